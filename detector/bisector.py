@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+"""
+Finds the commit introducing each source feature to a git repo, reading the
+c++ blobs of every probed commit straight from the object database instead of
+checking the commit out and running the detectors over the worktree.
+
+Only the first-parent chain of HEAD is bisected, so on histories with merges
+the commit found can differ from what `git bisect` reports: a feature brought
+in by a merged branch is attributed to the merge commit rather than to the
+branch commit introducing it.
+"""
+import argparse
+import json
+import logging
+import subprocess
+
+# imports from local libs
+from detectors import NamedCastDetector, SmartPointerDetector
+from scanner import CompiledPatterns, is_source_file
+
+# Git mode of symlinks, which grep -r over a worktree would skip.
+GIT_SYMLINK_MODE = b'120000'
+
+
+def source_regex_mapping():
+    """
+    Returns the feature -> regex mapping of every source detector.
+    """
+    regex_mapping = {}
+    regex_mapping.update(NamedCastDetector.regex_mapping)
+    regex_mapping.update(SmartPointerDetector.regex_mapping)
+    return regex_mapping
+
+
+class GitObjectReader:
+    """
+    Reads git objects through a single long lived `git cat-file --batch`.
+    """
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.process = subprocess.Popen(
+            ['git', '-C', repo_path, 'cat-file', '--batch'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, sha):
+        """
+        Returns the contents of the object with the given sha.
+        """
+        self.process.stdin.write(sha.encode('ascii') + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            raise ValueError('Could not read git object {}'.format(sha))
+        size = int(header[2])
+        data = self.process.stdout.read(size)
+        # Each object is followed by a newline.
+        self.process.stdout.read(1)
+        return data
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class GitBisector:
+    """
+    Counts feature occurrences at arbitrary commits of a repo without
+    touching its worktree, and bisects the first-parent history for the
+    commit each feature was introduced in.
+
+    Counts are memoized per blob, so a probe only scans the blobs that
+    changed since previously probed commits.
+    """
+
+    def __init__(self, repo_path, regex_mapping):
+        self.repo_path = repo_path
+        self.patterns = CompiledPatterns(regex_mapping)
+        self.reader = GitObjectReader(repo_path)
+        # Map from blob sha -> per feature counts.
+        self.blob_counts = {}
+        # Map from commit -> {feature: count}
+        self.commit_counts = {}
+
+    def _git(self, *args):
+        return subprocess.check_output(['git', '-C', self.repo_path] +
+                                       list(args))
+
+    def _source_blobs(self, rev):
+        """
+        Yields the shas of the c++ source blobs in the tree of rev.
+        """
+        output = self._git('ls-tree', '-r', '-z', '--full-tree', rev)
+        for entry in output.split(b'\0'):
+            if not entry:
+                continue
+            metadata, path = entry.split(b'\t', 1)
+            mode, object_type, sha = metadata.split()
+            if object_type != b'blob' or mode == GIT_SYMLINK_MODE:
+                continue
+            if is_source_file(path.decode('utf-8', 'surrogateescape')):
+                yield sha.decode('ascii')
+
+    def first_parent_history(self, rev='HEAD'):
+        """
+        Returns the commits along the first-parent chain of rev, oldest
+        first.
+        """
+        output = self._git('rev-list', '--first-parent', '--reverse', rev)
+        return output.decode('ascii').split()
+
+    def counts_at(self, rev):
+        """
+        Returns a mapping from each feature to its count of matching lines
+        in the tree of rev.
+        """
+        if rev in self.commit_counts:
+            return self.commit_counts[rev]
+
+        totals = [0] * len(self.patterns.features)
+        for sha in self._source_blobs(rev):
+            counts = self.blob_counts.get(sha)
+            if counts is None:
+                counts = self.patterns.count(self.reader.read(sha))
+                self.blob_counts[sha] = counts
+            totals = [total + count for total, count in zip(totals, counts)]
+
+        self.commit_counts[rev] = dict(zip(self.patterns.features, totals))
+        return self.commit_counts[rev]
+
+    def detected_at(self, rev, feature):
+        return self.counts_at(rev)[feature] > 0
+
+    def find_introduction(self, feature, commits):
+        """
+        Returns the first of commits (ordered oldest first) the feature is
+        detected in, assuming it stays detected from then on. None if it's
+        not detected in the newest commit or already detected in the oldest.
+        """
+        if not commits or not self.detected_at(commits[-1], feature):
+            return None
+        if self.detected_at(commits[0], feature):
+            return None
+
+        # Invariant: not detected at low, detected at high.
+        low, high = 0, len(commits) - 1
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.detected_at(commits[middle], feature):
+                high = middle
+            else:
+                low = middle
+        logging.info('Bisected %s to %s in %d probed commits', feature,
+                     commits[high], len(self.commit_counts))
+        return commits[high]
+
+    def run(self, features, rev='HEAD'):
+        """
+        Returns a mapping from each feature introduced within the history
+        of rev to the commit introducing it.
+        """
+        commits = self.first_parent_history(rev)
+        results = {}
+        for feature in features:
+            introduction_commit = self.find_introduction(feature, commits)
+            if introduction_commit:
+                results[feature] = introduction_commit
+        return results
+
+    def close(self):
+        self.reader.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repo_path', required=True,
+                        help='Path to the git repo to bisect. It does not '
+                        'need a checked out worktree.')
+    parser.add_argument('--rev', default='HEAD',
+                        help='Newest commit to bisect from. Default HEAD.')
+    parser.add_argument('--verbosity', default=2, type=int,
+                        help='Verbosity from 1 (least verbose) to 4. '
+                        'Default 2 (INFO)')
+    parser.add_argument('-o', '--override-feature-selected', action='append',
+                        help='Features to bisect, defaults to every source '
+                        'feature. i.e -o foo -o bar')
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.verbosity * 10)
+
+    regex_mapping = source_regex_mapping()
+    features = []
+    for feature in args.override_feature_selected or sorted(regex_mapping):
+        # Others, such as cpp_version, aren't detected from the source alone.
+        if feature not in regex_mapping:
+            logging.warning('Skipping %s, not a source feature.', feature)
+            continue
+        features.append(feature)
+
+    bisector = GitBisector(args.repo_path, dict(
+        (feature, regex_mapping[feature]) for feature in features))
+    try:
+        print(json.dumps(bisector.run(features, args.rev)))
+    finally:
+        bisector.close()
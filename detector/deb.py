@@ -0,0 +1,168 @@
+"""
+Contains a streaming reader for .deb packages, yielding the ELF objects of
+the package's data archive as in-memory buffers without extracting it.
+"""
+import logging
+import os.path
+import subprocess
+import tarfile
+import threading
+
+from elf import ELF_KIND_HEADER_SIZE, ELF_KINDS, ELF_MAGIC, parse_elf_kind
+
+AR_MAGIC = b'!<arch>\n'
+AR_HEADER_SIZE = 60
+AR_HEADER_END = b'`\n'
+DATA_MEMBER_PREFIX = 'data.tar'
+# tarfile stream modes for each data archive compression.
+TAR_STREAM_MODES = {
+    'data.tar': 'r|',
+    'data.tar.gz': 'r|gz',
+    'data.tar.bz2': 'r|bz2',
+    'data.tar.xz': 'r|xz',
+}
+ZSTD_DATA_MEMBER = 'data.tar.zst'
+# Bytes read per chunk when feeding the zstd decompressor.
+CHUNK_SIZE = 1024 * 1024
+
+
+class ArMemberReader:
+    """
+    File-like reader over a single member of an ar archive, so the member
+    can be streamed without reading it into memory.
+    """
+
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def _ar_members(fileobj):
+    """
+    Yields (name, size) for each member of the ar archive, leaving fileobj
+    positioned at the start of the member's data.
+    """
+    if fileobj.read(len(AR_MAGIC)) != AR_MAGIC:
+        raise ValueError('Not a .deb (ar) archive')
+    while True:
+        header = fileobj.read(AR_HEADER_SIZE)
+        if not header:
+            return
+        if len(header) != AR_HEADER_SIZE or header[58:] != AR_HEADER_END:
+            raise ValueError('Malformed ar member header')
+        name = header[:16].decode('ascii').strip().rstrip('/')
+        size = int(header[48:58].decode('ascii').strip())
+        start = fileobj.tell()
+        yield name, size
+        # Members are padded to an even size.
+        fileobj.seek(start + size + size % 2)
+
+
+def _iter_tar_elf_objects(tar, read_size=-1):
+    """
+    Yields (path, data) for every regular file in the tar starting with the
+    ELF magic, as find_elf_objects finds them in an extracted package. Hard
+    links to an ELF object, regular files once extracted, are yielded with
+    their target's data. read_size limits the bytes read of each.
+    """
+    # Map from path -> data of the ELF objects so far, for hard links.
+    elf_objects = {}
+    for member in tar:
+        name = os.path.normpath(member.name)
+        if member.islnk():
+            target = os.path.normpath(member.linkname)
+            if target in elf_objects:
+                yield name, elf_objects[target]
+            continue
+        if not member.isfile():
+            continue
+        fileobj = tar.extractfile(member)
+        magic = fileobj.read(len(ELF_MAGIC))
+        if magic != ELF_MAGIC:
+            continue
+        data = magic + fileobj.read(
+            read_size - len(magic) if read_size >= 0 else -1)
+        elf_objects[name] = data
+        yield name, data
+
+
+def _iter_zstd_elf_objects(member_reader, read_size):
+    """
+    Streams a zstd compressed data archive through the zstd tool, which
+    tarfile can't decompress itself.
+    """
+    process = subprocess.Popen(['zstd', '-dcq'], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+
+    def feed():
+        try:
+            chunk = member_reader.read(CHUNK_SIZE)
+            while chunk:
+                process.stdin.write(chunk)
+                chunk = member_reader.read(CHUNK_SIZE)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    try:
+        with tarfile.open(fileobj=process.stdout, mode='r|') as tar:
+            for elf_object in _iter_tar_elf_objects(tar, read_size):
+                yield elf_object
+    finally:
+        process.stdout.close()
+        feeder.join()
+        process.wait()
+
+
+def iter_deb_elf_objects(deb_path, read_size=-1):
+    """
+    Yields (path, data) for every ELF object in the .deb's data archive,
+    path being relative to the root the package installs into. Nothing is
+    written to disk. read_size, if given, limits the bytes read of each
+    object.
+    """
+    with open(deb_path, 'rb') as fh:
+        for name, size in _ar_members(fh):
+            if not name.startswith(DATA_MEMBER_PREFIX):
+                continue
+            member_reader = ArMemberReader(fh, size)
+            if name == ZSTD_DATA_MEMBER:
+                for elf_object in _iter_zstd_elf_objects(member_reader,
+                                                         read_size):
+                    yield elf_object
+            elif name in TAR_STREAM_MODES:
+                with tarfile.open(fileobj=member_reader,
+                                  mode=TAR_STREAM_MODES[name]) as tar:
+                    for elf_object in _iter_tar_elf_objects(tar, read_size):
+                        yield elf_object
+            else:
+                raise ValueError(
+                    'Unsupported data archive {} in {}'.format(name,
+                                                               deb_path))
+            return
+    logging.warning('No data archive found in %s', deb_path)
+
+
+def find_deb_elf_objects_by_kind(deb_path):
+    """
+    Like elf.find_elf_objects_by_kind for the package the .deb would
+    extract to, reading only the headers of its ELF objects.
+    """
+    elf_objects = dict((kind, []) for kind in ELF_KINDS)
+    for name, header in iter_deb_elf_objects(deb_path, ELF_KIND_HEADER_SIZE):
+        kind = parse_elf_kind(header)
+        if kind:
+            elf_objects[kind].append(name)
+    for paths in elf_objects.values():
+        paths.sort()
+    return elf_objects
@@ -0,0 +1,74 @@
+"""
+In-process entry point to the detectors, for callers running them on many
+packages without spawning runner.py and parsing its output for each.
+
+The config is chosen from the inputs given, as with the config variants the
+harness used to pick between:
+  - config.yaml: binary package and build log.
+  - config_no_log.yaml: binary package only.
+  - config_no_binary.yaml: build log only.
+  - config_no_binary_no_log.yaml: neither.
+"""
+import argparse
+import os.path
+
+# imports from local libs
+from runner import INPUT_ARGUMENTS, Runner
+
+DETECTOR_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(DETECTOR_DIRECTORY, 'config.yaml')
+CONFIG_NO_LOG_FILE = os.path.join(DETECTOR_DIRECTORY, 'config_no_log.yaml')
+CONFIG_NO_BINARY_FILE = os.path.join(DETECTOR_DIRECTORY,
+                                     'config_no_binary.yaml')
+CONFIG_NO_BINARY_NO_LOG_FILE = os.path.join(DETECTOR_DIRECTORY,
+                                            'config_no_binary_no_log.yaml')
+
+
+def select_config(has_binary, has_build_log):
+    """
+    Returns the path of the config whose detectors can run on a package
+    with the given inputs.
+    """
+    if has_binary:
+        return CONFIG_FILE if has_build_log else CONFIG_NO_LOG_FILE
+    return CONFIG_NO_BINARY_FILE if has_build_log else \
+        CONFIG_NO_BINARY_NO_LOG_FILE
+
+
+def detect(source_package_directory=None, source_package_dsc=None,
+           binary_package_directory=None, binary_package_path=None,
+           binary_name=None, build_log_path=None, features=None,
+           config_file=None, scan_workers=1, hardening_workers=1,
+           scan_cache=None):
+    """
+    Runs the detectors on a package, returning a mapping from feature to
+    its result, as runner.py prints.
+
+    The arguments match runner.py's flags. features defaults to the
+    config's features_selected, and config_file to the config matching the
+    inputs given. scan_cache is an optional open ScanCache. Raises
+    ValueError on missing or invalid inputs.
+    """
+    args = argparse.Namespace(
+        source_package_directory=source_package_directory,
+        source_package_dsc=source_package_dsc,
+        binary_package_directory=binary_package_directory,
+        binary_package_path=binary_package_path,
+        binary_name=binary_name,
+        build_log_path=build_log_path,
+        override_feature_selected=features,
+        config_file=config_file,
+        scan_workers=scan_workers,
+        hardening_workers=hardening_workers,
+        scan_cache_path=None)
+    if not any(getattr(args, name) for name in INPUT_ARGUMENTS):
+        raise ValueError('At least one of {} must be set.'.format(
+            ', '.join(INPUT_ARGUMENTS)))
+    if not config_file:
+        args.config_file = select_config(
+            bool(binary_package_directory or binary_package_path),
+            bool(build_log_path))
+
+    runner = Runner.create(args, scan_cache)
+    runner.setup()
+    return runner.run()
@@ -3,10 +3,10 @@ Contains the various detectors used to detect features within a packages
 binary and source.
 """
 
+import collections
 import logging
-import pkg_resources
+import os.path
 import re
-import subprocess
 
 
 class Detector:
@@ -47,6 +47,10 @@ class ASLRDetector(FlagDetector):
     def run(self, parsers, **kwargs):
         parser = parsers[self.parser_to_use]
         linking_results = parser.parse(stage='linker')
+        if not linking_results:
+            logging.warning('Detector %s found no linking line in the build '
+                            'log.', self.name)
+            return False
         detection_results = self.detect_feature(linking_results[0])
 
         logging.debug('Ran detector %s and detected feature? %s',
@@ -57,8 +61,37 @@ class ASLRDetector(FlagDetector):
 class CppVersionDetector(Detector):
     """
     Given the build logs, attempt to detect the c++ version compiled against.
+
+    The -std= of each compiler invocation is read off the build log parser's
+    invocation index, so the log is only tokenized once. Besides the
+    cpp_version summary, the lowest standard compiled against, the
+    cpp_version_histogram feature gives the number of invocations compiling
+    with each standard.
     """
 
+    # Standards the cpp_version summary is taken over.
+    summarized_standards = set([
+        'c++98', 'c++03', 'gnu++98', 'gnu++03',
+        'c++11', 'c++0x', 'gnu++11', 'gnu++0x',
+        'c++14', 'c++1y', 'gnu++14', 'gnu++1y',
+        'c++17', 'c++1z', 'gnu++17', 'gnu++1z',
+        'c++2a', 'gnu++2a'
+    ])
+    # The c++ standards -std= accepts. Others, such as the C standards of C
+    # compiler invocations or the 'gnu++11...' of a configure probe, aren't
+    # counted.
+    standard_regex = re.compile(
+        r'^(c|gnu)\+\+(98|03|0x|11|1y|14|1z|17|2a|20|2b|23|2c|26)$')
+    # Map from provisional standard names to the version they became.
+    standard_aliases = {
+        '0x': '11',
+        '1y': '14',
+        '1z': '17',
+        '2a': '20',
+        '2b': '23',
+        '2c': '26'
+    }
+
     def _clean_detection_results(self, results):
         version_mapping = {
             '98': 0,
@@ -89,53 +122,72 @@ class CppVersionDetector(Detector):
         else:
             return 'c++2a'
 
-    def detect_feature(self, compiler_lines):
-        stds_count = {
-            'c++98': 0,
-            'c++03': 0,
-            'gnu++98': 0,
-            'gnu++03': 0,
-            'c++11': 0,
-            'c++0x': 0,
-            'gnu++11': 0,
-            'gnu++0x': 0,
-            'c++14': 0,
-            'c++1y': 0,
-            'gnu++14': 0,
-            'gnu++1y': 0,
-            'c++17': 0,
-            'c++1z': 0,
-            'gnu++17': 0,
-            'gnu++1z': 0,
-            'c++2a': 0,
-            'gnu++2a': 0
+    @classmethod
+    def standard_histogram(cls, invocation_index):
+        """
+        Returns a mapping from each c++ standard compiler invocations pass
+        with -std= to the number of invocations passing it. An invocation
+        passing several counts towards the last, which is the one used.
+        """
+        histogram = {}
+        standard_counts = collections.Counter(invocation_index.stds)
+        for string_id, count in standard_counts.items():
+            if string_id == -1:
+                continue
+            standard = invocation_index.strings[string_id]
+            if cls.standard_regex.match(standard):
+                histogram[standard] = count
+        return histogram
+
+    def _histogram_results(self, histogram):
+        dialects = {'gnu': 0, 'iso': 0}
+        versions = set()
+        for standard, count in histogram.items():
+            dialect, version = standard.split('++', 1)
+            dialects['gnu' if dialect == 'gnu' else 'iso'] += count
+            versions.add(self.standard_aliases.get(version, version))
+        return {
+            'standards': histogram,
+            'dialects': dialects,
+            'mixed': 'yes' if len(versions) > 1 else 'no'
         }
 
-        for key in stds_count:
-            for line in compiler_lines:
-                if key in line:
-                    stds_count[key] += 1
-
-        results = list(filter(lambda x: stds_count[x] > 0, stds_count))
+    def detect_feature(self, histogram, compiler_lines):
+        results = [standard for standard in histogram
+                   if standard in self.summarized_standards]
 
         # If no results, use GCC version to infer C++ version.
         if len(results) == 0:
-            match = re.search(
-                r'g\+\+ \(= (?:[0-9]+:)?([0-9.]+).*\)', '\n'.join(compiler_lines))
-            if match and len(match.groups()) == 1:
-                version = match.groups()[0]
-                if pkg_resources.parse_version('6.1') < pkg_resources.parse_version(version):
-                    results = ['c++14']
-                else:
-                    results = ['c++03']
+            gpp_version_regex = re.compile(
+                r'g\+\+ \(= (?:[0-9]+:)?([0-9.]+).*\)')
+            for line in compiler_lines:
+                match = gpp_version_regex.search(line)
+                if match:
+                    # Only imported here, as it's slow to import.
+                    import pkg_resources
+                    version = match.groups()[0]
+                    if pkg_resources.parse_version('6.1') < pkg_resources.parse_version(version):
+                        results = ['c++14']
+                    else:
+                        results = ['c++03']
+                    break
 
         return results
 
     def run(self, parsers, **kwargs):
         parser = parsers[self.parser_to_use]
-        all_compiler_lines = parser.parse(stage='all')
-        logging.info('Found %d compiler lines', len(all_compiler_lines))
-        detection_results = self.detect_feature(all_compiler_lines)
+        histogram = self.standard_histogram(parser.invocation_index())
+        logging.info('Found %d c++ compiler invocations passing -std=',
+                     sum(histogram.values()))
+
+        if kwargs.get('feature') == 'cpp_version_histogram':
+            histogram_results = self._histogram_results(histogram)
+            logging.debug('Ran detector %s and detected feature? %s',
+                          self.name, histogram_results)
+            return histogram_results
+
+        detection_results = self.detect_feature(histogram,
+                                                parser.parse(stage='all'))
 
         if detection_results:
             logging.debug(
@@ -157,11 +209,20 @@ class CppVersionDetector(Detector):
 
 class HardeningDetector(FlagDetector):
     """
-    Returns signs of hardening on the binary
+    Returns signs of hardening on the binary, reported with the feature names
+    and results hardening-check uses. Each feature's <feature>_objects
+    counterpart gives its all/any/fraction aggregates and per-object results,
+    as for packages with several objects.
     """
 
-    def __init__(self, name, binary_path):
+    # Suffix of the features giving the aggregates of a hardening feature.
+    objects_feature_suffix = '_objects'
+
+    def __init__(self, name, binary_path, object_name=None):
         self.binary_path = binary_path
+        # Path of the binary within the package, naming its results.
+        self.object_name = object_name or (
+            os.path.basename(binary_path) if binary_path else None)
         self.cached_results = None
         self.feature_mapping = {
             'ro-relocation': 'Read-only relocations',
@@ -177,32 +238,32 @@ class HardeningDetector(FlagDetector):
     def detect_feature(self, source):
         pass
 
+    def _check_objects(self):
+        """
+        Returns a mapping from each object's path within the package to its
+        hardening-check style results.
+        """
+        # Only imported here, as it's only needed to check binaries.
+        from elf import check_hardening
+        return {self.object_name: check_hardening(self.binary_path)}
+
+    def _feature_results(self, feature):
+        from elf import combine_hardening, summarize_hardening
+        if feature.endswith(self.objects_feature_suffix):
+            feature = feature[:-len(self.objects_feature_suffix)]
+            return summarize_hardening(self.cached_results,
+                                       self.feature_mapping[feature])
+        return combine_hardening(self.cached_results,
+                                 self.feature_mapping[feature])
+
     def run(self, parsers, **kwargs):
-        if not self.cached_results:
-            command = 'hardening-check {}'.format(self.binary_path)
-            try:
-                output = subprocess.check_output(command, shell=True)
-            except subprocess.CalledProcessError as e:
-                # hardening-check returns exit code 1 if any of the
-                # protections are not enabled, so we have to ignore
-                # the exit status.
-                output = e.output
-
-            # Clean up output, looking for the line with the flag.
-            # Drop first and last newline, since don't contain hardening
-            # features
-            decoded_output = output.decode('utf-8').split('\n')[1:][:-1]
-            results = {}
-            for output in decoded_output:
-                feature, presence = output.split(':')
-                feature = feature.strip()
-                presence = presence.strip()
-                results[feature] = presence
-            self.cached_results = results
+        if self.cached_results is None:
+            self.cached_results = self._check_objects()
 
         if 'feature' in kwargs:
-            feature = kwargs['feature']
-            results = self.cached_results[self.feature_mapping[feature]]
+            results = self._feature_results(kwargs['feature'])
+        elif self.object_name:
+            results = self.cached_results[self.object_name]
         else:
             results = self.cached_results
 
@@ -211,54 +272,92 @@ class HardeningDetector(FlagDetector):
         return results
 
 
-GREP_ERROR = 2
-GREP_NOT_FOUND = 1
+class BatchHardeningDetector(HardeningDetector):
+    """
+    Returns signs of hardening for every ELF executable and shared object in
+    the binary package: for each feature the result of the least hardened
+    object, as a hardening-check string, with the per-object results under
+    <feature>_objects.
+    """
+
+    def __init__(self, name, binary_directory, workers=1):
+        self.binary_directory = binary_directory
+        self.workers = workers
+        super(BatchHardeningDetector, self).__init__(name, None)
+
+    def _check_objects(self):
+        from elf import check_hardening_batch, find_elf_objects
+        paths = find_elf_objects(self.binary_directory)
+        logging.info('Checking hardening of %d ELF objects', len(paths))
+        object_results = check_hardening_batch(paths, self.workers)
+        return dict(
+            (os.path.relpath(path, self.binary_directory), results)
+            for path, results in object_results.items())
 
 
-class NamedCastDetector(Detector):
+class DebHardeningDetector(BatchHardeningDetector):
     """
-    Returns signs of C++ named-cast usage in the source
+    Like the BatchHardeningDetector, reading the ELF objects straight out of
+    the .deb into memory rather than from an extracted package. Given the
+    binary_name, its path within the package, only that object is checked,
+    with results as the HardeningDetector's.
     """
 
-    def __init__(self, name, source_path):
+    def __init__(self, name, deb_path, workers=1, binary_name=None):
+        self.deb_path = deb_path
+        super(DebHardeningDetector, self).__init__(name, None, workers)
+        self.object_name = (os.path.normpath(binary_name) if binary_name
+                            else None)
+
+    def _check_objects(self):
+        # Only imported here, as tarfile is slow to import.
+        from deb import iter_deb_elf_objects
+        from elf import check_hardening_buffers
+        elf_objects = iter_deb_elf_objects(self.deb_path)
+        if self.object_name:
+            elf_objects = (elf_object for elf_object in elf_objects
+                           if elf_object[0] == self.object_name)
+        object_results = check_hardening_buffers(elf_objects, self.workers)
+        logging.info('Checked hardening of %d ELF objects in %s',
+                     len(object_results), self.deb_path)
+        if self.object_name and self.object_name not in object_results:
+            raise ValueError('No ELF object {} in {}'.format(
+                self.object_name, self.deb_path))
+        return object_results
+
+
+class SourceDetector(Detector):
+    """
+    A detector for regexes matched against the package source. Detectors
+    given the same scanner share a single walk of the source tree.
+    """
+
+    # Map from feature -> regex, provided by subclasses.
+    regex_mapping = {}
+
+    def __init__(self, name, source_path, scanner=None):
         self.source_path = source_path
-        self.regex_mapping = {
-            'const_cast': 'const_cast<.+>',
-            'dynamic_cast': 'dynamic_cast<.+>',
-            'static_cast': 'static_cast<.+>',
-            'reinterpret_cast': 'reinterpret_cast<.+>'
-        }
-        super(NamedCastDetector, self).__init__(name, None)
+        if scanner is None:
+            # Only imported here, as it's only needed to scan sources.
+            from scanner import SourceScanner
+            scanner = SourceScanner(source_path)
+        self.scanner = scanner
+        self.scanner.register(self.regex_mapping)
+        super(SourceDetector, self).__init__(name, None)
 
     def run(self, parsers, **kwargs):
 
         if 'feature' not in kwargs:
             raise ValueError('Expected feature to be explicitly specified.')
 
-        cast_type = kwargs['feature']
+        feature = kwargs['feature']
 
-        if cast_type not in self.regex_mapping:
+        if feature not in self.regex_mapping:
             raise ValueError(
-                'No matching regex for cast type {}'.format(cast_type))
-
-        # Use extended regex, include only c++ files, look in subdirs case-ins.
-        command = 'grep -ir --include *.h --include *.cpp -E "{}" {}'.format(
-            self.regex_mapping[cast_type], self.source_path)
-        try:
-            output = subprocess.check_output(command, shell=True)
-        except subprocess.CalledProcessError as e:
-            # Grep has exit status 1 if not found, and 2 if there's an error.
-            if e.returncode == GREP_ERROR:
-                raise Exception('Grep command ({}) failed'.format(command))
-            else:
-                assert(e.returncode == GREP_NOT_FOUND)
-                output = e.output
-
-        # Drop the last line since it'll be empty.
-        decoded_output = output.decode('utf-8').split('\n')[:-1]
+                'No matching regex for feature {}'.format(feature))
 
         # Count may be unreliable since a regex is fairly basic.
-        detected_count = len(decoded_output)
+        detected_count = self.scanner.count(feature)
 
         results = {
             'detected': 'yes' if detected_count else 'no',
@@ -270,60 +369,31 @@ class NamedCastDetector(Detector):
         return results
 
 
-class SmartPointerDetector(Detector):
+class NamedCastDetector(SourceDetector):
     """
-    Returns signs of C++ smart pointer usage in the source
+    Returns signs of C++ named-cast usage in the source
     """
 
-    def __init__(self, name, source_path):
-        self.source_path = source_path
-        self.regex_mapping = {
-            'unique_ptr': 'unique_ptr<.+>',
-            'shared_ptr': 'shared_ptr<.+>',
-            'weak_ptr': 'weak_ptr<.+>',
-            # Boost smart pointers (that don't conflict with stdlib)
-            'scoped_ptr': 'scoped_ptr<.+>',
-            'scoped_array': 'scoped_array<.+>',
-            'shared_array': 'shared_array<.+>',
-            'intrusive_ptr': 'intrusive_ptr<.+>',
-        }
-        super(SmartPointerDetector, self).__init__(name, None)
-
-    def run(self, parsers, **kwargs):
+    regex_mapping = {
+        'const_cast': 'const_cast<.+>',
+        'dynamic_cast': 'dynamic_cast<.+>',
+        'static_cast': 'static_cast<.+>',
+        'reinterpret_cast': 'reinterpret_cast<.+>'
+    }
 
-        if 'feature' not in kwargs:
-            raise ValueError('Expected feature to be explicitly specified.')
-
-        pointer_type = kwargs['feature']
-
-        if pointer_type not in self.regex_mapping:
-            raise ValueError(
-                'No matching regex for pointer type {}'.format(pointer_type))
-
-        # Use extended regex, include only c++ files, look in subdirs case-ins.
-        command = 'grep -ir --include *.h --include *.cpp -E "{}" {}'.format(
-            self.regex_mapping[pointer_type], self.source_path)
-        try:
-            output = subprocess.check_output(command, shell=True)
-        except subprocess.CalledProcessError as e:
-            # Grep has exit status 1 if not found, and 2 if there's an error.
-            if e.returncode == GREP_ERROR:
-                raise Exception('Grep command ({}) failed'.format(command))
-            else:
-                assert(e.returncode == GREP_NOT_FOUND)
-                output = e.output
-
-        # Drop the last line since it'll be empty.
-        decoded_output = output.decode('utf-8').split('\n')[:-1]
-
-        # Count may be unreliable since a regex is fairly basic.
-        detected_count = len(decoded_output)
 
-        results = {
-            'detected': 'yes' if detected_count else 'no',
-            'occurrences': detected_count
-        }
+class SmartPointerDetector(SourceDetector):
+    """
+    Returns signs of C++ smart pointer usage in the source
+    """
 
-        logging.debug('Ran detector %s and detected feature? %s',
-                      self.name, results)
-        return results
+    regex_mapping = {
+        'unique_ptr': 'unique_ptr<.+>',
+        'shared_ptr': 'shared_ptr<.+>',
+        'weak_ptr': 'weak_ptr<.+>',
+        # Boost smart pointers (that don't conflict with stdlib)
+        'scoped_ptr': 'scoped_ptr<.+>',
+        'scoped_array': 'scoped_array<.+>',
+        'shared_array': 'shared_array<.+>',
+        'intrusive_ptr': 'intrusive_ptr<.+>',
+    }
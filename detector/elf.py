@@ -0,0 +1,558 @@
+"""
+Contains a minimal ELF reader used to check binaries for hardening features
+in-process, reporting results in the same vocabulary as hardening-check.
+"""
+import logging
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+# e_type values.
+ET_REL = 1
+ET_EXEC = 2
+ET_DYN = 3
+
+# p_type values.
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_GNU_RELRO = 0x6474e552
+PF_X = 0x1
+
+# sh_type values.
+SHT_SYMTAB = 2
+SHT_DYNSYM = 11
+SHF_EXECINSTR = 0x4
+SHN_UNDEF = 0
+
+# d_tag values and flags.
+DT_NULL = 0
+DT_DEBUG = 21
+DT_BIND_NOW = 24
+DT_FLAGS = 30
+DT_FLAGS_1 = 0x6ffffffb
+DF_BIND_NOW = 0x8
+DF_1_NOW = 0x1
+DF_1_PIE = 0x08000000
+
+STACK_PROTECTOR_SYMBOLS = set([
+    '__stack_chk_fail', '__stack_chk_fail_local', '__intel_security_cookie'])
+
+# libc functions with a fortified __<name>_chk variant.
+FORTIFIABLE_FUNCTIONS = set([
+    'asprintf', 'confstr', 'dprintf', 'explicit_bzero', 'fdelt', 'fgets',
+    'fgets_unlocked', 'fgetws', 'fgetws_unlocked', 'fprintf', 'fread',
+    'fread_unlocked', 'fwprintf', 'getcwd', 'getdomainname', 'getgroups',
+    'gethostname', 'getlogin_r', 'gets', 'getwd', 'longjmp', 'mbsnrtowcs',
+    'mbsrtowcs', 'mbstowcs', 'memcpy', 'memmove', 'mempcpy', 'memset',
+    'obstack_printf', 'obstack_vprintf', 'poll', 'ppoll', 'pread',
+    'pread64', 'printf', 'ptsname_r', 'read', 'readlink', 'readlinkat',
+    'realpath', 'recv', 'recvfrom', 'snprintf', 'sprintf', 'stpcpy',
+    'stpncpy', 'strcat', 'strcpy', 'strncat', 'strncpy', 'swprintf',
+    'syslog', 'ttyname_r', 'vasprintf', 'vdprintf', 'vfprintf', 'vfwprintf',
+    'vprintf', 'vsnprintf', 'vsprintf', 'vswprintf', 'vsyslog', 'vwprintf',
+    'wcpcpy', 'wcpncpy', 'wcrtomb', 'wcscat', 'wcscpy', 'wcsncat',
+    'wcsncpy', 'wcsnrtombs', 'wcsrtombs', 'wcstombs', 'wctomb', 'wmemcpy',
+    'wmemmove', 'wmempcpy', 'wmemset', 'wprintf'])
+FORTIFIED_SYMBOL_REGEX = re.compile(r'^__(\w+)_chk$')
+
+# Instructions hardening-check looks for in the disassembly. The stack clash
+# probes are `or $0x0,<disp>(%rsp)` (with or without a REX prefix), the cfi
+# markers endbr64/endbr32.
+STACK_CLASH_PROBE_REGEX = re.compile(
+    b'\\x83\\x0c\\x24\\x00|\\x83\\x4c\\x24.\\x00|\\x83\\x8c\\x24....\\x00',
+    re.DOTALL)
+CFI_MARKER_REGEX = re.compile(b'\\xf3\\x0f\\x1e[\\xfa\\xfb]')
+
+# Size of the ELF identification plus e_type, enough to classify a file.
+ELF_TYPE_HEADER_SIZE = 18
+ELF32_HEADER_SIZE = 52
+ELF64_HEADER_SIZE = 64
+# Covers the ELF header and, in practice, the program headers following it,
+# enough to tell executables from shared objects.
+ELF_KIND_HEADER_SIZE = 4096
+
+# Kinds of ELF objects. PIE executables are ET_DYN like shared objects, told
+# apart by requesting a program interpreter.
+EXECUTABLE = 'executable'
+SHARED_OBJECT = 'shared_object'
+RELOCATABLE = 'relocatable'
+ELF_KINDS = [EXECUTABLE, SHARED_OBJECT, RELOCATABLE]
+
+# hardening-check's names for each feature it reports.
+RELRO_NAME = 'Read-only relocations'
+STACK_PROTECTOR_NAME = 'Stack protected'
+FORTIFY_NAME = 'Fortify Source functions'
+PIE_NAME = 'Position Independent Executable'
+BIND_NOW_NAME = 'Immediate binding'
+STACK_CLASH_NAME = 'Stack clash protection'
+CFI_NAME = 'Control flow integrity'
+
+
+class ElfFile:
+    """
+    Read-only view of the parts of an ELF object needed for hardening
+    checks. data is any bytes-like object holding the whole file, such as
+    a mmap.
+    """
+
+    def __init__(self, data):
+        if len(data) < 16 or data[:4] != ELF_MAGIC:
+            raise ValueError('Data is not an ELF object')
+        self.data = data
+        elf_class = data[4]
+        byte_order = data[5]
+        if elf_class not in (ELFCLASS32, ELFCLASS64):
+            raise ValueError('Unknown ELF class {}'.format(elf_class))
+        if byte_order not in (ELFDATA2LSB, ELFDATA2MSB):
+            raise ValueError('Unknown ELF byte order {}'.format(byte_order))
+        self.is_64 = elf_class == ELFCLASS64
+        self.endian = '<' if byte_order == ELFDATA2LSB else '>'
+
+        if self.is_64:
+            header_format = 'HHIQQQIHHHHHH'
+        else:
+            header_format = 'HHIIIIIHHHHHH'
+        (self.e_type, _, _, _, self.e_phoff, self.e_shoff, _, _,
+         self.e_phentsize, self.e_phnum, self.e_shentsize, self.e_shnum,
+         self.e_shstrndx) = self._unpack(header_format, 16)
+
+        self.program_headers = self._read_program_headers()
+        self.section_headers = self._read_section_headers()
+
+    @classmethod
+    def open(cls, path):
+        """
+        Returns an ElfFile over a read-only mmap of the file at path.
+        """
+        with open(path, 'rb') as fh:
+            try:
+                data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped.
+                raise ValueError('{} is not an ELF object'.format(path))
+        try:
+            return cls(data)
+        except ValueError:
+            data.close()
+            raise
+
+    def _unpack(self, fmt, offset):
+        fmt = self.endian + fmt
+        if offset < 0 or offset + struct.calcsize(fmt) > len(self.data):
+            raise ValueError('Truncated ELF object')
+        return struct.unpack_from(fmt, self.data, offset)
+
+    def _read_program_headers(self):
+        """
+        Returns a list of (p_type, p_flags, p_offset, p_filesz).
+        """
+        headers = []
+        for index in range(self.e_phnum):
+            offset = self.e_phoff + index * self.e_phentsize
+            if self.is_64:
+                (p_type, p_flags, p_offset, _, _, p_filesz, _,
+                 _) = self._unpack('IIQQQQQQ', offset)
+            else:
+                (p_type, p_offset, _, _, p_filesz, _, p_flags,
+                 _) = self._unpack('IIIIIIII', offset)
+            headers.append((p_type, p_flags, p_offset, p_filesz))
+        return headers
+
+    def _read_section_headers(self):
+        """
+        Returns a list of (sh_type, sh_flags, sh_offset, sh_size, sh_link,
+        sh_entsize).
+        """
+        headers = []
+        if not self.e_shoff:
+            return headers
+        for index in range(self.e_shnum):
+            offset = self.e_shoff + index * self.e_shentsize
+            if self.is_64:
+                (_, sh_type, sh_flags, _, sh_offset, sh_size, sh_link, _, _,
+                 sh_entsize) = self._unpack('IIQQQQIIQQ', offset)
+            else:
+                (_, sh_type, sh_flags, _, sh_offset, sh_size, sh_link, _, _,
+                 sh_entsize) = self._unpack('IIIIIIIIII', offset)
+            headers.append((sh_type, sh_flags, sh_offset, sh_size, sh_link,
+                            sh_entsize))
+        return headers
+
+    def has_segment(self, segment_type):
+        return any(header[0] == segment_type
+                   for header in self.program_headers)
+
+    def dynamic_entries(self):
+        """
+        Returns the (d_tag, d_val) entries of the dynamic segment.
+        """
+        entries = []
+        entry_format = 'qQ' if self.is_64 else 'iI'
+        entry_size = struct.calcsize(entry_format)
+        for p_type, _, p_offset, p_filesz in self.program_headers:
+            if p_type != PT_DYNAMIC:
+                continue
+            for offset in range(p_offset, p_offset + p_filesz, entry_size):
+                d_tag, d_val = self._unpack(entry_format, offset)
+                if d_tag == DT_NULL:
+                    break
+                entries.append((d_tag, d_val))
+        return entries
+
+    def _read_string(self, offset):
+        end = self.data.find(b'\0', offset)
+        if end == -1:
+            end = len(self.data)
+        return bytes(self.data[offset:end]).decode('utf-8', 'replace')
+
+    def symbols(self):
+        """
+        Returns a list of (name, is_undefined) for the symbols in the symbol
+        tables (.dynsym and, if not stripped, .symtab).
+        """
+        symbols = []
+        symbol_format = 'IBBHQQ' if self.is_64 else 'IIIBBH'
+        for sh_type, _, sh_offset, sh_size, sh_link, sh_entsize in (
+                self.section_headers):
+            if sh_type not in (SHT_SYMTAB, SHT_DYNSYM) or not sh_entsize:
+                continue
+            if sh_link >= len(self.section_headers):
+                continue
+            string_table_offset = self.section_headers[sh_link][2]
+            for offset in range(sh_offset, sh_offset + sh_size, sh_entsize):
+                fields = self._unpack(symbol_format, offset)
+                st_name = fields[0]
+                st_shndx = fields[3] if self.is_64 else fields[5]
+                if not st_name:
+                    continue
+                name = self._read_string(string_table_offset + st_name)
+                symbols.append((name, st_shndx == SHN_UNDEF))
+        return symbols
+
+    def executable_regions(self):
+        """
+        Returns the (offset, size) of the executable sections, falling back to
+        the executable segments if there are no section headers.
+        """
+        regions = [(sh_offset, sh_size)
+                   for sh_type, sh_flags, sh_offset, sh_size, _, _ in (
+                       self.section_headers)
+                   if sh_flags & SHF_EXECINSTR]
+        if not regions:
+            regions = [(p_offset, p_filesz)
+                       for p_type, p_flags, p_offset, p_filesz in (
+                           self.program_headers)
+                       if p_type == PT_LOAD and p_flags & PF_X]
+        return regions
+
+    def search_code(self, regex):
+        """
+        Returns whether regex matches within any executable region.
+        """
+        for offset, size in self.executable_regions():
+            if regex.search(self.data, offset, offset + size):
+                return True
+        return False
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+def _pie_result(elf_file, dynamic_entries):
+    if elf_file.e_type != ET_DYN:
+        return 'no, normal executable!'
+    flags_1 = 0
+    for d_tag, d_val in dynamic_entries:
+        if d_tag == DT_FLAGS_1:
+            flags_1 |= d_val
+    is_pie = (flags_1 & DF_1_PIE or elf_file.has_segment(PT_INTERP) or
+              any(d_tag == DT_DEBUG for d_tag, _ in dynamic_entries))
+    if is_pie:
+        return 'yes'
+    return 'no, regular shared library (ignored)'
+
+
+def _bind_now_result(dynamic_entries):
+    for d_tag, d_val in dynamic_entries:
+        if (d_tag == DT_BIND_NOW or
+                (d_tag == DT_FLAGS and d_val & DF_BIND_NOW) or
+                (d_tag == DT_FLAGS_1 and d_val & DF_1_NOW)):
+            return 'yes'
+    return 'no, not found!'
+
+
+def _fortify_result(symbols):
+    protected = set()
+    unprotected = set()
+    for name, is_undefined in symbols:
+        match = FORTIFIED_SYMBOL_REGEX.match(name)
+        if match and match.group(1) in FORTIFIABLE_FUNCTIONS:
+            protected.add(match.group(1))
+        elif is_undefined and name in FORTIFIABLE_FUNCTIONS:
+            unprotected.add(name)
+
+    if protected and unprotected:
+        return 'yes (some protected functions found)'
+    elif protected:
+        return 'yes'
+    elif unprotected:
+        return 'no, only unprotected functions found!'
+    return 'unknown, no protectable libc functions used'
+
+
+def check_elf_hardening(elf_file):
+    """
+    Returns a mapping from hardening-check's feature names to its result for
+    the ElfFile, i.e {'Stack protected': 'yes', ...}.
+    """
+    dynamic_entries = elf_file.dynamic_entries()
+    symbols = elf_file.symbols()
+    symbol_names = set(name for name, _ in symbols)
+
+    results = {}
+    results[PIE_NAME] = _pie_result(elf_file, dynamic_entries)
+    results[STACK_PROTECTOR_NAME] = (
+        'yes' if symbol_names & STACK_PROTECTOR_SYMBOLS else 'no, not found!')
+    results[FORTIFY_NAME] = _fortify_result(symbols)
+    results[RELRO_NAME] = (
+        'yes' if elf_file.has_segment(PT_GNU_RELRO) else 'no, not found!')
+    results[BIND_NOW_NAME] = _bind_now_result(dynamic_entries)
+    results[STACK_CLASH_NAME] = (
+        'yes' if elf_file.search_code(STACK_CLASH_PROBE_REGEX) else
+        'unknown, no -fstack-clash-protection instructions found')
+    results[CFI_NAME] = (
+        'yes' if elf_file.search_code(CFI_MARKER_REGEX) else
+        'unknown, no -fcf-protection instructions found!')
+    return results
+
+
+def check_hardening(path):
+    """
+    Returns the hardening-check style results for the binary at path.
+    """
+    elf_file = ElfFile.open(path)
+    try:
+        return check_elf_hardening(elf_file)
+    finally:
+        elf_file.close()
+
+
+def parse_elf_type(header):
+    """
+    Returns the e_type from the first bytes of an ELF object, or None if
+    they aren't the start of one.
+    """
+    if len(header) < ELF_TYPE_HEADER_SIZE or header[:4] != ELF_MAGIC:
+        return None
+    endian = '<' if header[5] == ELFDATA2LSB else '>'
+    return struct.unpack_from(endian + 'H', header, 16)[0]
+
+
+def read_elf_type(path):
+    """
+    Returns the e_type of the ELF object at path, or None if it isn't one.
+    Only reads the first few bytes of the file.
+    """
+    try:
+        with open(path, 'rb') as fh:
+            return parse_elf_type(fh.read(ELF_TYPE_HEADER_SIZE))
+    except IOError:
+        return None
+
+
+def _has_interpreter(header):
+    """
+    Returns whether the program headers within the first bytes of an ELF
+    object include a PT_INTERP.
+    """
+    is_64 = header[4] == ELFCLASS64
+    endian = '<' if header[5] == ELFDATA2LSB else '>'
+    if is_64:
+        if len(header) < ELF64_HEADER_SIZE:
+            return False
+        e_phoff, = struct.unpack_from(endian + 'Q', header, 32)
+        e_phentsize, e_phnum = struct.unpack_from(endian + 'HH', header, 54)
+    else:
+        if len(header) < ELF32_HEADER_SIZE:
+            return False
+        e_phoff, = struct.unpack_from(endian + 'I', header, 28)
+        e_phentsize, e_phnum = struct.unpack_from(endian + 'HH', header, 42)
+    for index in range(e_phnum):
+        offset = e_phoff + index * e_phentsize
+        if offset + 4 > len(header):
+            break
+        if struct.unpack_from(endian + 'I', header, offset)[0] == PT_INTERP:
+            return True
+    return False
+
+
+def parse_elf_kind(header):
+    """
+    Returns the kind of ELF object, one of ELF_KINDS, from its first bytes,
+    or None if they aren't the start of one of those.
+    """
+    e_type = parse_elf_type(header)
+    if e_type == ET_EXEC:
+        return EXECUTABLE
+    elif e_type == ET_DYN:
+        return EXECUTABLE if _has_interpreter(header) else SHARED_OBJECT
+    elif e_type == ET_REL:
+        return RELOCATABLE
+    return None
+
+
+def read_elf_kind(path):
+    """
+    Returns the kind of the ELF object at path, one of ELF_KINDS, or None if
+    it isn't one of those. Only reads the headers at the start of the file.
+    """
+    try:
+        with open(path, 'rb') as fh:
+            return parse_elf_kind(fh.read(ELF_KIND_HEADER_SIZE))
+    except IOError:
+        return None
+
+
+def _iter_files(root):
+    # Yields the paths of the regular files under root in sorted order.
+    # Symlinks are skipped so versioned library links aren't analyzed twice.
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if not os.path.islink(path) and os.path.isfile(path):
+                yield path
+
+
+def find_elf_objects(root, elf_types=(ET_EXEC, ET_DYN)):
+    """
+    Returns the paths of the ELF objects under root of the given types,
+    executables and shared objects by default. Symlinks are skipped.
+    """
+    return [path for path in _iter_files(root)
+            if read_elf_type(path) in elf_types]
+
+
+def find_elf_objects_by_kind(root):
+    """
+    Returns a mapping from each of ELF_KINDS to the sorted paths, relative to
+    root, of the ELF objects of that kind under root. Symlinks are skipped.
+    """
+    elf_objects = dict((kind, []) for kind in ELF_KINDS)
+    for path in _iter_files(root):
+        kind = read_elf_kind(path)
+        if kind:
+            elf_objects[kind].append(os.path.relpath(path, root))
+    for paths in elf_objects.values():
+        paths.sort()
+    return elf_objects
+
+
+def _check_hardening_or_none(path):
+    try:
+        return path, check_hardening(path)
+    except (IOError, ValueError) as e:
+        logging.warning('Could not check hardening of %s: %s', path, e)
+        return path, None
+
+
+def check_hardening_batch(paths, workers=1):
+    """
+    Returns a mapping from each path to its hardening-check style results,
+    checking the objects across a pool of workers processes. Objects that
+    fail to parse are left out.
+    """
+    if workers > 1 and len(paths) > 1:
+        with multiprocessing.Pool(min(workers, len(paths))) as pool:
+            results = pool.map(_check_hardening_or_none, paths)
+    else:
+        results = [_check_hardening_or_none(path) for path in paths]
+    return dict((path, object_results) for path, object_results in results
+                if object_results is not None)
+
+
+def _check_buffer_hardening_or_none(elf_object):
+    name, data = elf_object
+    try:
+        return name, check_elf_hardening(ElfFile(data))
+    except ValueError as e:
+        logging.warning('Could not check hardening of %s: %s', name, e)
+        return name, None
+
+
+def check_hardening_buffers(elf_objects, workers=1, elf_types=(ET_EXEC,
+                                                                ET_DYN)):
+    """
+    Like check_hardening_batch, for an iterable of in-memory (name, data)
+    objects. Only objects of the given types are checked.
+    """
+    elf_objects = (elf_object for elf_object in elf_objects
+                   if parse_elf_type(elf_object[1][:ELF_TYPE_HEADER_SIZE])
+                   in elf_types)
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            results = list(pool.imap_unordered(
+                _check_buffer_hardening_or_none, elf_objects))
+    else:
+        results = [_check_buffer_hardening_or_none(elf_object)
+                   for elf_object in elf_objects]
+    return dict((name, object_results) for name, object_results in results
+                if object_results is not None)
+
+
+def summarize_hardening(object_results, feature_name):
+    """
+    Aggregates a single hardening-check feature over many objects, given
+    the mapping from object -> results check_hardening_batch returns.
+
+    An object counts as hardened if its result starts with 'yes'. Results
+    hardening-check marks as ignored, such as PIE for shared libraries,
+    don't count towards the aggregate.
+    """
+    objects = dict((path, results[feature_name])
+                   for path, results in object_results.items())
+    applicable = [result for result in objects.values()
+                  if not result.endswith('(ignored)')]
+    hardened = [result for result in applicable if result.startswith('yes')]
+    return {
+        'all': 'yes' if applicable and len(hardened) == len(applicable)
+        else 'no',
+        'any': 'yes' if hardened else 'no',
+        'fraction': (float(len(hardened)) / len(applicable) if applicable
+                     else None),
+        'objects': objects
+    }
+
+
+def combine_hardening(object_results, feature_name):
+    """
+    Returns a single hardening-check result for a feature over many
+    objects, given the mapping from object -> results check_hardening_batch
+    returns: the first object's if all it applies to are hardened, as
+    summarize_hardening's 'all' counts them, otherwise the least hardened
+    object's, 'no' results before 'unknown' ones. For a single object,
+    that's its own result.
+    """
+    results = [object_results[path][feature_name]
+               for path in sorted(object_results)]
+    if not results:
+        return 'unknown, no ELF objects found'
+    applicable = [result for result in results
+                  if not result.endswith('(ignored)')]
+    if not applicable:
+        return results[0]
+    unhardened = [result for result in applicable
+                  if not result.startswith('yes')]
+    if not unhardened:
+        return applicable[0]
+    return min(unhardened, key=lambda result: not result.startswith('no'))
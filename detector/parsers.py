@@ -1,10 +1,309 @@
 """
 Contains parsers used to support the detectors detecting features.
 """
+import collections
 import logging
 import os.path
+import shlex
 import subprocess
 import re
+from array import array
+
+# Stages a compiler invocation is classified as.
+COMPILE = 'compile'
+LINK = 'link'
+OTHER = 'other'
+STAGES = [COMPILE, LINK, OTHER]
+
+# Cheap check for a line mentioning a gcc/clang driver, i.e g++, gcc-8,
+# /usr/bin/c++ or x86_64-linux-gnu-g++, before it's shell split. Whether the
+# driver is actually run is then decided by compiler_argv.
+COMPILER_LINE_REGEX = re.compile(
+    r'(?:^|[\s/;&|(])(?:[\w.+-]+-)?(?:g\+\+|gcc|c\+\+|cc|clang\+\+|clang)'
+    r'(?:-[0-9.]+)?(?=\s)')
+COMPILER_REGEX = re.compile(
+    r'^(?:[\w.+-]+-)?(?:g\+\+|gcc|c\+\+|cc|clang\+\+|clang)(?:-[0-9.]+)?$')
+# Driver options whose argument is the following argv entry.
+OPTIONS_WITH_ARGUMENT = set([
+    '-o', '-I', '-L', '-D', '-U', '-x', '-include', '-imacros', '-isystem',
+    '-iquote', '-idirafter', '-MF', '-MT', '-MQ', '-Xlinker', '-Xassembler',
+    '-Xpreprocessor', '--param', '-T', '-z', '-aux-info', '-arch'])
+# Characters of the shell operators a command line is split at.
+SHELL_OPERATOR_CHARS = '();<>|&'
+# The lines configure prints for its probes, i.e 'checking whether g++
+# accepts -g... yes', which mention the driver without running it.
+CONFIGURE_CHECK_REGEX = re.compile(r'^\s*checking\s')
+# Commands the driver is run through, i.e 'ccache g++ ...'.
+COMPILER_LAUNCHERS = set(['ccache', 'distcc'])
+# The libtool modes running the driver, as in 'libtool --tag=CXX
+# --mode=compile g++ ...', and the prefixes of the commands libtool echoes,
+# as in 'libtool: compile:  g++ ...'.
+LIBTOOL_MODES = set(['--mode=compile', '--mode=link'])
+LIBTOOL_ECHO_PREFIXES = [['libtool:', 'compile:'], ['libtool:', 'link:']]
+# Matches the shell words and operators of a command line, following POSIX
+# quoting. An unbalanced quote is matched on its own.
+SHELL_TOKEN_REGEX = re.compile(r'''
+    [();<>|&]+
+  | (?:[^\s'"\\();<>|&]+|'[^']*'|"(?:[^"\\]|\\.)*"|\\.)+
+  | ['"\\]
+''', re.VERBOSE | re.DOTALL)
+# Any character needing more than a split on whitespace.
+SHELL_SPECIAL_CHAR_REGEX = re.compile(r'''['"\\();<>|&]''')
+# The quoted and escaped parts of a shell word.
+SHELL_QUOTING_REGEX = re.compile(
+    r''''([^']*)'|"((?:[^"\\]|\\.)*)"|\\(.)''', re.DOTALL)
+# Characters a backslash escapes within double quotes.
+DOUBLE_QUOTE_ESCAPE_REGEX = re.compile(r'\\([\\"$`])')
+# Options making the driver stop before linking.
+NO_LINK_OPTIONS = set(['-S', '-E', '-M', '-MM'])
+# Prefixes of the flags captured in the index.
+CAPTURED_FLAG_PREFIXES = ('-std=', '-f', '-D', '-Wl,')
+
+CompilerInvocation = collections.namedtuple(
+    'CompilerInvocation',
+    ['line_number', 'stage', 'argv', 'output', 'std', 'flags'])
+
+
+def _unquote(match):
+    single_quoted, double_quoted, escaped = match.groups()
+    if single_quoted is not None:
+        return single_quoted
+    if double_quoted is not None:
+        return DOUBLE_QUOTE_ESCAPE_REGEX.sub(r'\1', double_quoted)
+    return escaped
+
+
+def split_command(line):
+    """
+    Splits line into words following POSIX shell quoting, keeping operators
+    such as && and ; as separate entries. Falls back to splitting on
+    whitespace if the quoting is unbalanced, as in lines make truncated.
+
+    A regex does the splitting as shlex is too slow for large build logs.
+    """
+    if not SHELL_SPECIAL_CHAR_REGEX.search(line):
+        return line.split()
+
+    tokens = SHELL_TOKEN_REGEX.findall(line)
+    for index, token in enumerate(tokens):
+        if token in ('"', "'", '\\'):
+            return line.split()
+        if '"' in token or "'" in token or '\\' in token:
+            tokens[index] = SHELL_QUOTING_REGEX.sub(_unquote, token)
+    return tokens
+
+
+def _is_command_position(tokens, index):
+    """
+    Returns whether tokens[index] is run as a command: first on the line,
+    after a shell operator or a launcher such as ccache, or run by libtool
+    in compile or link mode.
+    """
+    if index == 0:
+        return True
+    previous = tokens[index - 1]
+    if (not previous.strip(SHELL_OPERATOR_CHARS) or
+            os.path.basename(previous) in COMPILER_LAUNCHERS):
+        return True
+    if tokens[max(index - 2, 0):index] in LIBTOOL_ECHO_PREFIXES:
+        return True
+    # libtool's options, i.e --tag=CXX --mode=compile, up to the driver.
+    options_start = index
+    while options_start > 0 and tokens[options_start - 1].startswith('--'):
+        options_start -= 1
+    return (options_start > 0 and
+            os.path.basename(tokens[options_start - 1]) == 'libtool' and
+            any(token in LIBTOOL_MODES
+                for token in tokens[options_start:index]))
+
+
+def compiler_argv(line):
+    """
+    Returns the argv of the compiler invoked on the line, from the driver up
+    to the next shell operator, or None if the line doesn't invoke one. The
+    driver must be in command position, so mentions of it, as in configure's
+    probes, aren't taken for invocations.
+    """
+    if CONFIGURE_CHECK_REGEX.match(line):
+        return None
+    tokens = split_command(line)
+    for start, token in enumerate(tokens):
+        if (COMPILER_REGEX.match(os.path.basename(token)) and
+                _is_command_position(tokens, start)):
+            break
+    else:
+        return None
+
+    argv = [tokens[start]]
+    for token in tokens[start + 1:]:
+        if token and not token.strip(SHELL_OPERATOR_CHARS):
+            break
+        argv.append(token)
+    # Bare mentions of a compiler, i.e 'g++ (= 4:8.3.0-1)' in the list of
+    # installed build dependencies, aren't invocations.
+    return argv if len(argv) > 1 else None
+
+
+class CompilerInvocationIndex:
+    """
+    An index of the compiler invocations in a build log.
+
+    Invocations are kept in flat arrays rather than an object per
+    invocation, with every argv entry interned in a single string table, so
+    that logs of hundreds of MB stay compact in memory. Invocations can be
+    looked up by stage or by a captured flag (-std=, -f*, -D and -Wl,)
+    without re-reading the log.
+    """
+
+    def __init__(self):
+        # Interned strings, referenced by their index in the table.
+        self.strings = []
+        self.string_ids = {}
+        # Per invocation, indexed by invocation number.
+        self.line_numbers = array('L')
+        self.stages = array('B')
+        # Interned -o target and -std= value, -1 if absent.
+        self.outputs = array('l')
+        self.stds = array('l')
+        # The argv and captured flags of invocation i are
+        # argv_ids[argv_offsets[i]:argv_offsets[i + 1]] and likewise for
+        # flag_ids.
+        self.argv_offsets = array('L', [0])
+        self.argv_ids = array('L')
+        self.flag_offsets = array('L', [0])
+        self.flag_ids = array('L')
+        # Map from stage -> invocation numbers.
+        self.stage_postings = dict((stage, array('L')) for stage in STAGES)
+        # Map from interned flag -> invocation numbers.
+        self.flag_postings = {}
+
+    def __len__(self):
+        return len(self.stages)
+
+    def _intern(self, string):
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.string_ids[string] = string_id
+        return string_id
+
+    @staticmethod
+    def classify(argv):
+        """
+        Returns a tuple of the stage, -o target, -std= value and captured
+        flags of the invocation.
+        """
+        compiles = False
+        stops_before_link = False
+        has_input = False
+        output = None
+        std = None
+        flags = []
+
+        arguments = iter(argv[1:])
+        for argument in arguments:
+            if argument in OPTIONS_WITH_ARGUMENT:
+                value = next(arguments, '')
+                if argument == '-o':
+                    output = value
+                elif argument == '-D':
+                    flags.append('-D' + value)
+                continue
+
+            if argument == '-c':
+                compiles = True
+            elif argument in NO_LINK_OPTIONS:
+                stops_before_link = True
+            elif argument.startswith('-o'):
+                output = argument[2:]
+            elif not argument.startswith('-'):
+                has_input = True
+
+            if argument.startswith('-std='):
+                # As with the driver, the last -std= wins.
+                std = argument[len('-std='):]
+            if argument.startswith(CAPTURED_FLAG_PREFIXES):
+                flags.append(argument)
+
+        if stops_before_link:
+            stage = OTHER
+        elif compiles:
+            stage = COMPILE
+        elif has_input or output:
+            stage = LINK
+        else:
+            stage = OTHER
+        return stage, output, std, flags
+
+    def add(self, line_number, argv):
+        """
+        Adds the invocation with the given argv, from the given line of the
+        log.
+        """
+        stage, output, std, flags = self.classify(argv)
+        invocation = len(self.stages)
+
+        self.line_numbers.append(line_number)
+        self.stages.append(STAGES.index(stage))
+        self.outputs.append(self._intern(output) if output is not None
+                            else -1)
+        self.stds.append(self._intern(std) if std is not None else -1)
+        self.argv_ids.extend(self._intern(argument) for argument in argv)
+        self.argv_offsets.append(len(self.argv_ids))
+
+        self.stage_postings[stage].append(invocation)
+        for flag in flags:
+            flag_id = self._intern(flag)
+            self.flag_ids.append(flag_id)
+            postings = self.flag_postings.get(flag_id)
+            if postings is None:
+                postings = self.flag_postings[flag_id] = array('L')
+            # A flag repeated within an invocation is only posted once.
+            if not postings or postings[-1] != invocation:
+                postings.append(invocation)
+        self.flag_offsets.append(len(self.flag_ids))
+
+    def __getitem__(self, invocation):
+        output = self.outputs[invocation]
+        std = self.stds[invocation]
+        return CompilerInvocation(
+            self.line_numbers[invocation],
+            STAGES[self.stages[invocation]],
+            [self.strings[string_id] for string_id in self.argv_ids[
+                self.argv_offsets[invocation]:
+                self.argv_offsets[invocation + 1]]],
+            self.strings[output] if output != -1 else None,
+            self.strings[std] if std != -1 else None,
+            [self.strings[string_id] for string_id in self.flag_ids[
+                self.flag_offsets[invocation]:
+                self.flag_offsets[invocation + 1]]])
+
+    def find(self, stage=None, flag=None):
+        """
+        Returns the numbers of the invocations in the given stage (one of
+        STAGES) and/or passing the given captured flag, in log order.
+        """
+        if stage is not None and stage not in self.stage_postings:
+            raise ValueError('Unknown stage {}'.format(stage))
+        if flag is not None:
+            flag_id = self.string_ids.get(flag)
+            postings = self.flag_postings.get(flag_id, array('L'))
+            if stage is None:
+                return list(postings)
+            stage_code = STAGES.index(stage)
+            return [invocation for invocation in postings
+                    if self.stages[invocation] == stage_code]
+        if stage is not None:
+            return list(self.stage_postings[stage])
+        return list(range(len(self)))
+
+    def command_line(self, invocation):
+        """
+        Returns the invocation's argv joined back into a command line.
+        """
+        return ' '.join(shlex.quote(argument)
+                        for argument in self[invocation].argv)
 
 
 class BuildLogParser:
@@ -19,12 +318,16 @@ class BuildLogParser:
         self.parser_ready = False
         # lines prefixing g++
         self.compiler_lines = []
+        # Index of every compiler invocation in the log.
+        self.invocations = CompilerInvocationIndex()
+        # The following are built from the index on first use.
         # lines that compile into object files.
-        self.object_file_lines = []
-        # lines containing the final binary created (-o [binaryname])
-        self.linker_lines = []
-        # other g++ prefix lines not either of those two.
-        self.other_lines = []
+        self.object_file_lines = None
+        # lines containing the final binary created (-o [binaryname]), or
+        # every link without a binary name.
+        self.linker_lines = None
+        # other compiler lines not either of those two.
+        self.other_lines = None
         logging.info('Parsers %s was created.', self.name)
 
     def _setup_parser(self):
@@ -43,15 +346,31 @@ class BuildLogParser:
             gpp_package_version_regex = re.compile(r"g\+\+ \(= .*\)")
 
             with open(self.build_log_path, 'r', errors='ignore') as fh:
-                line = fh.readline()
-                while line != '':
+                for line_number, line in enumerate(fh, 1):
                     if (cpp_version_regex.search(line) or
                         gpp_package_version_regex.search(line)):
                         self.compiler_lines.append(line)
-                    line = fh.readline()
+                    if COMPILER_LINE_REGEX.search(line):
+                        argv = compiler_argv(line)
+                        if argv:
+                            self.invocations.add(line_number, argv)
 
             self.parser_ready = True
-            logging.info('Parsers %s was setup.', self.name)
+            logging.info('Parsers %s was setup, indexing %d compiler '
+                         'invocations.', self.name, len(self.invocations))
+
+    def _is_binary_link(self, invocation):
+        if not self.binary_name:
+            return True
+        output = self.invocations[invocation].output
+        # The binary name may be its path within the package, i.e usr/bin/foo,
+        # while the link writes it within the build tree.
+        return bool(output) and (os.path.basename(output) ==
+                                 os.path.basename(self.binary_name))
+
+    def _command_lines(self, invocations):
+        return [self.invocations.command_line(invocation)
+                for invocation in invocations]
 
     def _get_compiler_calls(self, stage):
         """
@@ -63,14 +382,24 @@ class BuildLogParser:
         """
         stage = stage.lower()
         if stage == 'linker':
-            if len(self.linker_lines) > 1:
-                logging.warning('Expected only a single linking',
-                                'line with the binary name. Instead found %d',
-                                len(self.linker_lines))
+            if self.linker_lines is None:
+                self.linker_lines = self._command_lines(
+                    invocation for invocation in self.invocations.find(LINK)
+                    if self._is_binary_link(invocation))
+                if self.binary_name and len(self.linker_lines) > 1:
+                    logging.warning('Expected only a single linking line '
+                                    'with the binary name. Instead found %d',
+                                    len(self.linker_lines))
             return self.linker_lines
         elif stage == 'objects':
+            if self.object_file_lines is None:
+                self.object_file_lines = self._command_lines(
+                    self.invocations.find(COMPILE))
             return self.object_file_lines
         elif stage == 'others':
+            if self.other_lines is None:
+                self.other_lines = self._command_lines(
+                    self.invocations.find(OTHER))
             return self.other_lines
         else:
             return self.compiler_lines
@@ -89,6 +418,14 @@ class BuildLogParser:
             self._setup_parser()
         return self._get_compiler_calls(kwargs['stage'])
 
+    def invocation_index(self):
+        """
+        Returns the CompilerInvocationIndex of the build log.
+        """
+        if not self.parser_ready:
+            self._setup_parser()
+        return self.invocations
+
 
 class RulesFlagParser:
     """
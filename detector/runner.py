@@ -1,28 +1,47 @@
 #!/usr/bin/python3
 import argparse
+import copy
 import logging
 import json
-import os.path
-import yaml
+import os
+import signal
+import sys
 
 # imports from local libs
 from parsers import BuildLogParser, RulesFlagParser
-from detectors import ASLRDetector, HardeningDetector, NamedCastDetector, SmartPointerDetector, CppVersionDetector
+from runner_config import load_config
+
+# The detectors, ELF reader, source scanner and scan cache are imported where
+# they're used, so a run only pays for importing the ones it needs, i.e a
+# build log run imports neither multiprocessing nor sqlite3.
+
+# Flags giving the package to run on, at least one of which must be set.
+INPUT_ARGUMENTS = ['binary_package_directory', 'binary_package_path',
+                   'source_package_directory', 'source_package_dsc',
+                   'build_log_path']
+# Worker job keys describing the package, unset unless the job sets them.
+PACKAGE_ARGUMENTS = INPUT_ARGUMENTS + ['binary_name',
+                                       'override_feature_selected']
+# Worker job keys defaulting to the worker's own flags.
+WORKER_ARGUMENTS = ['config_file', 'scan_workers', 'hardening_workers']
 
 
 class Runner:
 
     @classmethod
-    def create(cls, args):
+    def create(cls, args, scan_cache=None):
         """
         Use this classmethod to construct the class.
 
         If does validation of arguments, and raises errors if incorrect.
+        scan_cache, if given, is used instead of opening args.scan_cache_path.
         """
         config_filepath = args.config_file
         binary_name = args.binary_name
         binary_directory = args.binary_package_directory
+        binary_package_path = args.binary_package_path
         source_directory = args.source_package_directory
+        source_package_dsc = args.source_package_dsc
         build_log_path = args.build_log_path
 
         # Validates the existence of these paths, and correct node types.
@@ -42,6 +61,14 @@ class Runner:
             raise ValueError('binary_directory %s does not exists.',
                              binary_directory)
 
+        if binary_package_path and not os.path.exists(binary_package_path):
+            raise ValueError('binary_package_path %s does not exists.',
+                             binary_package_path)
+
+        if source_package_dsc and not os.path.exists(source_package_dsc):
+            raise ValueError('source_package_dsc %s does not exists.',
+                             source_package_dsc)
+
         if not os.path.isfile(config_filepath):
             raise ValueError('config_filepath %s is not a file.',
                              config_filepath)
@@ -50,6 +77,14 @@ class Runner:
             raise ValueError('build_log_path %s is not a file.',
                              build_log_path)
 
+        if binary_package_path and not os.path.isfile(binary_package_path):
+            raise ValueError('binary_package_path %s is not a file.',
+                             binary_package_path)
+
+        if source_package_dsc and not os.path.isfile(source_package_dsc):
+            raise ValueError('source_package_dsc %s is not a file.',
+                             source_package_dsc)
+
         if binary_directory and not os.path.isdir(binary_directory):
             raise ValueError('binary_directory %s is not a dir.',
                              binary_directory)
@@ -63,16 +98,43 @@ class Runner:
         if source_directory and source_directory[-1] != '/':
             source_directory += '/'
 
+        if args.scan_workers < 0:
+            raise ValueError('scan_workers %d must not be negative.',
+                             args.scan_workers)
+
+        if args.hardening_workers < 0:
+            raise ValueError('hardening_workers %d must not be negative.',
+                             args.hardening_workers)
+
+        if scan_cache is None and args.scan_cache_path:
+            from scan_cache import ScanCache
+            scan_cache = ScanCache(args.scan_cache_path,
+                                   args.scan_cache_size_mb * 1024 * 1024)
+
         return cls(config_filepath, binary_directory, source_directory,
-                   binary_name, args.override_feature_selected, build_log_path)
+                   binary_name, args.override_feature_selected, build_log_path,
+                   args.scan_workers, scan_cache, args.hardening_workers,
+                   binary_package_path, source_package_dsc)
 
     def __init__(self, config_filepath, binary_directory, source_directory,
-                 binary_name, preselected_features, build_log_path):
+                 binary_name, preselected_features, build_log_path,
+                 scan_workers=1, scan_cache=None, hardening_workers=1,
+                 binary_package_path=None, source_package_dsc=None):
         self.config_filepath = config_filepath
         self.binary_directory = binary_directory
         self.source_directory = source_directory
         self.binary_name = binary_name
         self.build_log_path = build_log_path
+        # .deb read in memory instead of an extracted binary_directory.
+        self.binary_package_path = binary_package_path
+        # Source package .dsc whose tarballs are scanned in place of an
+        # unpacked source_directory.
+        self.source_package_dsc = source_package_dsc
+        self.scan_workers = scan_workers
+        self.scan_cache = scan_cache
+        # Number of processes ELF objects are checked across in batch mode;
+        # 0 uses every core.
+        self.hardening_workers = hardening_workers or os.cpu_count()
 
         # Mapping from 'name' -> instantiated class
         self.detector_mapping = {}
@@ -80,42 +142,60 @@ class Runner:
         # Map from feature to detector that generates the feature.
         self.feature_to_detector_mapping = {}
         self.selected_features = preselected_features
+        # Scanner shared by the source detectors, so the source tree is only
+        # walked once for all of their features.
+        self.source_scanner = None
 
     def _create_detector(self, detector_config, parser_configs):
         """
         Creates the detector and dependency parsers specified in the
         detector_config. Adds the detectors/parsers to the mapping.
         """
+        from detectors import (
+            ASLRDetector, BatchHardeningDetector, CppVersionDetector,
+            DebHardeningDetector, HardeningDetector, NamedCastDetector,
+            SmartPointerDetector)
+
         detector_type = detector_config['type']
         name = detector_config['name']
         parser_name = detector_config['parser_to_use']
 
         # TODO(kbaichoo): make this more general / less brittle.
         # Set up the detector
-        if detector_type == 'ALSRDetector':
+        if detector_type == 'ASLRDetector':
             self.detector_mapping[name] = ASLRDetector(
                 name, parser_name)
         elif detector_type == 'HardeningDetector':
-            if not self.binary_directory:
+            if not self.binary_directory and not self.binary_package_path:
                 raise ValueError(
-                    'Binary Directory necessary for the HardeningDetector')
-
-            binary_path = os.path.join(
-                self.binary_directory, self.binary_name)
-            self.detector_mapping[name] = HardeningDetector(
-                name, binary_path)
+                    'Binary Directory or package necessary for the '
+                    'HardeningDetector')
+
+            # Without a binary name check every ELF object in the package.
+            if self.binary_package_path:
+                self.detector_mapping[name] = DebHardeningDetector(
+                    name, self.binary_package_path, self.hardening_workers,
+                    self.binary_name)
+            elif self.binary_name:
+                binary_path = os.path.join(
+                    self.binary_directory, self.binary_name)
+                self.detector_mapping[name] = HardeningDetector(
+                    name, binary_path, self.binary_name)
+            else:
+                self.detector_mapping[name] = BatchHardeningDetector(
+                    name, self.binary_directory, self.hardening_workers)
         elif detector_type == 'NamedCastDetector':
-            if not self.source_directory:
+            if not self.source_directory and not self.source_package_dsc:
                 raise ValueError(
-                    'Source Dir necessary for the NamedCastDetector')
+                    'Source Dir or dsc necessary for the NamedCastDetector')
             self.detector_mapping[name] = NamedCastDetector(
-                name, self.source_directory)
+                name, self.source_directory, self.source_scanner)
         elif detector_type == 'SmartPointerDetector':
-            if not self.source_directory:
+            if not self.source_directory and not self.source_package_dsc:
                 raise ValueError(
-                    'Source Dir necessary for the SmartPointerDetector')
+                    'Source Dir or dsc necessary for the SmartPointerDetector')
             self.detector_mapping[name] = SmartPointerDetector(
-                name, self.source_directory)
+                name, self.source_directory, self.source_scanner)
         elif detector_type == 'CppVersionDetector':
             if not self.build_log_path:
                 raise ValueError(
@@ -166,38 +246,49 @@ class Runner:
                      '(binary, source) directories: %s, %s',
                      self.config_filepath, self.binary_directory,
                      self.source_directory)
-        with open(self.config_filepath) as f:
-            config_data = yaml.load(f, Loader=yaml.FullLoader)
-
-            # Create a mapping from detector features provided to the
-            # detector that provides it.
-            for detector_config_mapping in config_data['detectors']:
-                detector_config = detector_config_mapping['detector']
-
-                for feature in detector_config['features_provided']:
-                    self.feature_to_detector_mapping[feature] = (
-                        detector_config['name'])
-
-            # Figure out set of unique detectors needed
-            required_detectors = set()
-
-            # If not already assigned, use the selected feature in the yaml.
-            if not self.selected_features:
-                self.selected_features = config_data['features_selected']
-            for feature_selected in self.selected_features:
-                if feature_selected not in self.feature_to_detector_mapping:
-                    raise IndexError(
-                        'Feature {} does not have a detector.'.format(
-                            feature_selected))
-                required_detectors.add(
-                    self.feature_to_detector_mapping[feature_selected])
-
-            # Only create the detector and parsers we need to create.
-            for detector_name in required_detectors:
-                for detector_config in config_data['detectors']:
-                    if detector_config['detector']['name'] == detector_name:
-                        self._create_detector(detector_config['detector'],
-                                              config_data['parsers'])
+        config_data = load_config(self.config_filepath)
+
+        # Create a mapping from detector features provided to the
+        # detector that provides it.
+        for detector_config_mapping in config_data['detectors']:
+            detector_config = detector_config_mapping['detector']
+
+            for feature in detector_config['features_provided']:
+                self.feature_to_detector_mapping[feature] = (
+                    detector_config['name'])
+
+        # Figure out set of unique detectors needed
+        required_detectors = set()
+
+        # If not already assigned, use the selected feature in the yaml.
+        if not self.selected_features:
+            self.selected_features = config_data['features_selected']
+        for feature_selected in self.selected_features:
+            if feature_selected not in self.feature_to_detector_mapping:
+                raise IndexError(
+                    'Feature {} does not have a detector.'.format(
+                        feature_selected))
+            required_detectors.add(
+                self.feature_to_detector_mapping[feature_selected])
+
+        if self.source_package_dsc:
+            from scanner import SourceArchiveScanner
+            self.source_scanner = SourceArchiveScanner(
+                self.source_package_dsc, self.selected_features,
+                self.scan_cache)
+        elif self.source_directory:
+            from scanner import SourceScanner
+            self.source_scanner = SourceScanner(self.source_directory,
+                                                self.selected_features,
+                                                self.scan_workers,
+                                                self.scan_cache)
+
+        # Only create the detector and parsers we need to create.
+        for detector_name in required_detectors:
+            for detector_config in config_data['detectors']:
+                if detector_config['detector']['name'] == detector_name:
+                    self._create_detector(detector_config['detector'],
+                                          config_data['parsers'])
         logging.info('Finished setting up the Parsers and Detectors.')
 
     def run(self):
@@ -213,26 +304,165 @@ class Runner:
             result = detector.run(self.parser_mapping, feature=feature)
             results_dict[feature] = result
 
-        # Output the detection output
-        print(json.dumps(results_dict))
+        return results_dict
+
+
+class RunnerWorker:
+    """
+    Runs the detectors on many packages from one long lived process, so
+    interpreter startup, imports and config parsing are only paid once.
+    Parsed configs and compiled source patterns stay warm between jobs, as
+    does the scan cache. The parsers, detectors and source scanner are
+    still created afresh for every job, as they hold the job's package
+    paths and results.
+
+    Jobs are JSON objects keyed by the runner's flags, i.e
+    {"id": 1, "config_file": "config.yaml", "source_package_directory": "x"}.
+    Unset package keys are unset for the job, while config_file,
+    scan_workers and hardening_workers default to the worker's own flags.
+    Each job is answered, in order, with a JSON line holding its id and
+    either the detection "results" or an "error".
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.scan_cache = None
+        if args.scan_cache_path:
+            from scan_cache import ScanCache
+            self.scan_cache = ScanCache(args.scan_cache_path,
+                                        args.scan_cache_size_mb * 1024 * 1024)
+
+    def _job_args(self, job):
+        """
+        Returns the runner args for the job.
+        """
+        unknown_keys = (set(job) - set(PACKAGE_ARGUMENTS) -
+                        set(WORKER_ARGUMENTS) - set(['id']))
+        if unknown_keys:
+            raise ValueError('Unknown job keys: {}'.format(
+                ', '.join(sorted(unknown_keys))))
+
+        args = copy.copy(self.args)
+        for name in PACKAGE_ARGUMENTS:
+            setattr(args, name, job.get(name))
+        for name in WORKER_ARGUMENTS:
+            if name in job:
+                setattr(args, name, job[name])
+
+        if not args.config_file:
+            raise ValueError('Job has no config_file.')
+        if not any(getattr(args, name) for name in INPUT_ARGUMENTS):
+            raise ValueError('At least one of {} must be set.'.format(
+                ', '.join(INPUT_ARGUMENTS)))
+        return args
+
+    def run_job(self, job):
+        """
+        Runs the detectors for the job, returning its response.
+        """
+        response = {'id': job.get('id')}
+        try:
+            runner = Runner.create(self._job_args(job), self.scan_cache)
+            runner.setup()
+            response['results'] = runner.run()
+        except Exception as e:
+            logging.exception('Job %s failed', response['id'])
+            response['error'] = '{}: {}'.format(type(e).__name__, e)
+        return response
+
+    def handle_line(self, line):
+        """
+        Runs the job encoded in a JSON line, returning its response.
+        """
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            return {'id': None, 'error': 'Malformed job: {}'.format(e)}
+        if not isinstance(job, dict):
+            return {'id': None, 'error': 'Job must be a JSON object.'}
+        return self.run_job(job)
+
+    def serve_stdin(self):
+        """
+        Runs the jobs read from stdin until it's closed, streaming the
+        responses to stdout.
+        """
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            sys.stdout.write(json.dumps(self.handle_line(line)) + '\n')
+            sys.stdout.flush()
+
+    def serve_socket(self, socket_path):
+        """
+        Runs the jobs sent over connections to a Unix socket at socket_path
+        until interrupted or terminated. Connections are served one at a
+        time.
+        """
+        import socketserver
+
+        class RunnerJobHandler(socketserver.StreamRequestHandler):
+            """
+            Runs the JSON line jobs sent over a connection to the socket,
+            writing back a result line for each.
+            """
+
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    response = self.server.worker.handle_line(line)
+                    self.wfile.write(
+                        (json.dumps(response) + '\n').encode('utf-8'))
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socketserver.UnixStreamServer(socket_path, RunnerJobHandler)
+        server.worker = self
+        # Unwind on SIGTERM too, so the socket is removed.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        logging.info('Runner worker listening on %s', socket_path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(socket_path)
+
+    def close(self):
+        if self.scan_cache:
+            self.scan_cache.close()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--config_file',
                         help='Path to the config file that will be parsed to'
-                        'instantiate the necessary detectors.', required=True)
+                        'instantiate the necessary detectors. Required unless '
+                        'serving, where it is the default for jobs.')
     parser.add_argument('--binary_name',
                         help='Name of the prog ultimately produced. '
-                        'Should match what debtags outputs.')
+                        'Should match what debtags outputs. If unset, every '
+                        'ELF executable and shared object in the binary '
+                        'package is checked for hardening.')
     parser.add_argument('--binary_package_directory',
                         help='Path to the binary package directory. '
                         'At least one of build_log_path, source_package_'
                         'directory, or binary_package_directory must be set.')
+    parser.add_argument('--binary_package_path',
+                        help='Path to the binary package .deb, read in memory '
+                        'in place of binary_package_directory. As there, '
+                        'binary_name, if set, is the path of the binary '
+                        'within the package to check for hardening.')
     parser.add_argument('--source_package_directory',
                         help='Path to the source package directory. '
                         'At least one of build_log_path, source_package_'
                         'directory, or binary_package_directory must be set.')
+    parser.add_argument('--source_package_dsc',
+                        help='Path to the source package .dsc, whose '
+                        'tarballs are scanned without unpacking in place of '
+                        'source_package_directory. Patches are not applied.')
     parser.add_argument('--build_log_path',
                         help='Path to the build log. '
                         'At least one of build_log_path, source_package_'
@@ -240,21 +470,59 @@ if __name__ == '__main__':
     parser.add_argument('--verbosity', default=2, type=int,
                         help='Verbosity from 1 (least verbose) to 4. '
                         'Default 2 (INFO)')
+    parser.add_argument('--scan_workers', default=1, type=int,
+                        help='Number of processes the source files are '
+                        'scanned across, 0 to use every core. Default 1.')
+    parser.add_argument('--hardening_workers', default=1, type=int,
+                        help='Number of processes ELF objects are checked '
+                        'across when no binary_name is given, 0 to use every '
+                        'core. Default 1.')
+    parser.add_argument('--scan_cache_path',
+                        help='Path to a sqlite file caching per-file scan '
+                        'results across runs. Caching is off if unset.')
+    parser.add_argument('--scan_cache_size_mb', default=512, type=int,
+                        help='Size budget of the scan cache, past which the '
+                        'least recently used entries are evicted. '
+                        'Default 512.')
     parser.add_argument('-o', '--override-feature-selected', action='append',
                         help='Overrides config.yaml feature_selected to use '
                         'the specified list. i.e -o foo -o bar')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a long lived worker, reading JSON line '
+                        'jobs keyed by these flags from stdin and writing a '
+                        'JSON line result for each to stdout. Imports, parsed '
+                        'configs, compiled patterns and the scan cache are '
+                        'kept between jobs; detectors and parsers are '
+                        'created for each job.')
+    parser.add_argument('--socket',
+                        help='Run as a long lived worker, as with --serve, '
+                        'serving JSON line jobs over a Unix socket at this '
+                        'path.')
 
     args = parser.parse_args()
+    # Enable logging.
+    logging.getLogger().setLevel(args.verbosity * 10)
+
+    if args.serve or args.socket:
+        worker = RunnerWorker(args)
+        try:
+            if args.socket:
+                worker.serve_socket(args.socket)
+            else:
+                worker.serve_stdin()
+        finally:
+            worker.close()
+        sys.exit(0)
+
     # Validate Args
-    if (not args.binary_package_directory and not args.source_package_directory
-            and not args.build_log_path):
+    if not args.config_file:
+        parser.error('config_file must be set.')
+    if not any(getattr(args, name) for name in INPUT_ARGUMENTS):
         parser.error('At least one of build_log_path, source_package_'
                      'directory, or binary_package_directory must be set.')
-    # Enable logging.
-    logging.getLogger().setLevel(args.verbosity * 10)
 
     # Run the detectors and parsers specified in the config flag
     # on the package directory.
     runner = Runner.create(args)
     runner.setup()
-    runner.run()
+    print(json.dumps(runner.run()))
@@ -0,0 +1,114 @@
+"""
+Contains the loading of the runner's detector/parser config files.
+
+Parsed and validated configs are cached in memory and, in marshal form, in
+a __pycache__ directory beside the config, keyed by the config's mtime and
+size. A runner starting on an unchanged config neither imports yaml nor
+parses it.
+"""
+import logging
+import marshal
+import os
+
+# Bump whenever the cached form of a config changes.
+CONFIG_CACHE_VERSION = 1
+CONFIG_CACHE_DIRECTORY = '__pycache__'
+CONFIG_CACHE_SUFFIX = '.config-cache'
+
+# Map from config file path -> (key, validated config).
+_config_cache = {}
+
+
+def _cache_key(config_filepath):
+    stat = os.stat(config_filepath)
+    return (CONFIG_CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+
+
+def compiled_config_path(config_filepath):
+    """
+    Returns the path the compiled form of the config is cached at.
+    """
+    directory, filename = os.path.split(os.path.abspath(config_filepath))
+    return os.path.join(directory, CONFIG_CACHE_DIRECTORY,
+                        filename + CONFIG_CACHE_SUFFIX)
+
+
+def validate_config(config_data):
+    """
+    Raises ValueError if the config is missing sections or its detectors
+    refer to parsers it doesn't define.
+    """
+    if not isinstance(config_data, dict):
+        raise ValueError('Config is not a mapping.')
+    for section in ('detectors', 'parsers', 'features_selected'):
+        if section not in config_data:
+            raise ValueError('Config has no {} section.'.format(section))
+
+    parser_names = set()
+    for parser_config_mapping in config_data['parsers']:
+        parser_config = parser_config_mapping['parser']
+        for key in ('name', 'type'):
+            if key not in parser_config:
+                raise ValueError('Parser config without a {}.'.format(key))
+        parser_names.add(parser_config['name'])
+
+    for detector_config_mapping in config_data['detectors']:
+        detector_config = detector_config_mapping['detector']
+        for key in ('name', 'type', 'features_provided'):
+            if key not in detector_config:
+                raise ValueError('Detector config without a {}.'.format(key))
+        parser_name = detector_config.get('parser_to_use')
+        if parser_name and parser_name not in parser_names:
+            raise ValueError('Detector {} uses undefined parser {}.'.format(
+                detector_config['name'], parser_name))
+
+
+def _read_compiled_config(config_filepath, key):
+    try:
+        with open(compiled_config_path(config_filepath), 'rb') as f:
+            cached_key, config_data = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return config_data if tuple(cached_key) == key else None
+
+
+def _write_compiled_config(config_filepath, key, config_data):
+    path = compiled_config_path(config_filepath)
+    temporary_path = '{}.{}'.format(path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temporary_path, 'wb') as f:
+            marshal.dump((key, config_data), f)
+        # Atomic, so concurrent runners never read a partial file.
+        os.replace(temporary_path, path)
+    except (OSError, ValueError) as e:
+        # ValueError if the config holds values marshal can't serialize, such
+        # as YAML dates, which are then parsed again on each start.
+        logging.debug('Could not cache config %s: %s', config_filepath, e)
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+
+
+def load_config(config_filepath):
+    """
+    Returns the parsed and validated config file, reusing a previous parse
+    while the file is unchanged.
+    """
+    key = _cache_key(config_filepath)
+    cached = _config_cache.get(config_filepath)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    config_data = _read_compiled_config(config_filepath, key)
+    if config_data is None:
+        # Only imported on a cache miss, as it's slow to import.
+        import yaml
+        with open(config_filepath) as f:
+            config_data = yaml.load(f, Loader=yaml.FullLoader)
+        validate_config(config_data)
+        _write_compiled_config(config_filepath, key, config_data)
+
+    _config_cache[config_filepath] = (key, config_data)
+    return config_data
@@ -0,0 +1,113 @@
+"""
+Contains the on-disk cache of per-file scan results shared between scans of
+different packages and package versions.
+"""
+import json
+import logging
+import sqlite3
+import time
+
+# Default budget for the cache, in bytes of stored entries.
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+# Approximate per-row storage beyond the key and counts, used for budgeting.
+ENTRY_OVERHEAD = 64
+# Seconds to wait on another process holding the database lock.
+SQLITE_TIMEOUT = 60
+
+
+class ScanCache:
+    """
+    Persistent mapping from (file content digest, pattern set version) to the
+    per-feature match counts of that file. Vendored trees and files unchanged
+    between package versions hash the same, so their counts are reused rather
+    than rescanned.
+
+    Entries are evicted least recently used first once the total entry size
+    goes over max_size bytes.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+        # WAL lets the scan workers read while the parent writes.
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS scan_cache (
+                digest TEXT NOT NULL,
+                pattern_version TEXT NOT NULL,
+                counts TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (digest, pattern_version))""")
+        self.connection.execute("""
+            CREATE INDEX IF NOT EXISTS scan_cache_last_used
+                ON scan_cache (last_used)""")
+        self.connection.commit()
+
+    def lookup(self, digest, pattern_version):
+        """
+        Returns the cached counts for the file content, or None if the file
+        hasn't been scanned with this pattern set.
+        """
+        row = self.connection.execute(
+            'SELECT counts FROM scan_cache '
+            'WHERE digest = ? AND pattern_version = ?',
+            (digest, pattern_version)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def store(self, entries, pattern_version):
+        """
+        Adds the digest -> counts mapping in entries to the cache.
+        """
+        now = time.time()
+        rows = []
+        for digest, counts in entries.items():
+            encoded_counts = json.dumps(counts)
+            size = len(digest) + len(encoded_counts) + ENTRY_OVERHEAD
+            rows.append((digest, pattern_version, encoded_counts, size, now))
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO scan_cache '
+                '(digest, pattern_version, counts, size, last_used) '
+                'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def touch(self, digests, pattern_version):
+        """
+        Marks the entries for digests as recently used.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE scan_cache SET last_used = ? '
+                'WHERE digest = ? AND pattern_version = ?',
+                [(now, digest, pattern_version) for digest in digests])
+
+    def evict(self):
+        """
+        Drops the least recently used entries until the cache fits in
+        max_size bytes.
+        """
+        total_size = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM scan_cache').fetchone()[0]
+        excess = total_size - self.max_size
+        if excess <= 0:
+            return
+
+        evicted_rowids = []
+        for rowid, size in self.connection.execute(
+                'SELECT rowid, size FROM scan_cache ORDER BY last_used'):
+            if excess <= 0:
+                break
+            evicted_rowids.append((rowid,))
+            excess -= size
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM scan_cache WHERE rowid = ?', evicted_rowids)
+        logging.info('Evicted %d entries from scan cache %s',
+                     len(evicted_rowids), self.path)
+
+    def close(self):
+        self.connection.close()
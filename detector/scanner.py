@@ -0,0 +1,336 @@
+"""
+Contains the scanner used by the source detectors to count pattern matches
+within a package's source in a single walk of the tree.
+"""
+import fnmatch
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+
+from scan_cache import ScanCache
+
+# Only files whose basename matches one of these are scanned, mirroring the
+# `grep --include` globs the detectors used to shell out with.
+SOURCE_FILE_GLOBS = ['*.h', '*.cpp']
+
+# Characters which end the literal prefix of a pattern.
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+# Bump whenever the way lines are counted changes, invalidating cached counts.
+SCAN_FORMAT_VERSION = 1
+
+# Map from a regex mapping's items -> its CompiledPatterns, so long lived
+# processes compile each pattern set once.
+_compiled_patterns = {}
+
+# Number of shards handed to each worker when scanning in parallel, so a
+# worker that draws large files doesn't hold up the rest.
+SHARDS_PER_WORKER = 4
+
+
+def is_source_file(filename):
+    """
+    Returns whether the basename of filename is one the scanner looks at.
+    """
+    basename = os.path.basename(filename)
+    return any(fnmatch.fnmatchcase(basename, glob)
+               for glob in SOURCE_FILE_GLOBS)
+
+
+def literal_prefix(regex):
+    """
+    Returns the literal text a regex begins with, i.e 'unique_ptr<' for
+    'unique_ptr<.+>'. Empty if the regex starts with a metacharacter.
+    """
+    prefix = []
+    for char in regex:
+        if char in REGEX_METACHARACTERS:
+            break
+        prefix.append(char)
+    return ''.join(prefix)
+
+
+class CompiledPatterns:
+    """
+    The compiled form of a feature -> regex mapping, as used for scanning.
+
+    Lines are first located with a single alternation of every pattern's
+    literal prefix, and only those lines are tested against the full regexes.
+    """
+
+    def __init__(self, regex_mapping):
+        self.features = sorted(regex_mapping)
+        # Identifies the pattern set, and so which cached counts apply.
+        self.version = hashlib.sha1(json.dumps(
+            [SCAN_FORMAT_VERSION, sorted(regex_mapping.items())]).encode(
+                'utf-8')).hexdigest()
+        self.regexes = [
+            re.compile(regex_mapping[feature].encode('utf-8'), re.IGNORECASE)
+            for feature in self.features]
+
+        prefixes = [literal_prefix(regex_mapping[feature])
+                    for feature in self.features]
+        if prefixes and all(prefixes):
+            self.prefilter = re.compile(
+                b'|'.join(re.escape(prefix.encode('utf-8'))
+                          for prefix in sorted(set(prefixes))),
+                re.IGNORECASE)
+        else:
+            # Some pattern has no literal to search for, every line is a
+            # candidate.
+            self.prefilter = re.compile(b'^', re.MULTILINE)
+
+    def count(self, data):
+        """
+        Returns a list of the number of lines in data matching each feature,
+        ordered as self.features.
+
+        Follows grep's convention of reporting a binary file (one containing
+        a NUL byte) as a single matching line.
+        """
+        counts = [0] * len(self.features)
+        if not self.features or not self.prefilter.search(data):
+            return counts
+
+        is_binary = b'\0' in data
+        last_line_start = -1
+        for match in self.prefilter.finditer(data):
+            line_start = data.rfind(b'\n', 0, match.start()) + 1
+            if line_start == last_line_start:
+                continue
+            last_line_start = line_start
+            line_end = data.find(b'\n', match.end())
+            if line_end == -1:
+                line_end = len(data)
+            line = data[line_start:line_end]
+
+            for index, regex in enumerate(self.regexes):
+                if regex.search(line):
+                    counts[index] += 1
+
+        if is_binary:
+            counts = [min(count, 1) for count in counts]
+        return counts
+
+
+def compile_patterns(regex_mapping):
+    """
+    Returns the CompiledPatterns of regex_mapping, compiling it on first use.
+    """
+    key = frozenset(regex_mapping.items())
+    patterns = _compiled_patterns.get(key)
+    if patterns is None:
+        patterns = _compiled_patterns[key] = CompiledPatterns(regex_mapping)
+    return patterns
+
+
+def count_cached(patterns, data, cache, scanned, reused):
+    """
+    Returns the counts for data, read from the cache if it has them. Digests
+    that had to be scanned are added to scanned along with their counts, and
+    those read from the cache to reused.
+    """
+    if cache is None:
+        return patterns.count(data)
+
+    digest = hashlib.sha1(data).hexdigest()
+    counts = scanned.get(digest)
+    if counts is None:
+        counts = cache.lookup(digest, patterns.version)
+        if counts is None:
+            counts = patterns.count(data)
+            scanned[digest] = counts
+        else:
+            reused.add(digest)
+    return counts
+
+
+def scan_files(regex_mapping, paths, cache_path=None):
+    """
+    Scans the files at paths, returning a tuple of:
+      - the per-feature match counts summed over the files, ordered by sorted
+        feature name.
+      - a mapping from content digest -> counts for files that had to be
+        scanned, to be added to the cache.
+      - the set of digests whose counts were read from the cache.
+    The last two are empty if no cache_path is given.
+
+    Module level so it can be handed to a process pool.
+    """
+    patterns = compile_patterns(regex_mapping)
+    cache = ScanCache(cache_path) if cache_path else None
+    totals = [0] * len(patterns.features)
+    scanned = {}
+    reused = set()
+
+    try:
+        for path in paths:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            counts = count_cached(patterns, data, cache, scanned, reused)
+            totals = [total + count for total, count in zip(totals, counts)]
+    finally:
+        if cache is not None:
+            cache.close()
+
+    return totals, scanned, reused
+
+
+def _scan_shard(args):
+    return scan_files(*args)
+
+
+class SourceScanner:
+    """
+    Counts, for every registered feature, the lines of the c++ files in a
+    source tree matching the feature's regex. The tree is walked once no
+    matter how many features are registered, and the result is cached so
+    detectors sharing a scanner read from the same scan.
+    """
+
+    def __init__(self, source_path, features=None, workers=1, cache=None):
+        self.source_path = source_path
+        # If set, only patterns for these features are scanned for.
+        self.features = set(features) if features else None
+        # Number of processes the files are spread over; 0 uses every core.
+        self.workers = workers or multiprocessing.cpu_count()
+        # Optional ScanCache consulted before scanning each file.
+        self.cache = cache
+        # Map from feature -> regex to scan for.
+        self.regex_mapping = {}
+        self.cached_results = None
+
+    def register(self, regex_mapping):
+        """
+        Adds the feature -> regex mapping to the patterns scanned for.
+        """
+        for feature, regex in regex_mapping.items():
+            if self.features is not None and feature not in self.features:
+                continue
+            self.regex_mapping[feature] = regex
+        # Any previous scan doesn't cover the new patterns.
+        self.cached_results = None
+
+    def _source_files(self):
+        """
+        Yields the paths of the files to scan. Like `grep -r`, symlinks are
+        not followed.
+        """
+        def raise_error(error):
+            raise error
+
+        for dirpath, dirnames, filenames in os.walk(self.source_path,
+                                                    onerror=raise_error):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                if is_source_file(filename) and not os.path.islink(path):
+                    yield path
+
+    def scan(self):
+        """
+        Returns a mapping from each registered feature to its count of
+        matching lines.
+        """
+        if self.cached_results is not None:
+            return self.cached_results
+
+        features = sorted(self.regex_mapping)
+        totals, scanned, reused = self._scan()
+
+        if self.cache:
+            pattern_version = compile_patterns(self.regex_mapping).version
+            self.cache.store(scanned, pattern_version)
+            self.cache.touch(reused, pattern_version)
+            self.cache.evict()
+            logging.info('Scan cache held %d of %d distinct files',
+                         len(reused), len(reused) + len(scanned))
+
+        self.cached_results = dict(zip(features, totals))
+        return self.cached_results
+
+    def _scan(self):
+        """
+        Scans the source, returning the same tuple as scan_files.
+        """
+        paths = list(self._source_files())
+        cache_path = self.cache.path if self.cache else None
+        if self.workers > 1 and len(paths) > 1:
+            results = self._parallel_scan(paths, cache_path)
+        else:
+            results = scan_files(self.regex_mapping, paths, cache_path)
+        logging.info('Scanned %d files in %s for %d features using %d '
+                     'worker(s)', len(paths), self.source_path,
+                     len(self.regex_mapping), self.workers)
+        return results
+
+    def _parallel_scan(self, paths, cache_path):
+        """
+        Splits paths into shards scanned across a process pool, summing the
+        per-shard counts. Counts are additive so the result is identical to
+        scanning serially.
+        """
+        shard_count = min(len(paths), self.workers * SHARDS_PER_WORKER)
+        shards = [(self.regex_mapping, paths[index::shard_count], cache_path)
+                  for index in range(shard_count)]
+
+        totals = [0] * len(self.regex_mapping)
+        scanned = {}
+        reused = set()
+        with multiprocessing.Pool(min(self.workers, shard_count)) as pool:
+            for shard_results in pool.imap_unordered(_scan_shard, shards):
+                counts, shard_scanned, shard_reused = shard_results
+                totals = [total + count
+                          for total, count in zip(totals, counts)]
+                scanned.update(shard_scanned)
+                reused.update(shard_reused)
+        return totals, scanned, reused
+
+    def count(self, feature):
+        """
+        Returns the number of lines matching the feature's regex.
+        """
+        if feature not in self.regex_mapping:
+            raise ValueError(
+                'Feature {} was not registered with the scanner'.format(
+                    feature))
+        return self.scan()[feature]
+
+
+class SourceArchiveScanner(SourceScanner):
+    """
+    A SourceScanner reading a source package's tarballs, as listed by its
+    .dsc, rather than the unpacked tree. Members are scanned as they are
+    decompressed, so the tree is never written to disk.
+
+    Counts are the same as scanning the tree `dpkg-source -x` unpacks, bar
+    the effect of patches which aren't applied (see source_archive).
+    """
+
+    def __init__(self, dsc_path, features=None, cache=None):
+        # Decompression is serial, so the scan is done in-process.
+        super(SourceArchiveScanner, self).__init__(dsc_path, features, 1,
+                                                   cache)
+
+    def _scan(self):
+        patterns = compile_patterns(self.regex_mapping)
+        scanned = {}
+        reused = set()
+
+        def count(data):
+            return count_cached(patterns, data, self.cache, scanned, reused)
+
+        # Only imported here, as tarfile is slow to import.
+        from source_archive import scan_source_package
+        file_counts = scan_source_package(self.source_path, is_source_file,
+                                          count)
+        totals = [0] * len(patterns.features)
+        for counts in file_counts.values():
+            totals = [total + count for total, count in zip(totals, counts)]
+        logging.info('Scanned %d files in %s for %d features',
+                     len(file_counts), self.source_path,
+                     len(self.regex_mapping))
+        return totals, scanned, reused
@@ -0,0 +1,154 @@
+"""
+Contains a streaming reader for Debian source packages, scanning the members
+of the tarballs a .dsc lists as they decompress instead of unpacking the
+package with dpkg-source.
+
+Members are placed where `dpkg-source -x` would unpack them: an upstream
+tarball with a single top-level directory has it stripped, component
+tarballs go under their component directory and the debian tarball replaces
+any debian/ directory upstream ships.
+
+Patches are not applied. For 3.0 (quilt) packages files touched by
+debian/patches are scanned as upstream ships them, and the .pc/ copies quilt
+leaves in an unpacked tree aren't there to be scanned. Likewise the .diff.gz
+of a 1.0 package is not applied.
+"""
+import logging
+import os.path
+import re
+import tarfile
+
+# Kinds of file a .dsc lists, see dpkg-source(1).
+ORIG = 'orig'
+DEBIAN = 'debian'
+NATIVE = 'native'
+DIFF = 'diff'
+# Checked in order, the first match giving the file's kind.
+SOURCE_FILE_PATTERNS = [
+    (re.compile(r'\.orig(?:-(?P<component>[A-Za-z0-9][A-Za-z0-9-]*))?'
+                r'\.tar(?:\.\w+)?$'), ORIG),
+    (re.compile(r'\.debian\.tar(?:\.\w+)?$'), DEBIAN),
+    (re.compile(r'\.diff\.gz$'), DIFF),
+    (re.compile(r'\.tar(?:\.\w+)?$'), NATIVE),
+]
+
+
+def parse_dsc_files(dsc_path):
+    """
+    Returns the names of the files listed in the Files field of a .dsc.
+    """
+    filenames = []
+    in_files = False
+    with open(dsc_path, encoding='utf-8', errors='surrogateescape') as fh:
+        for line in fh:
+            line = line.rstrip('\n')
+            if in_files and line[:1] in (' ', '\t'):
+                # Each line is '<md5> <size> <name>'.
+                filenames.append(line.split()[-1])
+                continue
+            in_files = line.startswith('Files:')
+    return filenames
+
+
+def source_archives(dsc_path):
+    """
+    Returns a (kind, component, path) tuple for each file of the source
+    package, in the order dpkg-source unpacks them. component is None
+    except for orig-<component> tarballs.
+    """
+    directory = os.path.dirname(dsc_path)
+    archives = []
+    for filename in parse_dsc_files(dsc_path):
+        for pattern, kind in SOURCE_FILE_PATTERNS:
+            match = pattern.search(filename)
+            if match:
+                break
+        else:
+            # Signatures and the like.
+            continue
+        path = os.path.join(directory, filename)
+        if not os.path.isfile(path):
+            raise ValueError('{} listed in {} was not found'.format(
+                filename, dsc_path))
+        component = match.groupdict().get('component')
+        archives.append((kind, component, path))
+
+    # Main upstream tarball, then components, then the debian tarball or
+    # diff on top.
+    kind_order = [NATIVE, ORIG, DEBIAN, DIFF]
+    archives.sort(key=lambda archive: (kind_order.index(archive[0]),
+                                       archive[1] or ''))
+    return archives
+
+
+def _scan_tarball(archive_path, is_wanted, scan):
+    """
+    Returns a tuple of:
+      - a mapping from member path -> scan(data) for each regular file
+        member whose path is_wanted. Like `grep -r`, symlinks are skipped.
+      - a mapping from each top-level entry to whether it's a directory.
+    """
+    results = {}
+    top_level = {}
+    with tarfile.open(archive_path, mode='r|*') as tar:
+        for member in tar:
+            name = os.path.normpath(member.name).lstrip('/')
+            if name in ('.', '..') or name.startswith('../'):
+                continue
+            parts = name.split('/', 1)
+            top_level[parts[0]] = (len(parts) > 1 or member.isdir() or
+                                   top_level.get(parts[0], False))
+
+            # A later member replaces any earlier one at the same path.
+            results.pop(name, None)
+            if member.islnk():
+                target = os.path.normpath(member.linkname).lstrip('/')
+                if target in results:
+                    results[name] = results[target]
+                elif is_wanted(name):
+                    logging.warning('Skipping %s in %s, a hard link to a '
+                                    'file that was not read', name,
+                                    archive_path)
+            elif member.isfile() and is_wanted(name):
+                results[name] = scan(tar.extractfile(member).read())
+    return results, top_level
+
+
+def _remove_tree(results, directory):
+    prefix = directory + '/'
+    for path in [path for path in results if path.startswith(prefix)]:
+        del results[path]
+
+
+def scan_source_package(dsc_path, is_wanted, scan):
+    """
+    Returns a mapping from path, relative to the unpacked source tree, to
+    scan(data) for each regular file of the source package whose path
+    is_wanted. Nothing is written to disk.
+    """
+    results = {}
+    for kind, component, path in source_archives(dsc_path):
+        if kind == DIFF:
+            logging.warning('Not applying %s, the files it changes are '
+                            'scanned as in the upstream tarball', path)
+            continue
+
+        members, top_level = _scan_tarball(path, is_wanted, scan)
+        if kind == DEBIAN:
+            # Unpacked in place over the upstream tree.
+            _remove_tree(results, 'debian')
+            prefix = ''
+        else:
+            # A lone top-level directory is unpacked as the tree itself.
+            if len(top_level) == 1 and list(top_level.values())[0]:
+                strip = len(list(top_level)[0]) + 1
+                members = dict((name[strip:], result)
+                               for name, result in members.items())
+            prefix = ''
+            if component:
+                _remove_tree(results, component)
+                prefix = component + '/'
+        for name, result in members.items():
+            results[prefix + name] = result
+        logging.info('Scanned %d files of %s', len(members), path)
+    return results
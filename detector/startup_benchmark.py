@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+"""
+Benchmarks the cold start of runner.py, the cost every runner invocation
+pays before detecting anything: importing the runner and setting up its
+detectors, plus the detection run itself for reference. Each sample is
+taken in a fresh interpreter.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# imports from local libs
+from runner_config import compiled_config_path
+
+DETECTOR_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PHASES = ['import', 'setup', 'run', 'total']
+
+# Run in a fresh interpreter for each sample. Prints the seconds taken by
+# each phase as JSON.
+PROBE = '''
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import runner
+imported = time.perf_counter()
+
+kwargs = json.loads(sys.argv[1])
+instance = runner.Runner(kwargs['config_file'], None,
+                         kwargs['source_package_directory'], None,
+                         kwargs['features'], kwargs['build_log_path'])
+instance.setup()
+set_up = time.perf_counter()
+instance.run()
+ran = time.perf_counter()
+
+print(json.dumps({'import': imported - start, 'setup': set_up - imported,
+                  'run': ran - set_up}))
+'''
+
+
+def take_sample(probe_kwargs, cold_config):
+    """
+    Returns the seconds each of PHASES took in a fresh interpreter, total
+    including the interpreter's own startup.
+    """
+    if cold_config:
+        try:
+            os.unlink(compiled_config_path(probe_kwargs['config_file']))
+        except FileNotFoundError:
+            pass
+
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE, json.dumps(probe_kwargs)],
+        cwd=DETECTOR_DIRECTORY)
+    total = time.perf_counter() - start
+
+    sample = json.loads(output.decode('utf-8').splitlines()[-1])
+    sample['total'] = total
+    return sample
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config_file', required=True,
+                        help='Path to the runner config file to benchmark.')
+    parser.add_argument('--source_package_directory',
+                        help='Path to a source package directory to run on.')
+    parser.add_argument('--build_log_path',
+                        help='Path to a build log to run on.')
+    parser.add_argument('--samples', default=10, type=int,
+                        help='Number of fresh interpreters to time. '
+                        'Default 10.')
+    parser.add_argument('--cold_config', action='store_true',
+                        help='Drop the compiled config before each sample, '
+                        'timing a config cache miss.')
+    parser.add_argument('--budget_ms', type=float,
+                        help='Exit with an error if the median total start '
+                        'and setup time, excluding the run, exceeds this.')
+    parser.add_argument('-o', '--override-feature-selected', action='append',
+                        help='Features to run, defaults to the config\'s '
+                        'features_selected. i.e -o foo -o bar')
+
+    args = parser.parse_args()
+    if not args.source_package_directory and not args.build_log_path:
+        parser.error('At least one of source_package_directory or '
+                     'build_log_path must be set.')
+
+    probe_kwargs = {
+        'config_file': os.path.abspath(args.config_file),
+        'source_package_directory': (
+            os.path.abspath(args.source_package_directory) + '/'
+            if args.source_package_directory else None),
+        'build_log_path': (os.path.abspath(args.build_log_path)
+                           if args.build_log_path else None),
+        'features': args.override_feature_selected
+    }
+    samples = [take_sample(probe_kwargs, args.cold_config)
+               for _ in range(args.samples)]
+
+    # Milliseconds per phase, plus the startup cost the budget applies to.
+    report = {}
+    for phase in PHASES + ['startup']:
+        if phase == 'startup':
+            values = [sample['total'] - sample['run'] for sample in samples]
+        else:
+            values = [sample[phase] for sample in samples]
+        report[phase] = {
+            'median_ms': round(statistics.median(values) * 1000, 1),
+            'max_ms': round(max(values) * 1000, 1)
+        }
+    print(json.dumps(report))
+
+    if args.budget_ms and report['startup']['median_ms'] > args.budget_ms:
+        logging.error('Median startup of %.1fms exceeds the %.1fms budget.',
+                      report['startup']['median_ms'], args.budget_ms)
+        sys.exit(1)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The detector's modules are imported from its own directory, as runner.py does.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
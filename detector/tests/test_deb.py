@@ -0,0 +1,88 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import deb
+import detectors
+import elf
+
+SOURCE = """\
+int answer(void) { return 42; }
+int main(void) { return answer(); }
+"""
+
+pytestmark = pytest.mark.skipif(
+    shutil.which('cc') is None or shutil.which('dpkg-deb') is None,
+    reason='needs a C compiler and dpkg-deb')
+
+
+def _compile(output_path, flags):
+    source_path = output_path.parent / (output_path.name + '.c')
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    source_path.write_text(SOURCE)
+    subprocess.check_call(['cc'] + flags + [str(source_path), '-o',
+                                            str(output_path)])
+    source_path.unlink()
+
+
+def _build_deb(tmp_path, populate):
+    root = tmp_path / 'package'
+    (root / 'DEBIAN').mkdir(parents=True)
+    (root / 'DEBIAN/control').write_text(
+        'Package: answer\nVersion: 1.0\nArchitecture: all\n'
+        'Maintainer: Nobody <nobody@example.com>\nDescription: answer\n')
+    populate(root)
+    deb_path = str(tmp_path / 'answer.deb')
+    subprocess.check_call(['dpkg-deb', '--root-owner-group', '--build',
+                           str(root), deb_path], stdout=subprocess.DEVNULL)
+    extraction_path = str(tmp_path / 'extracted')
+    subprocess.check_call(['dpkg-deb', '-x', deb_path, extraction_path])
+    return deb_path, extraction_path
+
+
+def _populate_library(root):
+    _compile(root / 'usr/bin/answer', ['-fPIE', '-pie'])
+    # Plugins are ELF objects, though neither executable nor named .so.
+    _compile(root / 'usr/lib/answer/plugin', ['-fPIC', '-shared'])
+    os.chmod(str(root / 'usr/lib/answer/plugin'), 0o644)
+    os.link(str(root / 'usr/bin/answer'), str(root / 'usr/bin/answer-link'))
+    (root / 'usr/bin/script').write_text('#!/bin/sh\n')
+    os.chmod(str(root / 'usr/bin/script'), 0o755)
+
+
+def _populate_binary(root):
+    _compile(root / 'usr/bin/answer', ['-fPIE', '-pie'])
+    _compile(root / 'usr/lib/libanswer.so', ['-fPIC', '-shared'])
+
+
+def test_deb_objects_match_extraction(tmp_path):
+    deb_path, extraction_path = _build_deb(tmp_path, _populate_library)
+
+    elf_objects = deb.find_deb_elf_objects_by_kind(deb_path)
+    assert elf_objects == elf.find_elf_objects_by_kind(extraction_path)
+    assert elf_objects[elf.EXECUTABLE] == ['usr/bin/answer',
+                                           'usr/bin/answer-link']
+    assert elf_objects[elf.SHARED_OBJECT] == ['usr/lib/answer/plugin']
+
+
+def test_deb_objects_without_elf_objects(tmp_path):
+    deb_path, extraction_path = _build_deb(
+        tmp_path, lambda root: (root / 'README').write_text('answer\n'))
+
+    assert deb.find_deb_elf_objects_by_kind(deb_path) == dict(
+        (kind, []) for kind in elf.ELF_KINDS)
+
+
+def test_deb_single_binary_matches_extraction(tmp_path):
+    deb_path, extraction_path = _build_deb(tmp_path, _populate_binary)
+
+    streamed = detectors.DebHardeningDetector('hardening', deb_path,
+                                              binary_name='usr/bin/answer')
+    extracted = detectors.HardeningDetector(
+        'hardening', os.path.join(extraction_path, 'usr/bin/answer'))
+    for feature in streamed.feature_mapping:
+        result = streamed.run({}, feature=feature)
+        assert isinstance(result, str)
+        assert result == extracted.run({}, feature=feature)
@@ -0,0 +1,37 @@
+import detectors
+import parsers
+
+BUILD_LOG = """\
+checking whether g++ supports C++11 features with -std=gnu++11... yes
+checking whether g++ supports C++14 features with -std=c++14... yes
+checking for gcc option to accept ISO C99... -std=gnu99
+g++ -std=gnu++11... -c conftest.cpp
+gcc -std=gnu99 -c compat.c -o compat.o
+g++ -std=gnu++11 -c a.cpp -o a.o
+g++ -std=gnu++11 -c b.cpp -o b.o
+g++ -std=c++0x -c c.cpp -o c.o
+g++ -o tool a.o b.o c.o compat.o
+"""
+
+
+def _run(tmp_path, feature):
+    build_log_path = tmp_path / 'build.log'
+    build_log_path.write_text(BUILD_LOG)
+    parser = parsers.BuildLogParser('build_log_parser', None,
+                                    str(build_log_path))
+    detector = detectors.CppVersionDetector('cpp_version_detector',
+                                            'build_log_parser')
+    return detector.run({'build_log_parser': parser}, feature=feature)
+
+
+def test_histogram_skips_configure_noise(tmp_path):
+    assert _run(tmp_path, 'cpp_version_histogram') == {
+        'standards': {'gnu++11': 2, 'c++0x': 1},
+        'dialects': {'gnu': 2, 'iso': 1},
+        # c++0x is c++11.
+        'mixed': 'no',
+    }
+
+
+def test_cpp_version_skips_configure_noise(tmp_path):
+    assert _run(tmp_path, 'cpp_version') == 'c++11'
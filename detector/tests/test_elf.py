@@ -0,0 +1,145 @@
+import os
+import platform
+import shutil
+import subprocess
+
+import pytest
+
+import detectors
+import elf
+
+SOURCE = """\
+int answer(void) { return 42; }
+int main(void) { return answer(); }
+"""
+# Copies argv[0] through a large stack buffer, so each hardening flag leaves
+# its mark: a stack canary, fortified strcpy/printf and stack clash probes.
+HARDENING_SOURCE = """\
+#include <stdio.h>
+#include <string.h>
+
+int main(int argc, char **argv) {
+    char buffer[8192];
+    strcpy(buffer, argv[0]);
+    printf("%s %d\\n", buffer, argc);
+    return 0;
+}
+"""
+HARDENED_FLAGS = [
+    '-O2', '-D_FORTIFY_SOURCE=2', '-fstack-protector-strong',
+    '-fstack-clash-protection', '-fcf-protection', '-fPIE', '-pie',
+    '-Wl,-z,relro', '-Wl,-z,now']
+UNHARDENED_FLAGS = [
+    '-O0', '-U_FORTIFY_SOURCE', '-fno-stack-protector',
+    '-fno-stack-clash-protection', '-fcf-protection=none', '-fno-PIE',
+    '-no-pie', '-Wl,-z,norelro', '-Wl,-z,lazy']
+
+pytestmark = pytest.mark.skipif(shutil.which('cc') is None,
+                                reason='needs a C compiler')
+
+
+def _compile(output_path, flags, source=SOURCE):
+    source_path = output_path.parent / (output_path.name + '.c')
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    source_path.write_text(source)
+    subprocess.check_call(['cc'] + flags + [str(source_path), '-o',
+                                            str(output_path)])
+    source_path.unlink()
+    return str(output_path)
+
+
+def test_find_elf_objects_by_kind(tmp_path):
+    root = tmp_path / 'root'
+    _compile(root / 'usr/bin/pie', ['-fPIE', '-pie'])
+    _compile(root / 'usr/bin/no-pie', ['-fno-PIE', '-no-pie'])
+    _compile(root / 'usr/lib/libanswer.so', ['-fPIC', '-shared'])
+    _compile(root / 'usr/lib/answer.o', ['-c'])
+    os.symlink('libanswer.so', str(root / 'usr/lib/libanswer.so.1'))
+    (root / 'usr/share/doc').mkdir(parents=True)
+    (root / 'usr/share/doc/README').write_text('not an ELF object\n')
+
+    assert elf.find_elf_objects_by_kind(str(root)) == {
+        elf.EXECUTABLE: ['usr/bin/no-pie', 'usr/bin/pie'],
+        elf.SHARED_OBJECT: ['usr/lib/libanswer.so'],
+        elf.RELOCATABLE: ['usr/lib/answer.o'],
+    }
+
+
+# The stack clash probes and cfi markers looked for are x86 instructions.
+x86_64_only = pytest.mark.skipif(platform.machine() != 'x86_64',
+                                 reason='checks x86-64 instructions')
+
+
+@x86_64_only
+def test_check_hardening_hardened(tmp_path):
+    path = _compile(tmp_path / 'hardened', HARDENED_FLAGS, HARDENING_SOURCE)
+
+    assert elf.check_hardening(path) == {
+        elf.PIE_NAME: 'yes',
+        elf.STACK_PROTECTOR_NAME: 'yes',
+        elf.FORTIFY_NAME: 'yes',
+        elf.RELRO_NAME: 'yes',
+        elf.BIND_NOW_NAME: 'yes',
+        elf.STACK_CLASH_NAME: 'yes',
+        elf.CFI_NAME: 'yes',
+    }
+
+
+@x86_64_only
+def test_check_hardening_unhardened(tmp_path):
+    path = _compile(tmp_path / 'unhardened', UNHARDENED_FLAGS,
+                    HARDENING_SOURCE)
+
+    results = elf.check_hardening(path)
+    # The C runtime's startup objects linked in may be built with cfi
+    # markers, whatever the flags, as hardening-check also finds.
+    del results[elf.CFI_NAME]
+    assert results == {
+        elf.PIE_NAME: 'no, normal executable!',
+        elf.STACK_PROTECTOR_NAME: 'no, not found!',
+        elf.FORTIFY_NAME: 'no, only unprotected functions found!',
+        elf.RELRO_NAME: 'no, not found!',
+        elf.BIND_NOW_NAME: 'no, not found!',
+        elf.STACK_CLASH_NAME:
+            'unknown, no -fstack-clash-protection instructions found',
+    }
+
+
+def test_combine_hardening():
+    def combine(*results):
+        return elf.combine_hardening(dict(
+            ('object{}'.format(index), {elf.PIE_NAME: result})
+            for index, result in enumerate(results)), elf.PIE_NAME)
+
+    assert combine('yes') == 'yes'
+    assert combine('no, normal executable!') == 'no, normal executable!'
+    assert combine('yes', 'no, regular shared library (ignored)') == 'yes'
+    assert combine('no, regular shared library (ignored)') == \
+        'no, regular shared library (ignored)'
+    assert combine('yes', 'unknown, x', 'no, y') == 'no, y'
+    assert combine('yes', 'unknown, x') == 'unknown, x'
+    assert combine() == 'unknown, no ELF objects found'
+
+
+@x86_64_only
+def test_batch_hardening_detector_results(tmp_path):
+    root = tmp_path / 'root'
+    _compile(root / 'usr/bin/hardened', HARDENED_FLAGS, HARDENING_SOURCE)
+    _compile(root / 'usr/bin/unhardened', UNHARDENED_FLAGS, HARDENING_SOURCE)
+    detector = detectors.BatchHardeningDetector('hardening', str(root))
+
+    # Top level features are hardening-check strings, as for a single binary.
+    assert detector.run({}, feature='stack-protector') == 'no, not found!'
+    assert detector.run({}, feature='stack-protector_objects') == {
+        'all': 'no',
+        'any': 'yes',
+        'fraction': 0.5,
+        'objects': {'usr/bin/hardened': 'yes',
+                    'usr/bin/unhardened': 'no, not found!'},
+    }
+
+    single = detectors.HardeningDetector(
+        'hardening', str(root / 'usr/bin/hardened'), 'usr/bin/hardened')
+    assert single.run({}, feature='stack-protector') == 'yes'
+    assert single.run({}, feature='stack-protector_objects')['objects'] == {
+        'usr/bin/hardened': 'yes'}
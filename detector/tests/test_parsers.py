@@ -0,0 +1,57 @@
+import parsers
+
+CONFIGURE_EXCERPT = """\
+checking for g++... g++
+checking whether the C++ compiler works... yes
+checking whether g++ accepts -g... yes
+checking whether g++ supports C++11 features with -std=gnu++11... yes
+checking dependency style of g++... gcc3
+configure: creating ./config.status
+/bin/bash ../libtool  --tag=CXX   --mode=compile g++ -DHAVE_CONFIG_H -std=c++14 -c -o util.lo util.cpp
+libtool: compile:  g++ -DHAVE_CONFIG_H -std=c++14 -c util.cpp  -fPIC -DPIC -o .libs/util.o
+cd src && g++ -std=c++17 -O2 -c main.cpp -o main.o
+g++ -std=gnu++11 -o tool main.o .libs/util.o -Wl,-z,relro
+"""
+
+
+def _parser(tmp_path, binary_name=None):
+    build_log_path = tmp_path / 'build.log'
+    build_log_path.write_text(CONFIGURE_EXCERPT)
+    return parsers.BuildLogParser('build_log_parser', binary_name,
+                                  str(build_log_path))
+
+
+def test_configure_checks_are_not_invocations():
+    for line in CONFIGURE_EXCERPT.splitlines()[:5]:
+        assert parsers.compiler_argv(line) is None
+
+
+def test_driver_must_be_in_command_position():
+    assert parsers.compiler_argv('echo g++ -c a.cpp') is None
+    assert parsers.compiler_argv('ccache g++ -c a.cpp') == [
+        'g++', '-c', 'a.cpp']
+    assert parsers.compiler_argv(
+        'libtool: link: g++ -shared -o libx.so a.o') == [
+            'g++', '-shared', '-o', 'libx.so', 'a.o']
+
+
+def test_configure_excerpt_invocations(tmp_path):
+    index = _parser(tmp_path).invocation_index()
+    assert [invocation.line_number for invocation in
+            (index[number] for number in range(len(index)))] == [7, 8, 9, 10]
+    assert [index[number].stage for number in range(len(index))] == [
+        parsers.COMPILE, parsers.COMPILE, parsers.COMPILE, parsers.LINK]
+
+
+def test_linker_stage_skips_configure_checks(tmp_path):
+    linking_results = _parser(tmp_path).parse(stage='linker')
+    assert linking_results == [
+        'g++ -std=gnu++11 -o tool main.o .libs/util.o -Wl,-z,relro']
+    assert _parser(tmp_path, 'tool').parse(stage='linker') == linking_results
+
+
+def test_linker_stage_with_binary_path_in_package(tmp_path):
+    # The harness names the binary by its path within the package.
+    assert _parser(tmp_path, 'usr/bin/tool').parse(stage='linker') == [
+        'g++ -std=gnu++11 -o tool main.o .libs/util.o -Wl,-z,relro']
+    assert _parser(tmp_path, 'usr/bin/other').parse(stage='linker') == []
@@ -0,0 +1,35 @@
+import datetime
+import os
+
+import runner_config
+
+CONFIG = """\
+parsers:
+  - parser: {name: log, type: BuildLogParser}
+detectors:
+  - detector: {name: hardening, type: HardeningDetector, features_provided: [pie]}
+features_selected: [pie]
+"""
+
+
+def test_config_is_cached(tmp_path):
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(CONFIG)
+
+    config_data = runner_config.load_config(str(config_path))
+    assert os.path.isfile(runner_config.compiled_config_path(str(config_path)))
+    runner_config._config_cache.clear()
+    assert runner_config.load_config(str(config_path)) == config_data
+
+
+def test_config_marshal_cannot_serialize_is_not_cached(tmp_path):
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(CONFIG + 'released: 2015-06-01\n')
+
+    config_data = runner_config.load_config(str(config_path))
+    assert config_data['released'] == datetime.date(2015, 6, 1)
+    compiled_path = runner_config.compiled_config_path(str(config_path))
+    assert not os.path.exists(compiled_path)
+    assert os.listdir(os.path.dirname(compiled_path)) == []
+    runner_config._config_cache.clear()
+    assert runner_config.load_config(str(config_path)) == config_data
@@ -0,0 +1,46 @@
+import shutil
+import subprocess
+
+import pytest
+
+import timeline
+
+pytestmark = pytest.mark.skipif(shutil.which('git') is None,
+                                reason='needs git')
+
+
+def _git(repo_path, *args):
+    subprocess.check_call(
+        ['git', '-C', str(repo_path), '-c', 'user.name=Nobody',
+         '-c', 'user.email=nobody@example.com'] + list(args),
+        stdout=subprocess.DEVNULL)
+
+
+def _commit(repo_path, path, content, date):
+    (repo_path / path).write_text(content)
+    _git(repo_path, 'add', path)
+    _git(repo_path, 'commit', '-q', '-m', path, '--date', date)
+
+
+@pytest.mark.parametrize('diff_config', [
+    [], ['diff.noprefix=true'], ['diff.mnemonicPrefix=true']])
+def test_timeline_ignores_diff_prefix_config(tmp_path, diff_config):
+    repo_path = tmp_path / 'repo'
+    repo_path.mkdir()
+    _git(repo_path, 'init', '-q')
+    for config in diff_config:
+        _git(repo_path, 'config', *config.split('='))
+    _commit(repo_path, 'a.cpp', 'std::unique_ptr<int> a;\n',
+            '2015-06-01T12:00:00')
+    _commit(repo_path, 'b.cpp',
+            'std::unique_ptr<int> b;\nstd::unique_ptr<int> c;\n',
+            '2015-07-01T12:00:00')
+
+    feature_timeline = timeline.FeatureTimeline(
+        str(repo_path), {'unique_ptr': 'unique_ptr<.+>'})
+    try:
+        counts = [(date, counts) for _, date, counts in feature_timeline.run()]
+    finally:
+        feature_timeline.close()
+    assert counts == [('2015-06-01', {'unique_ptr': 1}),
+                      ('2015-07-01', {'unique_ptr': 3})]
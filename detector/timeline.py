@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+"""
+Builds the occurrence count timeline of source features over a git repo's
+history, updating the counts from the lines each commit adds and removes
+rather than rescanning the tree per commit.
+"""
+import argparse
+import json
+import logging
+import subprocess
+
+# imports from local libs
+from bisector import GitObjectReader, source_regex_mapping
+from scanner import CompiledPatterns, SOURCE_FILE_GLOBS, is_source_file
+
+# Only regular files are scanned; symlinks and submodules are skipped.
+REGULAR_FILE_MODES = (b'100644', b'100755')
+NULL_SHA = '0' * 40
+# Marks the start of each commit in the log output.
+COMMIT_HEADER_FORMAT = '%x00%H %ad'
+
+
+class FileDiff:
+    """
+    The parts of a single file's diff needed to update the counts.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.mode = None
+        self.old_sha = None
+        self.new_sha = None
+        self.is_binary = False
+        self.added_lines = []
+        self.removed_lines = []
+
+    def is_scanned(self):
+        return (self.path is not None and self.mode in REGULAR_FILE_MODES and
+                is_source_file(self.path))
+
+
+class FeatureTimeline:
+    """
+    Walks the first-parent history of a repo oldest first, keeping a running
+    per-feature count of matching lines.
+
+    The root commit's diff holds its whole tree so it's scanned once, after
+    which each commit only costs scanning its added and removed lines. Binary
+    files, which git diffs without lines, are counted from their old and new
+    blobs so the totals agree with scanning each commit's tree.
+
+    Counting is exact except for files containing a NUL byte beyond the
+    prefix git sniffs for binary content: git diffs those as text, so they
+    are counted per line rather than as a single binary match.
+    """
+
+    def __init__(self, repo_path, regex_mapping):
+        self.repo_path = repo_path
+        self.patterns = CompiledPatterns(regex_mapping)
+        self.reader = GitObjectReader(repo_path)
+        # Map from blob sha -> per feature counts, for binary files.
+        self.blob_counts = {}
+
+    def _blob_counts(self, sha):
+        if sha == NULL_SHA:
+            return [0] * len(self.patterns.features)
+        if sha not in self.blob_counts:
+            self.blob_counts[sha] = self.patterns.count(self.reader.read(sha))
+        return self.blob_counts[sha]
+
+    def _file_delta(self, file_diff):
+        """
+        Returns the per feature change in counts the file diff makes.
+        """
+        if file_diff.is_binary:
+            old_counts = self._blob_counts(file_diff.old_sha)
+            new_counts = self._blob_counts(file_diff.new_sha)
+        else:
+            # Counts are per line, so the joined lines count the same as the
+            # sum of the individual lines.
+            old_counts = self.patterns.count(b'\n'.join(file_diff.removed_lines))
+            new_counts = self.patterns.count(b'\n'.join(file_diff.added_lines))
+        return [new - old for new, old in zip(new_counts, old_counts)]
+
+    def _log(self, rev):
+        """
+        Yields the lines of the first-parent patch log of rev, oldest commit
+        first.
+        """
+        command = ['git', '-C', self.repo_path, '-c', 'core.quotePath=false',
+                   'log', '--first-parent', '-m', '--reverse', '--topo-order',
+                   '-p', '-U0', '--no-renames', '--full-index', '--no-color',
+                   '--no-ext-diff', '--src-prefix=a/', '--dst-prefix=b/',
+                   '--date=format:%Y-%m-%d',
+                   '--format=' + COMMIT_HEADER_FORMAT, rev, '--']
+        command.extend(SOURCE_FILE_GLOBS)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        try:
+            for line in process.stdout:
+                yield line.rstrip(b'\n')
+        finally:
+            process.stdout.close()
+            if process.wait() != 0:
+                raise Exception('git log of {} failed'.format(self.repo_path))
+
+    @staticmethod
+    def _parse_path(header_path):
+        """
+        Returns the path of a '--- a/path' or '+++ b/path' header, None for
+        /dev/null.
+        """
+        header_path = header_path.decode('utf-8', 'surrogateescape')
+        if header_path.startswith('"') and header_path.endswith('"'):
+            header_path = header_path[1:-1]
+        if header_path == '/dev/null':
+            return None
+        # Drop the a/ or b/ prefix, passed explicitly to git log so that a
+        # diff.noprefix or diff.mnemonicPrefix config can't change it.
+        return header_path[2:]
+
+    def run(self, rev='HEAD'):
+        """
+        Yields a (commit, date, {feature: count}) tuple for every first-parent
+        commit changing c++ sources, oldest first.
+        """
+        totals = [0] * len(self.patterns.features)
+        commit = None
+        file_diff = None
+        in_hunk = False
+
+        def apply_file_diff():
+            if file_diff is not None and file_diff.is_scanned():
+                delta = self._file_delta(file_diff)
+                for index, change in enumerate(delta):
+                    totals[index] += change
+
+        for line in self._log(rev):
+            if line.startswith(b'\0'):
+                apply_file_diff()
+                if commit:
+                    yield commit + (dict(zip(self.patterns.features, totals)),)
+                sha, date = line[1:].decode('ascii').split()
+                commit = (sha, date)
+                file_diff = None
+                in_hunk = False
+            elif line.startswith(b'diff --git '):
+                apply_file_diff()
+                file_diff = FileDiff()
+                in_hunk = False
+            elif file_diff is None:
+                # Blank separator after the commit header.
+                continue
+            elif in_hunk:
+                if line.startswith(b'+'):
+                    file_diff.added_lines.append(line[1:])
+                elif line.startswith(b'-'):
+                    file_diff.removed_lines.append(line[1:])
+                elif line.startswith(b'@@'):
+                    continue
+            elif line.startswith(b'@@'):
+                in_hunk = True
+            elif line.startswith((b'new file mode ', b'deleted file mode ',
+                                  b'new mode ')):
+                file_diff.mode = line.split()[-1]
+            elif line.startswith(b'index '):
+                fields = line.split()
+                old_sha, new_sha = fields[1].decode('ascii').split('..')
+                file_diff.old_sha = old_sha
+                file_diff.new_sha = new_sha
+                if len(fields) == 3:
+                    file_diff.mode = fields[2]
+            elif line.startswith(b'--- '):
+                file_diff.path = self._parse_path(line[4:]) or file_diff.path
+            elif line.startswith(b'+++ '):
+                file_diff.path = self._parse_path(line[4:]) or file_diff.path
+            elif line.startswith(b'Binary files '):
+                file_diff.is_binary = True
+                # No ---/+++ lines for binary diffs, take the path from the
+                # 'Binary files a/x and b/x differ' line.
+                if file_diff.new_sha != NULL_SHA:
+                    path = line[:-len(b' differ')].rsplit(b' and ', 1)[1]
+                else:
+                    path = line[len(b'Binary files '):].split(b' and ')[0]
+                file_diff.path = self._parse_path(path)
+
+        apply_file_diff()
+        if commit:
+            yield commit + (dict(zip(self.patterns.features, totals)),)
+
+    def run_monthly(self, rev='HEAD'):
+        """
+        Yields a (month, commit, {feature: count}) tuple for every month with
+        commits changing c++ sources, using the counts after the month's last
+        commit.
+        """
+        current = None
+        for commit, date, counts in self.run(rev):
+            month = date[:7]
+            if current and current[0] != month:
+                yield current
+            current = (month, commit, counts)
+        if current:
+            yield current
+
+    def close(self):
+        self.reader.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repo_path', required=True,
+                        help='Path to the git repo. It does not need a '
+                        'checked out worktree.')
+    parser.add_argument('--rev', default='HEAD',
+                        help='Newest commit of the timeline. Default HEAD.')
+    parser.add_argument('--granularity', default='commit',
+                        choices=['commit', 'month'],
+                        help='Whether to output a point per commit or per '
+                        'month. Default commit.')
+    parser.add_argument('--verbosity', default=2, type=int,
+                        help='Verbosity from 1 (least verbose) to 4. '
+                        'Default 2 (INFO)')
+    parser.add_argument('-o', '--override-feature-selected', action='append',
+                        help='Features to count, defaults to every source '
+                        'feature. i.e -o foo -o bar')
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.verbosity * 10)
+
+    regex_mapping = source_regex_mapping()
+    features = []
+    for feature in args.override_feature_selected or sorted(regex_mapping):
+        # Others, such as cpp_version, aren't detected from the source alone.
+        if feature not in regex_mapping:
+            logging.warning('Skipping %s, not a source feature.', feature)
+            continue
+        features.append(feature)
+
+    timeline = FeatureTimeline(args.repo_path, dict(
+        (feature, regex_mapping[feature]) for feature in features))
+    try:
+        if args.granularity == 'month':
+            points = [{'month': month, 'commit': commit, 'counts': counts}
+                      for month, commit, counts in timeline.run_monthly(
+                          args.rev)]
+        else:
+            points = [{'commit': commit, 'date': date, 'counts': counts}
+                      for commit, date, counts in timeline.run(args.rev)]
+        print(json.dumps(points))
+    finally:
+        timeline.close()
@@ -0,0 +1,212 @@
+"""
+Loads apt's Packages and Sources index files into memory in one pass, serving
+per-package metadata lookups without running apt per package. Index files on disk
+are the only input, so it works offline and against test fixtures.
+"""
+
+import bz2
+import glob
+import gzip
+import io
+
+try:
+   from urllib.parse import urlsplit
+except ImportError:
+   from urlparse import urlsplit
+
+APT_LISTS_PATH = '/var/lib/apt/lists'
+DEFAULT_PACKAGES_GLOB = APT_LISTS_PATH + '/*_Packages'
+DEFAULT_SOURCES_GLOB = APT_LISTS_PATH + '/*_Sources'
+# Sources fields naming the package's version control system, i.e Vcs-Git.
+VCS_FIELD_PREFIX = 'Vcs-'
+# Hosts whose repo web pages are also the repos' clone URLs.
+GIT_FORGE_HOSTS = ['github.com', 'gitlab.com', 'salsa.debian.org']
+
+def vcs_git_url(vcs):
+   """
+   Returns the git repo URL declared by a source package's Vcs-* fields, or None:
+   its Vcs-Git, or else its Vcs-Browser if that's on a git forge.
+   """
+   # Possibly followed by a branch and subdirectory, i.e 'url -b branch [dir]'.
+   git_url = vcs.get('Vcs-Git', '').split()
+   if git_url:
+      return git_url[0]
+   browser_url = vcs.get('Vcs-Browser')
+   if browser_url and urlsplit(browser_url).netloc in GIT_FORGE_HOSTS:
+      return browser_url
+   return None
+
+def _open(path):
+   if path.endswith('.gz'):
+      return gzip.open(path, 'rb')
+   elif path.endswith('.bz2'):
+      return bz2.BZ2File(path, 'rb')
+   elif path.endswith('.xz'):
+      # Python 3 only.
+      import lzma
+      return lzma.open(path, 'rb')
+   return io.open(path, 'rb')
+
+def iter_stanzas(path):
+   """
+   Yields each stanza of a deb822 file, i.e a Packages index, as a mapping from
+   field name to value. Continuation lines are joined with newlines.
+   """
+   stanza = {}
+   field = None
+   with _open(path) as f:
+      for line in f:
+         line = line.decode('utf-8', 'replace').rstrip('\r\n')
+         if not line.strip():
+            if stanza:
+               yield stanza
+            stanza = {}
+            field = None
+         elif line[0] in ' \t':
+            if field:
+               stanza[field] += '\n' + line.strip()
+         else:
+            field, _, value = line.partition(':')
+            stanza[field] = value.strip()
+   if stanza:
+      yield stanza
+
+def _order(char):
+   # Sort weight of a non-digit version character, see deb-version(7).
+   if not char:
+      return 0
+   elif char == '~':
+      return -1
+   elif char.isalpha():
+      return ord(char)
+   return ord(char) + 256
+
+def _compare_fragments(a, b):
+   # Compares upstream versions or revisions, as dpkg's verrevcmp does.
+   i = j = 0
+   while i < len(a) or j < len(b):
+      while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+         a_order = _order(a[i] if i < len(a) and not a[i].isdigit() else '')
+         b_order = _order(b[j] if j < len(b) and not b[j].isdigit() else '')
+         if a_order != b_order:
+            return a_order - b_order
+         i += 1
+         j += 1
+      a_start = i
+      while i < len(a) and a[i].isdigit():
+         i += 1
+      b_start = j
+      while j < len(b) and b[j].isdigit():
+         j += 1
+      a_number = int(a[a_start:i] or 0)
+      b_number = int(b[b_start:j] or 0)
+      if a_number != b_number:
+         return a_number - b_number
+   return 0
+
+def _split_version(version):
+   epoch, _, rest = version.rpartition(':') if ':' in version else ('0', '', version)
+   upstream, _, revision = rest.rpartition('-') if '-' in rest else (rest, '', '')
+   return int(epoch or 0), upstream, revision
+
+def compare_versions(a, b):
+   """
+   Returns a negative number, zero or a positive number as Debian version a sorts
+   before, the same as or after b.
+   """
+   a_epoch, a_upstream, a_revision = _split_version(a)
+   b_epoch, b_upstream, b_revision = _split_version(b)
+   if a_epoch != b_epoch:
+      return a_epoch - b_epoch
+   return (_compare_fragments(a_upstream, b_upstream) or
+           _compare_fragments(a_revision, b_revision))
+
+def _parse_source_field(stanza):
+   # A Packages stanza's Source field, naming the source version when it differs
+   # from the binary's, i.e for binNMUs. Absent when named after the binary.
+   name, _, version = stanza.get('Source', stanza['Package']).partition(' ')
+   return name, version.strip('() ') or stanza['Version']
+
+class AptIndex:
+   """
+   In-memory index of the binary packages in Packages files, keyed by package name,
+   joined with their source packages in Sources files. Where an index lists a
+   package more than once, i.e for several suites, the highest version is kept, as
+   apt would pick it.
+   """
+
+   def __init__(self):
+      # Map from binary package name -> package metadata.
+      self._packages = {}
+      # Map from source package name -> (version, {Vcs-* field: value}).
+      self._sources = {}
+
+   @classmethod
+   def load(cls, packages_paths, sources_paths):
+      """
+      Returns the index of the given Packages and Sources files, which may be
+      compressed.
+      """
+      index = cls()
+      for path in packages_paths:
+         for stanza in iter_stanzas(path):
+            index._add_package(stanza)
+      for path in sources_paths:
+         for stanza in iter_stanzas(path):
+            index._add_source(stanza)
+      return index
+
+   @classmethod
+   def load_apt_lists(cls):
+      """
+      Returns the index of the Packages and Sources files apt last fetched.
+      """
+      return cls.load(sorted(glob.glob(DEFAULT_PACKAGES_GLOB)),
+                      sorted(glob.glob(DEFAULT_SOURCES_GLOB)))
+
+   def _add_package(self, stanza):
+      if 'Package' not in stanza or 'Version' not in stanza:
+         return
+      existing = self._packages.get(stanza['Package'])
+      if existing and compare_versions(existing['version'], stanza['Version']) >= 0:
+         return
+      source_package, source_version = _parse_source_field(stanza)
+      installed_size = stanza.get('Installed-Size')
+      self._packages[stanza['Package']] = {
+         'version': stanza['Version'],
+         'maintainer': stanza.get('Maintainer'),
+         'source_package': source_package,
+         'source_version': source_version,
+         # In KiB.
+         'installed_size': int(installed_size) if installed_size else None,
+      }
+
+   def _add_source(self, stanza):
+      if 'Package' not in stanza or 'Version' not in stanza:
+         return
+      existing = self._sources.get(stanza['Package'])
+      if existing and compare_versions(existing[0], stanza['Version']) >= 0:
+         return
+      vcs = dict((field, value) for field, value in stanza.items()
+                 if field.startswith(VCS_FIELD_PREFIX))
+      self._sources[stanza['Package']] = (stanza['Version'], vcs)
+
+   def __contains__(self, package_name):
+      return package_name in self._packages
+
+   def __len__(self):
+      return len(self._packages)
+
+   def lookup(self, package_name):
+      """
+      Returns the metadata of a binary package, or None if it isn't indexed: its
+      version, maintainer, source_package, source_version, installed_size and the
+      Vcs-* fields of its source package, i.e 'Vcs-Git'.
+      """
+      package = self._packages.get(package_name)
+      if package is None:
+         return None
+      package = dict(package)
+      source = self._sources.get(package['source_package'])
+      package['vcs'] = dict(source[1]) if source else {}
+      return package
@@ -0,0 +1,203 @@
+"""
+Contains the on-disk cache of downloaded package artifacts, so reruns over the same
+packages don't download them again.
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Default budget for the cache, in bytes of stored files.
+DEFAULT_MAX_SIZE = 20 * 1024 * 1024 * 1024
+# Bytes read at a time when hashing files.
+HASH_CHUNK_SIZE = 1024 * 1024
+# Seconds to wait on another process holding the database lock.
+SQLITE_TIMEOUT = 60
+
+def _digest(path):
+   sha256 = hashlib.sha256()
+   with open(path, 'rb') as f:
+      for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+         sha256.update(chunk)
+   return sha256.hexdigest()
+
+def _link_or_copy(source, destination):
+   try:
+      os.link(source, destination)
+   except OSError:
+      # On another filesystem.
+      shutil.copyfile(source, destination)
+
+class ArtifactCache:
+   """
+   Persistent mapping from (package=version, artifact type) to the files downloaded
+   for it, i.e the .dsc and tarballs of a source package, see fetchers. Files are stored once per
+   content digest, so an upstream tarball shared by several package versions takes
+   up space once, and handed out as hard links.
+
+   Each file is checked against its digest before being handed out, a corrupt
+   artifact being dropped and downloaded again. Artifacts are evicted least
+   recently used first once the stored files go over max_size bytes.
+   """
+
+   def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+      self.path = path
+      self.max_size = max_size
+      self._objects_path = os.path.join(path, 'objects')
+      os.makedirs(self._objects_path, exist_ok=True)
+      # Shared by the harness' fetch threads.
+      self._lock = threading.Lock()
+      self.connection = sqlite3.connect(os.path.join(path, 'index.sqlite'),
+                                        timeout=SQLITE_TIMEOUT, check_same_thread=False)
+      self.connection.execute("""
+         CREATE TABLE IF NOT EXISTS artifacts (
+            package_key TEXT NOT NULL,
+            artifact_type TEXT NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (package_key, artifact_type))""")
+      self.connection.execute("""
+         CREATE TABLE IF NOT EXISTS artifact_files (
+            package_key TEXT NOT NULL,
+            artifact_type TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            PRIMARY KEY (package_key, artifact_type, filename))""")
+      self.connection.execute("""
+         CREATE INDEX IF NOT EXISTS artifact_files_digest ON artifact_files (digest)""")
+      self.connection.commit()
+
+   def _object_path(self, digest):
+      return os.path.join(self._objects_path, digest[:2], digest)
+
+   def _lookup(self, package_key, artifact_type):
+      with self._lock:
+         return self.connection.execute(
+            'SELECT filename, digest, size FROM artifact_files '
+            'WHERE package_key = ? AND artifact_type = ?',
+            (package_key, artifact_type)).fetchall()
+
+   def _verify(self, files):
+      for _, digest, size in files:
+         object_path = self._object_path(digest)
+         try:
+            if os.path.getsize(object_path) != size or _digest(object_path) != digest:
+               return False
+         except OSError:
+            return False
+      return True
+
+   def _store(self, package_key, artifact_type, download_path):
+      files = []
+      for filename in sorted(os.listdir(download_path)):
+         path = os.path.join(download_path, filename)
+         if not os.path.isfile(path):
+            continue
+         digest = _digest(path)
+         object_path = self._object_path(digest)
+         if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # Read-only, as they're handed out as hard links.
+            os.chmod(path, 0o444)
+            os.replace(path, object_path)
+         files.append((package_key, artifact_type, filename, digest, os.path.getsize(object_path)))
+      if not files:
+         return []
+
+      with self._lock:
+         with self.connection:
+            replaced_digests = self._delete(package_key, artifact_type)
+            self.connection.executemany(
+               'INSERT INTO artifact_files (package_key, artifact_type, filename, digest, size) '
+               'VALUES (?, ?, ?, ?, ?)', files)
+            self.connection.execute(
+               'INSERT INTO artifacts (package_key, artifact_type, last_used) VALUES (?, ?, ?)',
+               (package_key, artifact_type, time.time()))
+            self._remove_unreferenced(replaced_digests)
+      return [(filename, digest, size) for _, _, filename, digest, size in files]
+
+   def _delete(self, package_key, artifact_type):
+      # Drops an artifact, returning the digests of its files. These are called with
+      # the lock held, inside a transaction.
+      digests = [row[0] for row in self.connection.execute(
+         'SELECT digest FROM artifact_files WHERE package_key = ? AND artifact_type = ?',
+         (package_key, artifact_type))]
+      self.connection.execute(
+         'DELETE FROM artifact_files WHERE package_key = ? AND artifact_type = ?',
+         (package_key, artifact_type))
+      self.connection.execute(
+         'DELETE FROM artifacts WHERE package_key = ? AND artifact_type = ?',
+         (package_key, artifact_type))
+      return digests
+
+   def _remove_unreferenced(self, digests):
+      # Removes the stored files no artifact has any more.
+      for digest in digests:
+         if not self.connection.execute('SELECT 1 FROM artifact_files WHERE digest = ?',
+                                        (digest,)).fetchone():
+            try:
+               os.unlink(self._object_path(digest))
+            except OSError:
+               pass
+
+   def fetch(self, package_key, artifact_type, destination, download):
+      """
+      Puts the artifact's files in destination, returning their names. Calls
+      download(directory) to download the files into an empty directory when the
+      artifact isn't cached, or its cached files are corrupt. Nothing is cached if
+      no file was downloaded.
+      """
+      files = self._lookup(package_key, artifact_type)
+      if files and not self._verify(files):
+         with self._lock:
+            with self.connection:
+               self._remove_unreferenced(self._delete(package_key, artifact_type))
+         files = None
+
+      if files:
+         with self._lock:
+            with self.connection:
+               self.connection.execute(
+                  'UPDATE artifacts SET last_used = ? WHERE package_key = ? AND artifact_type = ?',
+                  (time.time(), package_key, artifact_type))
+      else:
+         # Downloaded next to the stored files, so they're moved in place.
+         download_path = tempfile.mkdtemp(prefix='download-', dir=self.path)
+         try:
+            download(download_path)
+            files = self._store(package_key, artifact_type, download_path)
+         finally:
+            shutil.rmtree(download_path, ignore_errors=True)
+
+      for filename, digest, _ in files:
+         _link_or_copy(self._object_path(digest), os.path.join(destination, filename))
+      # After linking, as the links keep the files of an artifact evicted right away.
+      self.evict()
+      return [filename for filename, _, _ in files]
+
+   def evict(self):
+      """
+      Drops the least recently used artifacts until the stored files fit in
+      max_size bytes.
+      """
+      with self._lock:
+         with self.connection:
+            if self._total_size() <= self.max_size:
+               return
+            for package_key, artifact_type in self.connection.execute(
+                  'SELECT package_key, artifact_type FROM artifacts ORDER BY last_used').fetchall():
+               self._remove_unreferenced(self._delete(package_key, artifact_type))
+               if self._total_size() <= self.max_size:
+                  break
+
+   def _total_size(self):
+      return self.connection.execute(
+         'SELECT COALESCE(SUM(size), 0) FROM '
+         '(SELECT DISTINCT digest, size FROM artifact_files)').fetchone()[0]
+
+   def close(self):
+      self.connection.close()
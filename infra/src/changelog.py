@@ -0,0 +1,102 @@
+"""
+Contains the parser of debian/changelog, giving the dates of a package's uploads
+from its source package already on disk rather than from apt-get changelog.
+"""
+
+import collections
+import datetime
+import email.utils
+import io
+import os
+import re
+import tarfile
+import zlib
+
+from source_archive import DEBIAN, DIFF, NATIVE, ORIG, source_archives
+
+CHANGELOG_PATH = os.path.join('debian', 'changelog')
+# The first line of an entry, i.e 'foo (1.0-1) unstable; urgency=medium'.
+HEADER_REGEX = re.compile(r'^(?P<package>\S+) \((?P<version>[^)]+)\)')
+# The last line of an entry, i.e ' -- Jane Doe <jane@example.org>  Mon, 01 Jan 2018 12:00:00 +0000'.
+TRAILER_REGEX = re.compile(r'^ -- (?P<maintainer>.*?>)\s+(?P<date>\S.*?)\s*$')
+# The debian/changelog member of a source tarball, under a top-level directory or not.
+CHANGELOG_MEMBER_REGEX = re.compile(r'^(?:\./)?(?:[^/]+/)?debian/changelog$')
+# The header of a diff of debian/changelog in a 1.0 source package's .diff.gz.
+CHANGELOG_DIFF_REGEX = re.compile(r'^\+\+\+ (?:[^/]+/)?debian/changelog(?:\s|$)')
+
+Upload = collections.namedtuple('Upload', ['package', 'version', 'maintainer', 'date'])
+
+def parse_changelog(lines):
+   """
+   Returns the uploads a changelog's entries record, newest first as they're
+   listed. An entry whose date can't be parsed is left out. Dates are naive, in
+   local time.
+   """
+   uploads = []
+   header = None
+   for line in lines:
+      line = line.rstrip('\n')
+      header_match = HEADER_REGEX.match(line)
+      if header_match:
+         header = header_match
+         continue
+      trailer_match = TRAILER_REGEX.match(line)
+      if trailer_match and header:
+         parsed_date = email.utils.parsedate_tz(trailer_match.group('date'))
+         if parsed_date:
+            uploads.append(Upload(
+               header.group('package'), header.group('version'),
+               trailer_match.group('maintainer'),
+               datetime.datetime.fromtimestamp(email.utils.mktime_tz(parsed_date))))
+         header = None
+   return uploads
+
+def _decode(data):
+   return io.StringIO(data.decode('utf-8', 'replace'))
+
+def _read_tarball_changelog(archive_path):
+   # Streams through the tarball until its changelog, if it has one.
+   with tarfile.open(archive_path, mode='r|*') as tar:
+      for member in tar:
+         if member.isfile() and CHANGELOG_MEMBER_REGEX.match(member.name):
+            return _decode(tar.extractfile(member).read())
+   return None
+
+def _read_diff_changelog(diff_path):
+   # Rebuilds the changelog a 1.0 package's diff adds. Only a diff creating the file
+   # holds all of it, which is the case unless upstream ships a debian directory.
+   with open(diff_path, 'rb') as f:
+      diff = zlib.decompress(f.read(), zlib.MAX_WBITS | 32).decode('utf-8', 'replace')
+   lines = None
+   for line in diff.splitlines(True):
+      if lines is None:
+         if CHANGELOG_DIFF_REGEX.match(line):
+            lines = []
+      elif line.startswith('+'):
+         lines.append(line[1:])
+      elif line.startswith('@@ -0,0 '):
+         continue
+      else:
+         # The next file, or a hunk changing an existing changelog.
+         break
+   return io.StringIO(''.join(lines)) if lines else None
+
+def read_changelog(source_package_directory=None, source_package_dsc=None):
+   """
+   Returns the uploads of an unpacked source package, or of a source package's .dsc
+   and the files it lists, which aren't unpacked.
+   """
+   if source_package_directory:
+      with open(os.path.join(source_package_directory, CHANGELOG_PATH),
+                encoding='utf-8', errors='replace') as f:
+         return parse_changelog(f)
+
+   # The changelog dpkg-source would leave is in the last of the files it unpacks.
+   for kind, _, path in reversed(source_archives(source_package_dsc)):
+      if kind == DIFF:
+         changelog = _read_diff_changelog(path)
+      elif kind in (DEBIAN, NATIVE, ORIG):
+         changelog = _read_tarball_changelog(path)
+      if changelog:
+         return parse_changelog(changelog)
+   return []
@@ -1,188 +1,237 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 
 import argparse
+import artifact_cache
+import concurrent.futures
 import datetime
 import errno
 import git
+import job_queue
 import json
+import multiprocessing
 import os
+import results_stream
 import shutil
 import subprocess
 import sys
-import yaml
+import tempfile
+import time
+
+# The detector is run in-process, and its modules shared, from its own directory.
+DETECTOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                             'detector')
+sys.path.append(DETECTOR_PATH)
+import changelog
+import deb
+import detection
+import elf
+import fetchers
+from runner_config import load_config
 
 MOCK = False
 DEFAULT_OUT_FILENAME = 'detection_results.json'
-SOURCE_DOWNLOADS_PATH = 'source_package_downloads_tmp'
-BINARY_DOWNLOADS_PATH = 'binary_package_downloads_tmp'
-BUILD_LOG_DIR_PATH = 'build_log_dir_tmp'
-GIT_REPO_PATH = 'git_bisection_repo_tmp'
+# Each package in flight gets a workspace here, holding these directories.
+WORKSPACES_PATH = 'harness_workspaces_tmp'
+SOURCE_DOWNLOADS_PATH = 'source_package_downloads'
+BINARY_DOWNLOADS_PATH = 'binary_package_downloads'
+BUILD_LOG_DIR_PATH = 'build_log_dir'
+WORKSPACE_DIRECTORIES = [SOURCE_DOWNLOADS_PATH, BINARY_DOWNLOADS_PATH, BUILD_LOG_DIR_PATH]
+# Cloned into the workspace when bisecting.
+GIT_REPO_PATH = 'git_bisection_repo'
 GITHUB_REPO_WHITELIST = './results/github_repo_whitelist.txt'
-BISECTION_RUNNER_PATH = './src/bisect_runner.sh'
-DETECTOR_BISECT_PATH = './src/detector_bisect.sh'
-CREATION_TIME_CMD = './src/creation_time.sh %s'
-BUILD_LOG_DOWNLOAD_CMD = 'getbuildlog %s last amd64'
-if MOCK:
-   DETECTION_TOOL_CMD = './src/mock_detection_tool.sh %s'
-else:
-   CONFIG_FILE = '../detector/config.yaml'
-   CONFIG_NO_LOG_FILE = '../detector/config_no_log.yaml'
-   CONFIG_NO_BINARY_FILE = '../detector/config_no_binary.yaml'
-   CONFIG_NO_BINARY_NO_LOG_FILE = '../detector/config_no_binary_no_log.yaml'
-   RUNNER_PATH = '../detector/runner.py'
-   DETECTION_TOOL_CMD = ('../detector/runner.py '
-                         '--config_file %s '
-                         '--binary_package_directory %s '
-                         '--binary_name %s '
-                         '--source_package_directory %s')
-   DETECTION_TOOL_LOG_CMD = ('../detector/runner.py '
-                             '--config_file %s '
-                             '--binary_package_directory %s '
-                             '--binary_name %s '
-                             '--source_package_directory %s '
-                             '--build_log_path %s')
-   DETECTION_TOOL_NO_BINARY_CMD = ('../detector/runner.py '
-                                   '--config_file %s '
-                                   '--source_package_directory %s')
-   DETECTION_TOOL_NO_BINARY_LOG_CMD = ('../detector/runner.py '
-                                       '--config_file %s '
-                                       '--source_package_directory %s '
-                                       '--build_log_path %s')
+MOCK_DETECTION_TOOL_CMD = './src/mock_detection_tool.sh %s'
+RUNNER_PATH = os.path.join(DETECTOR_PATH, 'runner.py')
+BISECTOR_PATH = os.path.join(DETECTOR_PATH, 'bisector.py')
+TIMELINE_PATH = os.path.join(DETECTOR_PATH, 'timeline.py')
 EXTRACTION_CMD = 'dpkg -x %s %s'
+SOURCE_EXTRACTION_CMD = 'dpkg-source --no-check -x'
 DEB_EXTRACTION_PATH = os.path.join(BINARY_DOWNLOADS_PATH, 'extraction_root')
-BINARY_PATH_FINDER_CMD = "%s" % os.path.join(os.getcwd(), 'src/binary_finder.sh')
 DATE_FMT = '%Y-%m-%d'
+# Pipeline stages, each with a pool of its own.
+FETCH_STAGE = 'fetch'
+DETECT_STAGE = 'detect'
+BISECT_STAGE = 'bisect'
+DEFAULT_FETCH_WORKERS = 4
+DEFAULT_BISECT_WORKERS = 2
+# Times a job queue lease is renewed over its length.
+HEARTBEATS_PER_LEASE = 3
+
+class RunnerWorkerClient:
+   """
+   Runs detection jobs on a single long lived `runner.py --serve` process instead of
+   in the harness process, isolating the harness from detector crashes.
+   """
+
+   def __init__(self):
+      self._process = subprocess.Popen([RUNNER_PATH, '--serve'], stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                       universal_newlines=True)
+
+   def run(self, job):
+      # The worker takes jobs keyed by the runner's flags, as detection.detect does.
+      self._process.stdin.write(json.dumps(job) + '\n')
+      self._process.stdin.flush()
+      line = self._process.stdout.readline()
+      if not line:
+         raise Exception('runner worker exited')
+      response = json.loads(line)
+      if 'error' in response:
+         raise Exception(response['error'])
+      return response['results']
+
+   def close(self):
+      self._process.stdin.close()
+      self._process.wait()
 
 class DetectionHarness:
+   """
+   Runs the detection tool, and optionally git bisection, over the packages as a
+   pipeline. Packages are downloaded on an I/O pool, detected on a process pool and
+   bisected on a pool of their own, each in its own workspace, so network, disk and
+   CPU are kept busy at once. Results are still returned in package order.
+
+   With a job queue, packages are instead claimed from the queue until it's drained,
+   committing each result to it as the package finishes.
+   """
+
    def __init__(self, package_infos, start_offset, count, github_repo_whitelist, features,
-                skip_bisect):
+                skip_bisect, with_timeline, stream_debs, stream_sources, runner_worker=None,
+                fetch_workers=DEFAULT_FETCH_WORKERS, detect_workers=None,
+                bisect_workers=DEFAULT_BISECT_WORKERS, max_in_flight=None, job_queue=None,
+                results_stream=None, completed_keys=None, artifact_cache=None, fetcher=None):
       self._package_infos = package_infos
       self._start_offset = start_offset
       self._count = count
       self._github_repo_whitelist = github_repo_whitelist
       self._features = features
       self._skip_bisect = skip_bisect
+      self._with_timeline = with_timeline
+      self._stream_debs = stream_debs
+      self._stream_sources = stream_sources
+      # Optional RunnerWorkerClient the detection jobs are run on.
+      self._runner_worker = runner_worker
+      # Size of each stage's pool. Detection defaults to every core.
+      self._fetch_workers = fetch_workers
+      self._detect_workers = detect_workers or multiprocessing.cpu_count()
+      self._bisect_workers = bisect_workers
+      # Packages in flight across all stages at once, bounding the disk used by
+      # their workspaces. Defaults to enough to keep every pool busy.
+      self._max_in_flight = max_in_flight or (
+         self._fetch_workers + self._detect_workers + self._bisect_workers)
+
+      # Optional JobQueue the packages are claimed from in place of package_infos,
+      # start_offset and count, shared with other harness workers.
+      self._job_queue = job_queue
+      # Optional ResultsStream the results are written to as produced, instead of
+      # being held until the run ends.
+      self._results_stream = results_stream
+      # package=version keys of the packages already in the results, which are
+      # skipped and count towards count.
+      self._completed_keys = completed_keys or set()
+      # Optional ArtifactCache checked for the package downloads before downloading.
+      self._artifact_cache = artifact_cache
+      # Fetcher the package artifacts are fetched with, apt by default.
+      self._fetcher = fetcher or fetchers.AptFetcher()
 
       self._detection_results = []
 
-   @staticmethod
-   def _download_source_package(download_cmd):
-      # Enter download path.
-      cwd = os.getcwd()
-      os.chdir(SOURCE_DOWNLOADS_PATH)
-
-      try:
-         # Pull down source.
-         subprocess.call(download_cmd.split(),
-                         stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
-
-         # Find source path.
-         subdirs = next(os.walk('.'))[1]
-         if len(subdirs) != 1:
-            raise Exception('package source could not be extracted')
-      except Exception as e:
-         raise e
-      finally:
-         # Return to earlier working directory.
-         os.chdir(cwd)
-
-      return os.path.join(os.getcwd(), SOURCE_DOWNLOADS_PATH, subdirs[0])
+   def _download(self, package_info, artifact_type, download_path):
+      """
+      Fetches the package's artifact into download_path, from the artifact cache if
+      it was fetched before.
+      """
+      def download(directory):
+         self._fetcher.fetch(package_info, artifact_type, directory)
+
+      if self._artifact_cache and self._fetcher.cacheable:
+         self._artifact_cache.fetch(results_stream.package_key(package_info), artifact_type,
+                                    download_path, download)
+      else:
+         download(download_path)
+
+   def _download_source_dsc(self, package_info, download_path):
+      # Only fetch the .dsc and the tarballs it lists, leaving them packed.
+      self._download(package_info, fetchers.SOURCE, download_path)
+
+      # Find the dsc path.
+      dsc_filenames = [filename for filename in os.listdir(download_path)
+                       if filename.endswith('.dsc')]
+      if len(dsc_filenames) != 1:
+         raise Exception('package source could not be downloaded')
+      return os.path.join(download_path, dsc_filenames[0])
 
    @staticmethod
-   def _download_binary_package(download_cmd):
-      # Enter download path.
-      cwd = os.getcwd()
-      os.chdir(BINARY_DOWNLOADS_PATH)
-
-      try:
-         # Pull down source.
-         subprocess.call(download_cmd.split(),
-                         stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
-
-         # Find source path.
-         subfiles = os.listdir('.')
-         if len(subfiles) != 1:
-            raise Exception('package source could not be extracted')
-      except Exception as e:
-         raise e
-      finally:
-         # Return to earlier working directory.
-         os.chdir(cwd)
-
-      return os.path.join(os.getcwd(), BINARY_DOWNLOADS_PATH, subfiles[0])
+   def _extract_source_package(dsc_path):
+      # Unpack the source as apt-get source does, having verified the files itself.
+      download_path = os.path.dirname(dsc_path)
+      subprocess.call(SOURCE_EXTRACTION_CMD.split() + [os.path.basename(dsc_path)],
+                      cwd=download_path, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+      # Find source path.
+      subdirs = next(os.walk(download_path))[1]
+      if len(subdirs) != 1:
+         raise Exception('package source could not be extracted')
+      return os.path.join(download_path, subdirs[0])
+
+   def _download_binary_package(self, package_info, download_path):
+      # Pull down the deb.
+      self._download(package_info, fetchers.BINARY, download_path)
+
+      # Find the deb path.
+      subfiles = os.listdir(download_path)
+      if len(subfiles) != 1:
+         raise Exception('binary package could not be downloaded')
+      return os.path.join(download_path, subfiles[0])
 
    @staticmethod
-   def _extract_deb(deb_path):
-      subprocess.call((EXTRACTION_CMD % (deb_path, DEB_EXTRACTION_PATH)).split(),
-                      stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
-      return os.path.join(os.getcwd(), DEB_EXTRACTION_PATH)
+   def _extract_deb(deb_path, extraction_path):
+      subprocess.call((EXTRACTION_CMD % (deb_path, extraction_path)).split(),
+                      stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+      return extraction_path
 
    @staticmethod
    def _get_binary_paths(extraction_path):
-      # Enter extraction path.
-      cwd = os.getcwd()
-      os.chdir(extraction_path)
+      # Maps each kind of ELF object to its paths relative to the extraction path.
+      return elf.find_elf_objects_by_kind(extraction_path)
 
+   @staticmethod
+   def _run_bisector(features, repo_path):
+      # Bisects every feature in a single in-process run, reading commits from
+      # the object database rather than checking each probe out.
       try:
-         # Get the binary path.
-         binary_paths = subprocess.check_output(BINARY_PATH_FINDER_CMD.split()).splitlines()
+         output = subprocess.check_output(
+            [BISECTOR_PATH, '--repo_path', repo_path] +
+            [arg for feature in features for arg in ('-o', feature)],
+            stderr=subprocess.DEVNULL)
+         return json.loads(output)
       except Exception as e:
-         raise e
-      finally:
-         # Return to earlier working directory.
-         os.chdir(cwd)
-
-      return binary_paths
+         print(e)
+         return {}
 
    @staticmethod
-   def _run_git_bisect(new_commit, old_commit, feature):
-      # Get full paths to tools.
-      bisection_runner_path = os.path.abspath(BISECTION_RUNNER_PATH)
-      detector_bisect_path = os.path.abspath(DETECTOR_BISECT_PATH)
-      runner_path = os.path.abspath(RUNNER_PATH)
-      config_no_binary_path = os.path.abspath(CONFIG_NO_BINARY_FILE)
-      repo_path = os.path.abspath(GIT_REPO_PATH)
-
-      # Enter git repo root.
-      cwd = os.getcwd()
-      os.chdir(GIT_REPO_PATH)
-
+   def _run_timeline(features, repo_path):
+      # Gets the monthly occurrence counts of each feature over the repo's history.
       try:
-         # Get bisection commit.
-         return subprocess.check_output(
-            [bisection_runner_path,
-             str(new_commit),
-             str(old_commit),
-             detector_bisect_path,
-             runner_path,
-             config_no_binary_path,
-             repo_path,
-             feature]).strip()
-      except:
+         output = subprocess.check_output(
+            [TIMELINE_PATH, '--repo_path', repo_path, '--granularity', 'month'] +
+            [arg for feature in features for arg in ('-o', feature)],
+            stderr=subprocess.DEVNULL)
+         return json.loads(output)
+      except Exception as e:
+         print(e)
          return None
-      finally:
-         # Return to earlier working directory.
-         os.chdir(cwd)
-
-   @staticmethod
-   def _feature_detected(feature):
-      try:
-         subprocess.check_call([DETECTOR_BISECT_PATH, RUNNER_PATH, CONFIG_NO_BINARY_FILE,
-                                GIT_REPO_PATH, feature])
-         return False
-      except subprocess.CalledProcessError:
-         return True
 
    @staticmethod
-   def _run_git_bisection(git_repo_url, features):
+   def _run_git_bisection(git_repo_url, features, with_timeline, repo_path):
       try:
          data = {}
 
-         repo = git.Repo.clone_from(git_repo_url, GIT_REPO_PATH)
+         # The bisector reads straight from the object database, so skip
+         # populating a worktree.
+         repo = git.Repo.clone_from(git_repo_url, repo_path, no_checkout=True)
 
-         # Get head commit and first commit.
+         # Get first commit.
          main_branch = repo.active_branch
-         head_commit = next(repo.iter_commits(main_branch))
          first_commit = None
          for first_commit in repo.iter_commits(main_branch):
             pass
@@ -193,189 +242,321 @@ class DetectionHarness:
          # Extract initial commit timestamp.
          data['creation_timestamp'] = first_commit.authored_datetime.strftime(DATE_FMT)
 
-         # Iterate over features, running git bisection on each.
+         # Bisect the features, getting the commit each was introduced in.
          features_data = {}
-         for feature in features:
-            # If feature not detected in head commit, continue.
-            repo.git.checkout(head_commit)
-            if not DetectionHarness._feature_detected(feature):
-               continue
-
-            # If feature detected in first commit, continue.
-            repo.git.checkout(first_commit)
-            if DetectionHarness._feature_detected(feature):
-               continue
-
-            # Run bisection.
-            repo.git.checkout(main_branch)
-            introduction_hash = DetectionHarness._run_git_bisect(head_commit, first_commit, feature)
-            if introduction_hash:
-               introduction_commit = repo.commit(introduction_hash)
-               features_data[feature] = {
-                  'commit': introduction_hash,
-                  'timestamp': introduction_commit.authored_datetime.strftime(DATE_FMT)
-               }
+         introduction_hashes = DetectionHarness._run_bisector(features, repo_path)
+         for feature, introduction_hash in introduction_hashes.items():
+            introduction_commit = repo.commit(introduction_hash)
+            features_data[feature] = {
+               'commit': introduction_hash,
+               'timestamp': introduction_commit.authored_datetime.strftime(DATE_FMT)
+            }
          data['features'] = features_data
 
+         if with_timeline:
+            timeline = DetectionHarness._run_timeline(features, repo_path)
+            if timeline:
+               data['timeline'] = timeline
+
          return data
       except:
-         print "Failed to run git bisection on %s" % git_repo_url
+         print("Failed to run git bisection on %s" % git_repo_url)
          return None
       finally:
-         shutil.rmtree(GIT_REPO_PATH, ignore_errors=True)
-
-   @staticmethod
-   def _download_build_log(package_name):
-      # Enter log dir.
-      cwd = os.getcwd()
-      os.chdir(BUILD_LOG_DIR_PATH)
+         shutil.rmtree(repo_path, ignore_errors=True)
 
+   def _download_build_log(self, package_info, download_path):
+      package_name = package_info['package_name']
       try:
-         # Pull down source.
-         subprocess.call((BUILD_LOG_DOWNLOAD_CMD % package_name).split(),
-                         stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+         # Pull down the log.
+         self._download(package_info, fetchers.BUILD_LOG, download_path)
 
-         # Find source path.
-         subfiles = os.listdir('.')
+         # Find the log path.
+         subfiles = os.listdir(download_path)
          if len(subfiles) != 1:
-            raise Exception('package source could not be extracted')
+            raise Exception('build log could not be downloaded')
       except:
-         print "Failed to download build log for %s" % package_name
+         print("Failed to download build log for %s" % package_name)
          return None
-      finally:
-         os.chdir(cwd)
 
-      return os.path.join(os.getcwd(), BUILD_LOG_DIR_PATH, subfiles[0])
+      return os.path.join(download_path, subfiles[0])
 
    @staticmethod
-   def _extract_creation_time(package_name):
+   def _extract_uploads(package_name, package):
+      # Read from the source package's debian/changelog, newest upload first.
       try:
-         creation_time_secs = subprocess.check_output((CREATION_TIME_CMD % package_name).split())
-         return datetime.datetime.fromtimestamp(int(creation_time_secs))
+         return changelog.read_changelog(package.get('source_package_directory'),
+                                         package.get('source_package_dsc'))
       except Exception as e:
-         print e
-         print "Failed to get creation time for %s" % package_name
-         return None
+         print(e)
+         print("Failed to read changelog for %s" % package_name)
+         return []
+
+   def _fetch(self, package_info, workspace):
+      """
+      Downloads the package into its workspace. Returns the detector inputs found,
+      along with the deb, the package's creation time and the dates of its uploads.
+      """
+      for directory in WORKSPACE_DIRECTORIES:
+         os.makedirs(os.path.join(workspace, directory))
+
+      # Download the source package. When streaming, the detector scans its
+      # tarballs as they are, so it isn't unpacked here.
+      dsc_path = self._download_source_dsc(
+         package_info, os.path.join(workspace, SOURCE_DOWNLOADS_PATH))
+      if self._stream_sources:
+         package = {'source_package_dsc': dsc_path}
+      else:
+         package = {'source_package_directory': self._extract_source_package(dsc_path)}
+
+      # Download the binary package.
+      binary_package_path = self._download_binary_package(
+         package_info, os.path.join(workspace, BINARY_DOWNLOADS_PATH))
+
+      # Get the build log.
+      build_log_path = self._download_build_log(
+         package_info, os.path.join(workspace, BUILD_LOG_DIR_PATH))
+      if build_log_path:
+         package['build_log_path'] = build_log_path
+
+      uploads = self._extract_uploads(package_info['package_name'], package)
+      return {
+         'package': package,
+         'binary_package_path': binary_package_path,
+         # The package was created with its first upload.
+         'creation_time': uploads[-1].date if uploads else None,
+         'upload_dates': [{'version': upload.version, 'date': upload.date.strftime(DATE_FMT)}
+                          for upload in reversed(uploads)],
+      }
+
+   @staticmethod
+   def _detect(fetched, workspace, stream_debs, hardening_workers, runner_worker=None):
+      """
+      Runs the detection tool on a fetched package, returning its output. Run on the
+      detection process pool, or with runner_worker on a thread.
+      """
+      package = dict(fetched['package'])
+      binary_package_path = fetched['binary_package_path']
+      if MOCK:
+         return json.loads(subprocess.check_output(
+            (MOCK_DETECTION_TOOL_CMD % binary_package_path).split()))
+
+      # When streaming, the detector reads the ELF objects straight out of the deb,
+      # so it's only searched here, reading the objects' headers.
+      if stream_debs:
+         elf_objects = deb.find_deb_elf_objects_by_kind(binary_package_path)
+         binary_package = {'binary_package_path': binary_package_path}
+      else:
+         # Extract download from the deb.
+         binary_extraction_path = DetectionHarness._extract_deb(
+            binary_package_path, os.path.join(workspace, DEB_EXTRACTION_PATH))
+
+         # Get binary paths.
+         elf_objects = DetectionHarness._get_binary_paths(binary_extraction_path)
+         binary_package = {'binary_package_directory': binary_extraction_path}
+      executables = elf_objects[elf.EXECUTABLE]
+      if executables or elf_objects[elf.SHARED_OBJECT]:
+         package.update(binary_package)
+         # With a single executable check just that, otherwise have the
+         # detector check every ELF object in the package.
+         if len(executables) == 1:
+            package['binary_name'] = executables[0]
+      package['hardening_workers'] = hardening_workers
+
+      # The detector picks the config matching the inputs given.
+      if runner_worker:
+         package['config_file'] = detection.select_config(
+            'binary_package_path' in package or 'binary_package_directory' in package,
+            'build_log_path' in package)
+         return runner_worker.run(package)
+      return detection.detect(**package)
+
+   def _should_bisect(self, git_repo_url):
+      # If repo has a git URL, run git bisection on it. If it's a github URL make
+      # sure it's in the whitelist.
+      return (not self._skip_bisect and git_repo_url and
+              ('github.com' not in git_repo_url or
+               git_repo_url in self._github_repo_whitelist))
+
+   @staticmethod
+   def _result(package_info, fetched, detection_tool_output, git_bisection_data):
+      result = {
+         'package_name': package_info['package_name'],
+         'rank': package_info['rank'],
+         'source': package_info['source'],
+         'version_number': package_info['version_number'],
+         'data_collection_timestamp': datetime.datetime.today().strftime('%Y-%m-%d-%H:%M:%S'),
+         'detection_tool_output': detection_tool_output
+      }
+      if fetched['creation_time']:
+         result['creation_date'] = fetched['creation_time'].strftime(DATE_FMT)
+      if fetched['upload_dates']:
+         # Oldest first.
+         result['upload_dates'] = fetched['upload_dates']
+      if git_bisection_data:
+         result['git_bisection_data'] = git_bisection_data
+      if package_info.get('maintainer'):
+         result['maintainer'] = package_info['maintainer']
+      return result
 
    def run(self):
-      for package_info in self._package_infos[self._start_offset:]:
-         if len(self._detection_results) == self._count:
-            break
-
-         (repo_name,
-          rank,
-          package_name,
-          maintainer,
-          git_repo_url) = (
-             package_info['source'],
-             package_info['rank'],
-             package_info['package_name'],
-             # Optional data.
-             package_info.get('maintainer'),
-             package_info.get('git_repo_url'))
-         print 'Running tool on: (%s, %s, %s)' % (repo_name, rank, package_name)
-
-         # Create the download directories.
-         if os.path.isdir(SOURCE_DOWNLOADS_PATH):
-            shutil.rmtree(SOURCE_DOWNLOADS_PATH)
-         os.makedirs(SOURCE_DOWNLOADS_PATH)
-         if os.path.isdir(BINARY_DOWNLOADS_PATH):
-            shutil.rmtree(BINARY_DOWNLOADS_PATH)
-         os.makedirs(BINARY_DOWNLOADS_PATH)
-         if os.path.isdir(BUILD_LOG_DIR_PATH):
-            shutil.rmtree(BUILD_LOG_DIR_PATH)
-         os.makedirs(BUILD_LOG_DIR_PATH)
+      package_infos = self._package_infos[self._start_offset:]
+      workspaces_path = os.path.abspath(WORKSPACES_PATH)
+      os.makedirs(workspaces_path, exist_ok=True)
+
+      fetch_pool = concurrent.futures.ThreadPoolExecutor(self._fetch_workers)
+      if self._runner_worker:
+         # The worker serves one job at a time.
+         detect_pool = concurrent.futures.ThreadPoolExecutor(1)
+         hardening_workers = 0
+      else:
+         # Forked workers could inherit locks held by the fetch threads.
+         detect_pool = concurrent.futures.ProcessPoolExecutor(
+            self._detect_workers, mp_context=multiprocessing.get_context('forkserver'))
+         # Packages are already detected in parallel.
+         hardening_workers = 0 if self._detect_workers == 1 else 1
+      bisect_pool = concurrent.futures.ThreadPoolExecutor(self._bisect_workers)
+
+      # Packages are keyed by their index in package_infos, or their job id when
+      # claimed from the job queue.
+      # Map from each running future -> (package key, stage).
+      running = {}
+      # Map from package key -> package info, for the packages in flight.
+      in_flight = {}
+      # Map from package key -> workspace, for the packages in flight.
+      workspaces = {}
+      # Map from package key -> stage -> output, for the packages in flight.
+      stage_outputs = {}
+      # Map from package index -> result, or None if it failed, until returned in order.
+      finished = {}
+      next_index = 0
+      next_finished_index = 0
+      succeeded = 0
+      last_heartbeat = time.time()
 
-         try:
-            # Download the source package.
-            source_extraction_path = self._download_source_package(
-               package_info['download_source_cmd'])
-
-            # Download the binary package.
-            binary_package_path = self._download_binary_package(
-               package_info['download_binary_cmd'])
-
-            # Extract download from the deb.
-            binary_extraction_path = self._extract_deb(binary_package_path)
-
-            # Get binary paths.
-            binary_paths = self._get_binary_paths(binary_extraction_path)
-
-            # If not correct number of binary paths included, don't pass into detector.
-            # TODO(jayden): Cleanly support multiple binaries.
-            if len(binary_paths) == 1:
-               binary_path = binary_paths[0]
-            else:
-               binary_path = None
-
-            # Get the build log.
-            build_log_path = self._download_build_log(package_name)
-
-            # Get the package creation time from changelog.
-            creation_time = self._extract_creation_time(package_name)
-
-            # Run the detection tool on the package.
-            if MOCK:
-               cmd = DETECTION_TOOL_CMD % binary_package_path
-            else:
-               if binary_path:
-                  if build_log_path:
-                     cmd = DETECTION_TOOL_LOG_CMD % (CONFIG_FILE,
-                                                     binary_extraction_path,
-                                                     binary_path,
-                                                     source_extraction_path,
-                                                     build_log_path)
+      try:
+         while True:
+            # Start packages while there's room in flight and an idle fetch worker, so
+            # packages aren't claimed from the job queue long before they're worked on.
+            # Without a job queue only start packages while, were every package in
+            # flight to succeed, there'd still be fewer than count results.
+            while (len(in_flight) < self._max_in_flight and
+                   [stage for _, stage in running.values()].count(FETCH_STAGE) <
+                   self._fetch_workers):
+               if self._job_queue:
+                  claimed = self._job_queue.claim()
+                  if not claimed:
+                     break
+                  key, package_info = claimed
+               elif (next_index < len(package_infos) and
+                     succeeded + len(in_flight) < self._count):
+                  key, package_info = next_index, package_infos[next_index]
+                  next_index += 1
+                  if results_stream.package_key(package_info) in self._completed_keys:
+                     finished[key] = None
+                     succeeded += 1
+                     continue
+               else:
+                  break
+               print('Running tool on: (%s, %s, %s)' % (
+                  package_info['source'], package_info['rank'], package_info['package_name']))
+               in_flight[key] = package_info
+               workspaces[key] = tempfile.mkdtemp(
+                  prefix='%s-' % package_info['package_name'], dir=workspaces_path)
+               future = fetch_pool.submit(self._fetch, package_info, workspaces[key])
+               running[future] = (key, FETCH_STAGE)
+
+            if not running:
+               break
+            done, _ = concurrent.futures.wait(
+               running, timeout=self._heartbeat_interval(),
+               return_when=concurrent.futures.FIRST_COMPLETED)
+
+            # Keep the leases on the claimed packages.
+            if self._job_queue and time.time() - last_heartbeat > self._heartbeat_interval():
+               self._job_queue.heartbeat(list(in_flight))
+               last_heartbeat = time.time()
+
+            for future in done:
+               key, stage = running.pop(future)
+               package_info = in_flight[key]
+               try:
+                  output = future.result()
+               except Exception as e:
+                  print('Error: %s\n' % str(e))
+                  if self._job_queue:
+                     self._job_queue.fail(key, str(e))
                   else:
-                     cmd = DETECTION_TOOL_CMD % (CONFIG_NO_LOG_FILE,
-                                                 binary_extraction_path,
-                                                 binary_path,
-                                                 source_extraction_path)
+                     finished[key] = None
                else:
-                  if build_log_path:
-                     cmd = DETECTION_TOOL_NO_BINARY_LOG_CMD % (CONFIG_NO_BINARY_FILE,
-                                                               source_extraction_path,
-                                                               build_log_path)
+                  outputs = stage_outputs.setdefault(key, {})
+                  outputs[stage] = output
+                  if stage == FETCH_STAGE:
+                     next_stage = DETECT_STAGE
+                     future = detect_pool.submit(
+                        self._detect, output, workspaces[key], self._stream_debs,
+                        hardening_workers, self._runner_worker)
+                  elif stage == DETECT_STAGE and self._should_bisect(
+                        package_info.get('git_repo_url')):
+                     next_stage = BISECT_STAGE
+                     future = bisect_pool.submit(
+                        self._run_git_bisection, package_info['git_repo_url'], self._features,
+                        self._with_timeline, os.path.join(workspaces[key], GIT_REPO_PATH))
                   else:
-                     cmd = DETECTION_TOOL_NO_BINARY_CMD % (CONFIG_NO_BINARY_NO_LOG_FILE,
-                                                           source_extraction_path)
-            detection_result_string = subprocess.check_output(cmd.split())
-
-            # If repo has a git URL, run git bisection on it. If it's a github
-            # URL make sure it's in the whitelist.
-            git_bisection_data = None
-            if (not self._skip_bisect and git_repo_url and
-                ('github.com' not in git_repo_url or
-                 git_repo_url in self._github_repo_whitelist)):
-               git_bisection_data = self._run_git_bisection(git_repo_url, self._features)
-
-            result = {
-               'package_name': package_name,
-               'rank': rank,
-               'source': repo_name,
-               'version_number': package_info['version_number'],
-               'data_collection_timestamp': datetime.datetime.today().strftime('%Y-%m-%d-%H:%M:%S'),
-               'detection_tool_output': json.loads(detection_result_string)
-            }
-            if creation_time:
-               result['creation_date'] = creation_time.strftime(DATE_FMT)
-            if git_bisection_data:
-               result['git_bisection_data'] = git_bisection_data
-            if maintainer:
-               result['maintainer'] = maintainer
-            self._detection_results.append(result)
-         except Exception as e:
-            print 'Error: %s\n' % str(e)
-            continue
-         finally:
-            # Delete the download directories.
-            shutil.rmtree(SOURCE_DOWNLOADS_PATH)
-            shutil.rmtree(BINARY_DOWNLOADS_PATH)
-            shutil.rmtree(BUILD_LOG_DIR_PATH)
-
-         print 'Success: Added detection results for package.\n'
+                     next_stage = None
+                  if next_stage:
+                     running[future] = (key, next_stage)
+                     continue
+
+                  result = self._result(package_info, outputs[FETCH_STAGE],
+                                        outputs[DETECT_STAGE], outputs.get(BISECT_STAGE))
+                  if self._job_queue:
+                     if self._job_queue.complete(key, result):
+                        self._add_result(result)
+                     else:
+                        print('Error: lease on %s lost, dropping its results\n' %
+                              package_info['package_name'])
+                  else:
+                     finished[key] = result
+                  succeeded += 1
+
+               # Delete the package's workspace.
+               del in_flight[key]
+               stage_outputs.pop(key, None)
+               shutil.rmtree(workspaces.pop(key), ignore_errors=True)
+
+            # Return the results in package order.
+            while next_finished_index in finished:
+               result = finished.pop(next_finished_index)
+               if result:
+                  self._add_result(result)
+               next_finished_index += 1
+      finally:
+         for pool in (fetch_pool, detect_pool, bisect_pool):
+            pool.shutdown(cancel_futures=True)
+         for workspace in workspaces.values():
+            shutil.rmtree(workspace, ignore_errors=True)
+         try:
+            os.rmdir(workspaces_path)
+         except OSError:
+            # Still in use by another harness.
+            pass
 
       return self._detection_results
 
+   def _add_result(self, result):
+      if self._results_stream:
+         self._results_stream.write(result)
+      else:
+         self._detection_results.append(result)
+      print('Success: Added detection results for package.\n')
+
+   def _heartbeat_interval(self):
+      # Leases are renewed a few times over, so a slow wait doesn't lose them.
+      if not self._job_queue:
+         return None
+      return self._job_queue.lease_seconds / HEARTBEATS_PER_LEASE
+
 if __name__ == '__main__':
    parser = argparse.ArgumentParser()
    parser.add_argument('package_infos_file',
@@ -383,11 +564,74 @@ if __name__ == '__main__':
                              'package_finder'))
    parser.add_argument('--out', help="output file path, default: %s" % DEFAULT_OUT_FILENAME,
                        default=DEFAULT_OUT_FILENAME)
+   parser.add_argument('--results-lines', help=('JSON lines file each result is appended to '
+                                                'as its package finishes, default: the output '
+                                                'path with a .jsonl extension'),
+                       default=None)
+   parser.add_argument('--resume', help=('whether to skip the packages already in the JSON '
+                                         'lines results of an earlier run, appending to them'),
+                       action='store_true')
+   parser.add_argument('--overwrite', help=('whether to replace the JSON lines results of an '
+                                            'earlier run, which are otherwise kept'),
+                       action='store_true')
    parser.add_argument('--start-offset', help='package index to start at', default=0)
    parser.add_argument('--count', help='number of packages to process, default to all',
                        default=None)
    parser.add_argument('--no-bisect', help='whether to skip bisection',
                        default=False, type=bool)
+   parser.add_argument('--timeline', help=('whether to also record monthly feature counts '
+                                           'over the git history'),
+                       action='store_true')
+   parser.add_argument('--stream-debs', help=('whether to have the detector read binary '
+                                              'packages in memory instead of extracting '
+                                              'them with dpkg -x'),
+                       action='store_true')
+   parser.add_argument('--stream-sources', help=('whether to have the detector scan source '
+                                                 'tarballs as downloaded instead of unpacking '
+                                                 'them, ignoring debian/patches'),
+                       action='store_true')
+   parser.add_argument('--runner-worker', help=('whether to run the detection tool on '
+                                                'every package from a single long lived '
+                                                'runner process'),
+                       action='store_true')
+   parser.add_argument('--fetch-workers', help=('number of packages downloaded at once, '
+                                                'default: %d' % DEFAULT_FETCH_WORKERS),
+                       default=DEFAULT_FETCH_WORKERS, type=int)
+   parser.add_argument('--detect-workers', help=('number of packages detected at once, '
+                                                 'default: one per core'),
+                       default=None, type=int)
+   parser.add_argument('--bisect-workers', help=('number of packages bisected at once, '
+                                                 'default: %d' % DEFAULT_BISECT_WORKERS),
+                       default=DEFAULT_BISECT_WORKERS, type=int)
+   parser.add_argument('--max-in-flight', help=('number of packages in the pipeline, and so '
+                                                'on disk, at once, default: the workers of '
+                                                'every stage'),
+                       default=None, type=int)
+   parser.add_argument('--queue', help=('SQLite job queue file shared by the workers of a '
+                                        'run. The packages selected by --start-offset and '
+                                        '--count are added to it, then claimed one at a '
+                                        'time with the other workers. The output holds '
+                                        'every worker\'s results so far'),
+                       default=None)
+   parser.add_argument('--lease-seconds', help=('seconds before a queued package claimed by '
+                                                'a crashed worker is claimed again, '
+                                                'default: %d' % job_queue.DEFAULT_LEASE_SECONDS),
+                       default=job_queue.DEFAULT_LEASE_SECONDS, type=int)
+   parser.add_argument('--artifact-cache', help=('directory caching the downloaded source '
+                                                 'packages, debs and build logs across runs, '
+                                                 'default: no caching'),
+                       default=None)
+   parser.add_argument('--artifact-cache-size-gb', help=('disk budget of the artifact cache, '
+                                                         'past which the least recently used '
+                                                         'artifacts are evicted, default: %d' %
+                                                         (artifact_cache.DEFAULT_MAX_SIZE /
+                                                          1024 ** 3)),
+                       default=artifact_cache.DEFAULT_MAX_SIZE / 1024 ** 3, type=float)
+   parser.add_argument('--local-pool', help=('directory holding the packages\' .dsc and '
+                                             'tarballs, debs and build logs, as a Debian '
+                                             'pool does, to fetch them from instead of apt '
+                                             'and getbuildlog'),
+                       default=None)
    args = parser.parse_args()
 
    # Verify package infos file exists.
@@ -407,16 +651,60 @@ if __name__ == '__main__':
       github_repo_whitelist = set(f.read().splitlines())
 
    # Read in features from no-binary config.
-   with open(CONFIG_NO_BINARY_FILE) as f:
-      no_binary_config = yaml.load(f)
-      features = no_binary_config['features_selected']
+   features = load_config(detection.CONFIG_NO_BINARY_FILE)['features_selected']
+
+   # Queue the packages, alongside any other worker of the run queuing the same.
+   queue = None
+   if args.queue:
+      queue = job_queue.JobQueue(args.queue, lease_seconds=args.lease_seconds)
+      start_offset = int(args.start_offset)
+      added = queue.load(package_infos[start_offset:start_offset + count])
+      print('Queued %d packages in %s' % (added, args.queue))
+
+   # Stream the results out as they're produced.
+   results_lines_path = os.path.join(
+      os.getcwd(), args.results_lines or os.path.splitext(args.out)[0] + '.jsonl')
+   completed_keys = set()
+   if args.resume:
+      completed_keys = results_stream.completed_keys(results_lines_path)
+      print('Resuming after %d packages in %s' % (len(completed_keys), results_lines_path))
+   try:
+      results_lines = results_stream.ResultsStream(results_lines_path, args.resume,
+                                                   args.overwrite)
+   except FileExistsError:
+      sys.stderr.write('results lines file "%s" already exists, pass --resume to continue it '
+                       'or --overwrite to replace it\n' % results_lines_path)
+      exit(errno.EEXIST)
 
    # Run detection harness.
-   detection_harness = DetectionHarness(package_infos, int(args.start_offset), count,
-                                        github_repo_whitelist, features, args.no_bisect)
-   results = detection_harness.run()
-
-   # Save results to output file.
-   with open(os.path.join(os.getcwd(), args.out), 'w') as f:
-      json.dump(results, f, indent=4)
-      f.write('\n')
+   artifacts = None
+   if args.artifact_cache:
+      artifacts = artifact_cache.ArtifactCache(args.artifact_cache,
+                                               int(args.artifact_cache_size_gb * 1024 ** 3))
+   fetcher = fetchers.LocalPoolFetcher(args.local_pool) if args.local_pool else None
+   runner_worker = RunnerWorkerClient() if args.runner_worker else None
+   try:
+      detection_harness = DetectionHarness(package_infos, int(args.start_offset), count,
+                                           github_repo_whitelist, features, args.no_bisect,
+                                           args.timeline, args.stream_debs,
+                                           args.stream_sources, runner_worker,
+                                           args.fetch_workers, args.detect_workers,
+                                           args.bisect_workers, args.max_in_flight, queue,
+                                           results_lines, completed_keys, artifacts, fetcher)
+      detection_harness.run()
+
+      # Save results to output file, as a single JSON array.
+      if queue:
+         print('Job queue states: %s' % queue.state_counts())
+         results = queue.iter_results()
+      else:
+         results = results_stream.iter_results(results_lines_path)
+      results_stream.write_json_array(results, os.path.join(os.getcwd(), args.out))
+   finally:
+      results_lines.close()
+      if artifacts:
+         artifacts.close()
+      if runner_worker:
+         runner_worker.close()
+      if queue:
+         queue.close()
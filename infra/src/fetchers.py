@@ -0,0 +1,138 @@
+"""
+Contains the fetchers the harness gets each package's artifacts with: the apt
+fetcher, downloading them from the configured archive, and the local pool fetcher,
+finding them in a directory on disk such as a mirror subset or test fixture.
+
+A fetcher's fetch(package_info, artifact_type, directory) puts the files of the
+artifact in directory, leaving it empty if the artifact can't be found.
+"""
+
+import os
+import re
+import subprocess
+import threading
+
+from source_archive import parse_dsc_files
+
+# Artifact types.
+SOURCE = 'source'
+BINARY = 'binary'
+BUILD_LOG = 'build_log'
+ARTIFACT_TYPES = [SOURCE, BINARY, BUILD_LOG]
+
+BUILD_LOG_DOWNLOAD_CMD = 'getbuildlog %s last amd64'
+DEB_SOURCE_FIELD_CMD = 'dpkg-deb --field %s Source'
+# Names of the files in a Debian pool, i.e foo_1.0-1_amd64.deb. Pool file names
+# leave out the epoch of the version.
+DEB_REGEX = re.compile(r'^(?P<name>[^_]+)_(?P<version>[^_]+)_[^_]+\.deb$')
+DSC_REGEX = re.compile(r'^(?P<name>[^_]+)_(?P<version>[^_]+)\.dsc$')
+BUILD_LOG_REGEX = re.compile(r'^(?P<name>[^_]+)_(?P<version>[^_]+)_[^_]+\.(?:build|log)$')
+# A deb's Source field, naming the source version too when it differs.
+SOURCE_FIELD_REGEX = re.compile(r'^(?P<name>\S+)(?:\s+\((?P<version>[^)]+)\))?$')
+
+def _strip_epoch(version):
+   return version.split(':', 1)[-1]
+
+class AptFetcher:
+   """
+   Downloads the artifacts with the package info's apt-get commands, and the
+   build log with getbuildlog.
+   """
+
+   # Whether the artifact cache should hold what's fetched.
+   cacheable = True
+
+   def fetch(self, package_info, artifact_type, directory):
+      if artifact_type == SOURCE:
+         # Only fetch the .dsc and the tarballs it lists, leaving them packed.
+         download_cmd = package_info['download_source_cmd'] + ' --download-only'
+      elif artifact_type == BINARY:
+         download_cmd = package_info['download_binary_cmd']
+      else:
+         download_cmd = BUILD_LOG_DOWNLOAD_CMD % package_info['package_name']
+      subprocess.call(download_cmd.split(), cwd=directory,
+                      stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+class LocalPoolFetcher:
+   """
+   Finds the artifacts under a local directory laid out like, or simply holding the
+   files of, a Debian pool: <name>_<version>_<arch>.deb, <source>_<version>.dsc
+   with the tarballs it lists beside it, and <source>_<version>_<arch>.build (or
+   .log) build logs. The files are hard linked into place, or symlinked across
+   filesystems, never copied.
+
+   The pool is indexed by a single walk, on first use.
+   """
+
+   # Already on disk, so not worth caching.
+   cacheable = False
+
+   def __init__(self, pool_path):
+      self.pool_path = os.path.abspath(pool_path)
+      self._index = None
+      self._index_lock = threading.Lock()
+
+   def _build_index(self):
+      # Map from (artifact type, name, version without epoch) -> path.
+      index = {}
+      for dirpath, _, filenames in os.walk(self.pool_path):
+         for filename in filenames:
+            for artifact_type, regex in ((BINARY, DEB_REGEX), (SOURCE, DSC_REGEX),
+                                         (BUILD_LOG, BUILD_LOG_REGEX)):
+               match = regex.match(filename)
+               if match:
+                  key = (artifact_type, match.group('name'), match.group('version'))
+                  # Keep the first of the build logs of a version, in name order.
+                  path = os.path.join(dirpath, filename)
+                  if key not in index or path < index[key]:
+                     index[key] = path
+                  break
+      return index
+
+   def _lookup(self, artifact_type, name, version):
+      with self._index_lock:
+         if self._index is None:
+            self._index = self._build_index()
+      return self._index.get((artifact_type, name, _strip_epoch(version)))
+
+   def _source_of(self, package_info):
+      # The source package name and version the binary package was built from.
+      name = package_info.get('source_package', package_info['package_name'])
+      version = package_info.get('source_version', package_info['version_number'])
+      deb_path = self._lookup(BINARY, package_info['package_name'],
+                              package_info['version_number'])
+      # The package finder records both, otherwise the deb's Source field tells.
+      if 'source_version' not in package_info and deb_path:
+         try:
+            field = subprocess.check_output((DEB_SOURCE_FIELD_CMD % deb_path).split(),
+                                            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+         except subprocess.CalledProcessError:
+            field = ''
+         match = SOURCE_FIELD_REGEX.match(field)
+         if match:
+            name = match.group('name')
+            version = match.group('version') or version
+      return name, version
+
+   def fetch(self, package_info, artifact_type, directory):
+      if artifact_type == BINARY:
+         paths = [self._lookup(BINARY, package_info['package_name'],
+                               package_info['version_number'])]
+      else:
+         source_name, source_version = self._source_of(package_info)
+         paths = [self._lookup(artifact_type, source_name, source_version)]
+         # Along with the .dsc, the tarballs and diff it lists.
+         if artifact_type == SOURCE and paths[0]:
+            dsc_directory = os.path.dirname(paths[0])
+            paths.extend(os.path.join(dsc_directory, filename)
+                         for filename in parse_dsc_files(paths[0]))
+
+      for path in paths:
+         if not path or not os.path.isfile(path):
+            continue
+         destination = os.path.join(directory, os.path.basename(path))
+         try:
+            os.link(path, destination)
+         except OSError:
+            # On another filesystem.
+            os.symlink(path, destination)
@@ -0,0 +1,236 @@
+"""
+Contains the GitHub API client of the package finder. It paces requests by the
+rate limit headers GitHub returns, issues them from several threads at once, and
+caches responses on disk so reruns make conditional requests, whose 304 responses
+don't count against the rate limit.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+
+DEFAULT_API_URL = 'https://api.github.com'
+DEFAULT_WORKERS = 8
+# Tries of a request, each after waiting out the rate limit.
+MAX_ATTEMPTS = 5
+REQUEST_TIMEOUT = 30
+# Seconds added to the reset time GitHub gives, allowing for clock skew.
+RESET_MARGIN = 1
+# Seconds to wait on another process holding the cache's database lock.
+SQLITE_TIMEOUT = 60
+
+class GitHubError(Exception):
+   pass
+
+def map_concurrently(function, items, workers):
+   """
+   Returns [function(item) for item in items], calling function from up to workers
+   threads. The first exception raised by a call is raised once all calls are done.
+   """
+   items = list(items)
+   results = [None] * len(items)
+   errors = []
+   indexes = iter(range(len(items)))
+   lock = threading.Lock()
+
+   def work():
+      while True:
+         with lock:
+            index = next(indexes, None)
+         if index is None:
+            return
+         try:
+            results[index] = function(items[index])
+         except Exception as e:
+            errors.append(e)
+
+   threads = [threading.Thread(target=work) for _ in range(min(workers, len(items)))]
+   for thread in threads:
+      thread.daemon = True
+      thread.start()
+   for thread in threads:
+      thread.join()
+   if errors:
+      raise errors[0]
+   return results
+
+class RateLimiter:
+   """
+   Token bucket holding the requests left in the current rate limit window, as told
+   by the X-RateLimit-Remaining and X-RateLimit-Reset headers of each response. Once
+   it's empty, requests wait for the window to reset. Requests are unlimited until
+   a response has said what the limit is.
+   """
+
+   def __init__(self):
+      self._condition = threading.Condition()
+      # Requests left in the window, None when unknown.
+      self._remaining = None
+      # Time the window resets at, in seconds since the epoch.
+      self._reset = None
+      self._in_flight = 0
+
+   def acquire(self):
+      """
+      Takes a token for a request, waiting for one if need be.
+      """
+      with self._condition:
+         while True:
+            now = time.time()
+            if self._reset is not None and now >= self._reset:
+               # Unknown again until the next response.
+               self._remaining = None
+               self._reset = None
+            if self._remaining is None or self._remaining > 0:
+               break
+            self._condition.wait(self._reset - now)
+         if self._remaining is not None:
+            self._remaining -= 1
+         self._in_flight += 1
+
+   def release(self, headers=None):
+      """
+      Ends a request, refilling the bucket from the rate limit headers of its
+      response, if any.
+      """
+      with self._condition:
+         self._in_flight -= 1
+         try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = float(headers['X-RateLimit-Reset']) + RESET_MARGIN
+         except (KeyError, TypeError, ValueError):
+            remaining = None
+         # Responses arriving out of order from an earlier window are ignored.
+         if remaining is not None and (self._reset is None or reset >= self._reset):
+            # GitHub's count doesn't include the requests still in flight.
+            self._remaining = max(remaining - self._in_flight, 0)
+            self._reset = reset
+         self._condition.notify_all()
+
+   def pause(self, seconds):
+      """
+      Holds back all requests for the given number of seconds, i.e as a response's
+      Retry-After header asks.
+      """
+      with self._condition:
+         self._remaining = 0
+         self._reset = max(self._reset or 0, time.time() + seconds)
+
+class ResponseCache:
+   """
+   Persistent mapping from URL to the last response body and its ETag and
+   Last-Modified validators.
+   """
+
+   def __init__(self, path):
+      self.path = path
+      # Shared by the client's threads.
+      self._lock = threading.Lock()
+      self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+      self.connection.execute("""
+         CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            body TEXT NOT NULL,
+            fetched REAL NOT NULL)""")
+      self.connection.commit()
+
+   def get(self, url):
+      """
+      Returns the (etag, last_modified, body) of the cached response, or None.
+      """
+      with self._lock:
+         return self.connection.execute(
+            'SELECT etag, last_modified, body FROM responses WHERE url = ?', (url,)).fetchone()
+
+   def put(self, url, etag, last_modified, body):
+      with self._lock:
+         with self.connection:
+            self.connection.execute(
+               'INSERT OR REPLACE INTO responses (url, etag, last_modified, body, fetched) '
+               'VALUES (?, ?, ?, ?, ?)', (url, etag, last_modified, body, time.time()))
+
+   def close(self):
+      self.connection.close()
+
+class GitHubClient:
+   """
+   Client of the GitHub REST API at api_url, which may be a local stand-in server.
+   Thread safe, up to workers requests sharing a pool of keep-alive connections.
+   Responses are cached at cache_path, if given.
+   """
+
+   def __init__(self, api_url=DEFAULT_API_URL, auth=None, cache_path=None,
+                workers=DEFAULT_WORKERS):
+      self.api_url = api_url.rstrip('/')
+      self.workers = workers
+      self._session = requests.Session()
+      self._session.auth = auth
+      self._session.headers['Accept'] = 'application/vnd.github+json'
+      adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+      self._session.mount('http://', adapter)
+      self._session.mount('https://', adapter)
+      self._rate_limiter = RateLimiter()
+      self._cache = ResponseCache(cache_path) if cache_path else None
+
+   @staticmethod
+   def _rate_limit_wait(response):
+      # Seconds to wait before retrying a rate limited response, or None if it
+      # wasn't rate limited.
+      if response.status_code not in (403, 429):
+         return None
+      if 'Retry-After' in response.headers:
+         return float(response.headers['Retry-After'])
+      if response.headers.get('X-RateLimit-Remaining') == '0':
+         return max(float(response.headers['X-RateLimit-Reset']) - time.time(), 0) + RESET_MARGIN
+      return None
+
+   def get_json(self, path):
+      """
+      Returns the decoded JSON response to a GET of path, i.e '/search/repositories?q=foo',
+      waiting out and retrying rate limited requests.
+      """
+      url = self.api_url + path
+      cached = self._cache.get(url) if self._cache else None
+      headers = {}
+      if cached:
+         etag, last_modified, _ = cached
+         if etag:
+            headers['If-None-Match'] = etag
+         if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+      for _ in range(MAX_ATTEMPTS):
+         self._rate_limiter.acquire()
+         try:
+            response = self._session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+         except requests.RequestException as e:
+            self._rate_limiter.release()
+            raise GitHubError('GET %s failed: %s' % (url, e))
+         self._rate_limiter.release(response.headers)
+
+         if response.status_code == 304 and cached:
+            return json.loads(cached[2])
+         wait = self._rate_limit_wait(response)
+         if wait is not None:
+            self._rate_limiter.pause(wait)
+            continue
+         if not response.ok:
+            raise GitHubError('GET %s returned %d' % (url, response.status_code))
+
+         etag = response.headers.get('ETag')
+         last_modified = response.headers.get('Last-Modified')
+         if self._cache and (etag or last_modified):
+            self._cache.put(url, etag, last_modified, response.text)
+         return response.json()
+
+      raise GitHubError('GET %s still rate limited after %d attempts' % (url, MAX_ATTEMPTS))
+
+   def close(self):
+      self._session.close()
+      if self._cache:
+         self._cache.close()
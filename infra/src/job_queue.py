@@ -0,0 +1,160 @@
+"""
+Contains a durable SQLite work queue of packages, letting any number of harness
+workers, on one machine or several sharing a filesystem, split a run between them.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import time
+
+from results_stream import package_key
+
+# Job states.
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+# Seconds a claimed job stays leased to its worker without a heartbeat.
+DEFAULT_LEASE_SECONDS = 15 * 60
+# Claims of a job, including ones whose lease expired, before it's given up on.
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds to wait on another worker holding the database lock.
+SQLITE_TIMEOUT = 60
+
+def default_worker_id():
+   return '%s:%d' % (socket.gethostname(), os.getpid())
+
+class JobQueue:
+   """
+   Queue of package infos, in the order loaded, each claimed by a single worker at a
+   time. A claim is a lease which the worker extends with heartbeats. Once a lease
+   expires, say because its worker crashed, the job is claimed again by another.
+   Results are committed per package, so finished work survives any crash.
+
+   Uses SQLite's default rollback journal rather than WAL, which doesn't work over
+   network filesystems. Leases are timed by the workers' clocks, which should agree
+   to well within a lease.
+   """
+
+   def __init__(self, path, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                max_attempts=DEFAULT_MAX_ATTEMPTS):
+      self.path = path
+      self.worker_id = worker_id or default_worker_id()
+      self.lease_seconds = lease_seconds
+      self.max_attempts = max_attempts
+      # Transactions are begun explicitly, so claims can take the write lock upfront.
+      self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+      self.connection.execute("""
+         CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            package_key TEXT NOT NULL UNIQUE,
+            package_info TEXT NOT NULL,
+            state TEXT NOT NULL,
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT)""")
+      self.connection.execute("""
+         CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)""")
+
+   def load(self, package_infos):
+      """
+      Adds the packages not already queued, returning how many were added. Every
+      worker of a run can load the same package list.
+      """
+      rows = [(package_key(package_info), json.dumps(package_info), PENDING)
+              for package_info in package_infos]
+      self.connection.execute('BEGIN IMMEDIATE')
+      try:
+         before = self.connection.total_changes
+         self.connection.executemany(
+            'INSERT OR IGNORE INTO jobs (package_key, package_info, state) VALUES (?, ?, ?)',
+            rows)
+         added = self.connection.total_changes - before
+         self.connection.execute('COMMIT')
+      except:
+         self.connection.execute('ROLLBACK')
+         raise
+      return added
+
+   def claim(self):
+      """
+      Leases the first pending job, or job whose lease expired, to this worker.
+      Returns its (id, package info), or None once no job is left to claim.
+      """
+      now = time.time()
+      self.connection.execute('BEGIN IMMEDIATE')
+      try:
+         # Give up on jobs whose last allowed attempt never finished.
+         self.connection.execute(
+            'UPDATE jobs SET state = ?, worker = NULL, error = ? '
+            'WHERE state = ? AND lease_expires < ? AND attempts >= ?',
+            (FAILED, 'lease expired', LEASED, now, self.max_attempts))
+         row = self.connection.execute(
+            'SELECT id, package_info FROM jobs '
+            'WHERE state = ? OR (state = ? AND lease_expires < ?) '
+            'ORDER BY id LIMIT 1', (PENDING, LEASED, now)).fetchone()
+         if row:
+            self.connection.execute(
+               'UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, '
+               'attempts = attempts + 1 WHERE id = ?',
+               (LEASED, self.worker_id, now + self.lease_seconds, row[0]))
+         self.connection.execute('COMMIT')
+      except:
+         self.connection.execute('ROLLBACK')
+         raise
+      if not row:
+         return None
+      return row[0], json.loads(row[1])
+
+   def heartbeat(self, job_ids):
+      """
+      Extends the leases this worker holds on the jobs.
+      """
+      lease_expires = time.time() + self.lease_seconds
+      self.connection.executemany(
+         'UPDATE jobs SET lease_expires = ? WHERE id = ? AND state = ? AND worker = ?',
+         [(lease_expires, job_id, LEASED, self.worker_id) for job_id in job_ids])
+
+   def complete(self, job_id, result):
+      """
+      Commits the result of a job. Returns False, dropping the result, if the lease
+      was lost and the job claimed by another worker.
+      """
+      cursor = self.connection.execute(
+         'UPDATE jobs SET state = ?, result = ?, error = NULL, lease_expires = NULL '
+         'WHERE id = ? AND state = ? AND worker = ?',
+         (DONE, json.dumps(result), job_id, LEASED, self.worker_id))
+      return cursor.rowcount == 1
+
+   def fail(self, job_id, error):
+      """
+      Records that the job failed, putting it back to be retried unless it's out
+      of attempts.
+      """
+      self.connection.execute(
+         'UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+         'worker = NULL, lease_expires = NULL, error = ? '
+         'WHERE id = ? AND state = ? AND worker = ?',
+         (self.max_attempts, FAILED, PENDING, error, job_id, LEASED, self.worker_id))
+
+   def iter_results(self):
+      """
+      Yields the results of every finished job, in the order the packages were
+      loaded.
+      """
+      for row in self.connection.execute(
+            'SELECT result FROM jobs WHERE state = ? ORDER BY id', (DONE,)):
+         yield json.loads(row[0])
+
+   def state_counts(self):
+      """
+      Returns a mapping from job state to the number of jobs in it.
+      """
+      return dict(self.connection.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+
+   def close(self):
+      self.connection.close()
@@ -10,9 +10,13 @@ import requests
 import shutil
 import subprocess
 import sys
-import time
 import yaml
 
+from apt_index import AptIndex, DEFAULT_PACKAGES_GLOB, DEFAULT_SOURCES_GLOB, vcs_git_url
+from github_client import (DEFAULT_API_URL, DEFAULT_WORKERS, GitHubClient, GitHubError,
+                           map_concurrently)
+from url_resolver import UrlResolver
+
 DEFAULT_OUT_FILENAME = 'package_finder_results.json'
 DOWNLOADS_PATH = 'package_downloads'
 CHANGELOG_PATH = 'debian/changelog'
@@ -23,12 +27,13 @@ CPP_REGEX_STRINGS = [
 CPP_REGEXES = [re.compile(regex) for regex in CPP_REGEX_STRINGS]
 USE_DEBTAGS = True
 DEBTAGS_PATH = 'debtags_cpp.txt'
-GITHUB_SEARCH_URLS = [
+GITHUB_SEARCH_PATHS = [
    # Search all repos.
-   'https://api.github.com/search/repositories?q=%s&sort=stars&order=desc',
+   '/search/repositories?q=%s&sort=stars&order=desc',
    # Search only mirrors.
-   'https://api.github.com/search/repositories?q=%s+mirror:true&sort=stars&order=desc',
+   '/search/repositories?q=%s+mirror:true&sort=stars&order=desc',
 ]
+DEFAULT_GITHUB_CACHE_FILENAME = 'github_cache.sqlite'
 
 class PackageError(Exception):
    pass
@@ -37,11 +42,15 @@ class BenignError(Exception):
    pass
 
 class PackageFinder:
-   def __init__(self, num_packages, package_repos_contents, start_offset, github_auth):
+   def __init__(self, num_packages, package_repos_contents, start_offset, github_client,
+                url_resolver, apt_index):
       self._num_packages = num_packages
       self._package_repos_contents = package_repos_contents
       self._start_offset = start_offset
-      self._github_auth = github_auth
+      self._github_client = github_client
+      self._url_resolver = url_resolver
+      # Metadata of every package in the apt index files, loaded upfront.
+      self._apt_index = apt_index
 
       # [(repo_name, rank, package_name)]
       self._packages_list = []
@@ -117,35 +126,25 @@ class PackageFinder:
 
       return version_string[1:-1]
 
-   @staticmethod
-   def _get_package_attribute(package_name, attribute):
-      output = subprocess.check_output(('apt show %s' % package_name).split(),
-                                       stderr=open(os.devnull, 'w')).splitlines()
-      package_info = dict([line.split(': ', 1) for line in output if len(line.split(': ', 1)) == 2])
-      return package_info[attribute] if attribute in package_info else None
+   def _get_package_attribute(self, package_name, attribute):
+      package = self._apt_index.lookup(package_name)
+      return package[attribute] if package else None
 
-   @staticmethod
-   def _extract_maintainer(package_name):
-      return PackageFinder._get_package_attribute(package_name, 'Maintainer')
+   def _extract_maintainer(self, package_name):
+      return self._get_package_attribute(package_name, 'maintainer')
 
-   @staticmethod
-   def _extract_version_number(package_name):
-      return PackageFinder._get_package_attribute(package_name, 'Version')
+   def _extract_version_number(self, package_name):
+      return self._get_package_attribute(package_name, 'version')
 
-   @staticmethod
-   def _get_debcheckout_info(package_name):
-      try:
-         # Get debcheckout details of the repo.
-         output = subprocess.check_output(
-            ('debcheckout -d %s' % package_name).split(),
-            stderr=open(os.devnull, 'w')).splitlines()
-         attributes = dict([(s[0], ' '.join(s[1:]))
-                            for line in output
-                            for s in [line.split()] if len(s) >= 2])
-      except:
-         return (None, None)
-
-      return (attributes.get('type'), attributes.get('url'))
+   def _extract_source_package(self, package_name):
+      return self._get_package_attribute(package_name, 'source_package')
+
+   def _extract_source_version(self, package_name):
+      return self._get_package_attribute(package_name, 'source_version')
+
+   def _extract_vcs_git_url(self, package_name):
+      vcs = self._get_package_attribute(package_name, 'vcs')
+      return vcs_git_url(vcs) if vcs else None
 
    def _is_cpp_project(self, package_name):
       if USE_DEBTAGS:
@@ -190,53 +189,35 @@ class PackageFinder:
 
          return (True, version_number)
 
-   @staticmethod
-   def _get_git_repo(package_name, github_auth):
-      # Search for repo in GitHub.
-      for github_search_url in GITHUB_SEARCH_URLS:
+   def _search_github_repo(self, package_name):
+      # Search for repo in GitHub. The client waits out the rate limit.
+      for github_search_path in GITHUB_SEARCH_PATHS:
          try:
-            valid_results = False
-            while not valid_results:
-               # Issue search for repositories with this package name.
-               github_search = requests.get(github_search_url % package_name, auth=github_auth)
-               results = github_search.json()
-
-               # Wait then retry if request failed.
-               if 'items' not in results:
-                  time.sleep(10)
-                  continue
-               else:
-                  valid_results = True
-
-               # Find all repositories that match this name. If not exactly one, continue.
-               matching_repos = [repo for repo in results['items'] if repo['name'] == package_name]
-               if len(matching_repos) != 1:
-                  continue
-               repo = matching_repos[0]
+            # Issue search for repositories with this package name.
+            results = self._github_client.get_json(github_search_path % package_name)
+         except (GitHubError, ValueError) as e:
+            print 'Error: GitHub search for %s: %s' % (package_name, str(e))
+            continue
+         if 'items' not in results:
+            continue
 
-               # Extract repo clone URL.
-               return repo['clone_url']
-         except Exception as e:
+         # Find all repositories that match this name. If not exactly one, continue.
+         matching_repos = [repo for repo in results['items'] if repo['name'] == package_name]
+         if len(matching_repos) != 1:
             continue
+         repo = matching_repos[0]
 
-      # Search for repo in debcheckout.
-      (repo_type, repo_url) = PackageFinder._get_debcheckout_info(package_name)
-      if repo_type != 'git':
-         return None
+         # Extract repo clone URL.
+         return repo['clone_url']
 
-      # Try to access URL, following redirect if necessary.
-      try:
-         r = requests.head(repo_url, allow_redirects=True)
-         if not r.ok:
-            return None
-         return r.url
-      except:
-         return None
+      return None
 
    def _generate_package_infos(self):
+      # [(repo_name, rank, package_name, version_number)]
+      found_packages = []
       for repo_name, rank, package_name in self._packages_list[self._start_offset:]:
          # If we've found enough packages, stop.
-         if len(self._package_infos) == self._num_packages:
+         if len(found_packages) == self._num_packages:
             break
 
          print 'Extracting information for: (%s, %s, %s)' % (repo_name, rank, package_name)
@@ -247,15 +228,31 @@ class PackageFinder:
             continue
 
          print 'Success: project meets all requirements\n'
-
-         # Get git repo URL if it exists.
-         git_repo_url = self._get_git_repo(package_name, self._github_auth)
-
+         found_packages.append((repo_name, rank, package_name, version_number))
+
+      # Get git repo URLs if they exist, searching for several packages at once.
+      print 'Finding git repos of %d package(s).' % len(found_packages)
+      package_names = [package_name for _, _, package_name, _ in found_packages]
+      git_repo_urls = map_concurrently(self._search_github_repo, package_names,
+                                       self._github_client.workers)
+
+      # Otherwise use the repos the source packages declare, following their redirects
+      # all at once.
+      declared_urls = [None if git_repo_url else self._extract_vcs_git_url(package_name)
+                       for package_name, git_repo_url in zip(package_names, git_repo_urls)]
+      resolved_urls = self._url_resolver.resolve_all(url for url in declared_urls if url)
+      git_repo_urls = [git_repo_url or resolved_urls.get(declared_url)
+                       for git_repo_url, declared_url in zip(git_repo_urls, declared_urls)]
+
+      for (repo_name, rank, package_name, version_number), git_repo_url in \
+            zip(found_packages, git_repo_urls):
          # TODO(jayden): Get build log.
          build_log_url = None
 
          # Get maintainer information.
          maintainer = self._extract_maintainer(package_name)
+         source_package = self._extract_source_package(package_name)
+         source_version = self._extract_source_version(package_name)
 
          package_info = {
             'package_name': package_name,
@@ -271,6 +268,10 @@ class PackageFinder:
             package_info['build_log_url'] = build_log_url
          if maintainer:
             package_info['maintainer'] = maintainer
+         if source_package:
+            package_info['source_package'] = source_package
+         if source_version:
+            package_info['source_version'] = source_version
 
          self._package_infos.append(package_info)
 
@@ -298,6 +299,20 @@ if __name__ == '__main__':
    parser.add_argument('--start-offset', help='package index to start at', default=0)
    parser.add_argument('--use-github-auth', help='Login to GitHub, ups rate limit',
                        action='store_true')
+   parser.add_argument('--github-cache',
+                       help='GitHub response cache file, default: %s' % DEFAULT_GITHUB_CACHE_FILENAME,
+                       default=DEFAULT_GITHUB_CACHE_FILENAME)
+   parser.add_argument('--github-workers', type=int, default=DEFAULT_WORKERS,
+                       help='GitHub requests to make at once, default: %d' % DEFAULT_WORKERS)
+   parser.add_argument('--github-api-url', default=DEFAULT_API_URL,
+                       help='GitHub API to search, i.e a local stand-in, default: %s'
+                            % DEFAULT_API_URL)
+   parser.add_argument('--packages-index', action='append', default=[],
+                       help='Packages index file to load package metadata from, which may be '
+                            'compressed; repeatable, default: %s' % DEFAULT_PACKAGES_GLOB)
+   parser.add_argument('--sources-index', action='append', default=[],
+                       help='Sources index file to load package metadata from, which may be '
+                            'compressed; repeatable, default: %s' % DEFAULT_SOURCES_GLOB)
    args = parser.parse_args()
 
    # Verify repo info file is present.
@@ -318,10 +333,24 @@ if __name__ == '__main__':
    else:
       github_auth = None
 
+   # Load the apt index files, falling back to apt's lists when none are given.
+   if args.packages_index or args.sources_index:
+      package_index = AptIndex.load(args.packages_index, args.sources_index)
+   else:
+      package_index = AptIndex.load_apt_lists()
+   print 'Loaded metadata for %d package(s).' % len(package_index)
+
+   github_client = GitHubClient(args.github_api_url, github_auth,
+                                os.path.join(os.getcwd(), args.github_cache), args.github_workers)
+   url_resolver = UrlResolver()
+
    # Run package finder.
    package_finder = PackageFinder(int(args.num_packages), package_repos_contents,
-                                  int(args.start_offset), github_auth)
+                                  int(args.start_offset), github_client, url_resolver,
+                                  package_index)
    results = package_finder.run()
+   github_client.close()
+   url_resolver.close()
 
    # Save results to output file.
    with open(os.path.join(os.getcwd(), args.out), 'w') as f:
@@ -1,47 +1,273 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 
 import argparse
-import collections
+import array
+import errno
 import json
 import os
+import sys
+
+import numpy as np
 
 DEFAULT_OUT_FILENAME = 'analyzed_results.json'
 BUCKETS = [100, 1000, 10000, 30000]
+# Characters read at a time when streaming a JSON array of results.
+READ_CHUNK_SIZE = 1024 * 1024
+# Value of a column for a package without one.
+MISSING = -1
+# Columns every package has, besides one per detector feature, i.e 'unique_ptr.detected'
+# or 'cpp_version'.
+RANK = 'rank'
+CREATION_YEAR = 'creation_year'
+# Column derived from the rank when grouping, the first of BUCKETS the rank is within,
+# or OVERFLOW_BUCKET past the last of them.
+RANK_BUCKET = 'rank_bucket'
+OVERFLOW_BUCKET = None
+# Value of the rank bucket column in the overflow bucket.
+OVERFLOW_BUCKET_VALUE = BUCKETS[-1] + 1
+# Array typecodes of integer, float and categorical columns.
+NUMERIC_TYPECODE = 'q'
+FLOAT_TYPECODE = 'd'
+CATEGORICAL_TYPECODE = 'i'
+
+def _iter_json_array(f):
+   # Yields the elements of a JSON array one at a time, holding at most a chunk
+   # of the file and the element being decoded in memory.
+   decoder = json.JSONDecoder()
+   buffer = ''
+   position = 0
+   eof = False
+   started = False
+   while True:
+      while position < len(buffer) and buffer[position] in ' \t\r\n,':
+         position += 1
+      if position == len(buffer) or not started:
+         if position == len(buffer):
+            if eof:
+               return
+            chunk = f.read(READ_CHUNK_SIZE)
+            buffer, position, eof = chunk, 0, not chunk
+            continue
+         if buffer[position] != '[':
+            raise ValueError('detection results are not a JSON array')
+         position += 1
+         started = True
+         continue
+      if buffer[position] == ']':
+         return
+      try:
+         result, position = decoder.raw_decode(buffer, position)
+      except ValueError:
+         # The element continues past the buffer.
+         chunk = f.read(READ_CHUNK_SIZE)
+         if not chunk:
+            raise
+         buffer, position = buffer[position:] + chunk, 0
+         continue
+      yield result
+
+def iter_results(path):
+   """
+   Yields the results of a detection results file one at a time, whether it's the
+   JSON array or the JSON lines the harness outputs.
+   """
+   with open(path) as f:
+      first = f.read(1)
+      while first.isspace():
+         first = f.read(1)
+      f.seek(0)
+      if first == '[':
+         for result in _iter_json_array(f):
+            yield result
+      else:
+         for line in f:
+            if line.strip():
+               yield json.loads(line)
+
+def _bucket_label(value):
+   return OVERFLOW_BUCKET if value == OVERFLOW_BUCKET_VALUE else int(value)
+
+def _group_order(group):
+   # Sort key of a (key, total) group, the overflow bucket after the other buckets.
+   key = group[0] if isinstance(group[0], tuple) else (group[0],)
+   return [(value is OVERFLOW_BUCKET, value) for value in key]
+
+def _typecode(value):
+   # Typecode of the column for a value, numeric for numbers and categorical otherwise.
+   if isinstance(value, bool) or not isinstance(value, (int, float)):
+      return CATEGORICAL_TYPECODE
+   return NUMERIC_TYPECODE if isinstance(value, int) else FLOAT_TYPECODE
+
+class Column:
+   """
+   Array-backed column of an integer, float or categorical value per package, MISSING
+   where a package has none. A categorical column holds codes into its labels.
+   """
+
+   def __init__(self, typecode, length):
+      self.categorical = typecode == CATEGORICAL_TYPECODE
+      self.values = array.array(typecode, [MISSING]) * length
+      # [label], indexed by code.
+      self.labels = [] if self.categorical else None
+      self._codes = {}
+
+   def append(self, row, value):
+      """
+      Sets the value of a row, leaving the rows since the last value set missing.
+      """
+      self.pad(row)
+      if self.categorical:
+         if not isinstance(value, str):
+            value = str(value)
+         code = self._codes.get(value)
+         if code is None:
+            code = self._codes[value] = len(self.labels)
+            self.labels.append(value)
+         self.values.append(code)
+      elif _typecode(value) in (NUMERIC_TYPECODE, self.values.typecode):
+         # Integers are also taken by float columns.
+         self.values.append(value)
+      else:
+         self.values.append(MISSING)
+
+   def pad(self, length):
+      if len(self.values) < length:
+         self.values.extend(array.array(self.values.typecode, [MISSING]) *
+                            (length - len(self.values)))
 
-def get_bucket(x):
-   for bucket in BUCKETS:
-      if int(x) <= bucket:
-         return bucket
+   def array(self):
+      return np.frombuffer(self.values, dtype=self.values.typecode)
+
+   def label(self, value):
+      if self.categorical:
+         return self.labels[value]
+      return float(value) if self.values.typecode == FLOAT_TYPECODE else int(value)
 
 class DetectionAnalyzer:
+   """
+   Columnar store of detection results, read a package at a time into a column for
+   the rank, the creation year and each detector feature, which counts are then
+   grouped from all at once.
+   """
+
    def __init__(self, detection_results):
-      self._detection_results = detection_results
-      # {bucket: {detector_name: {feature_name: {result: count}}}}
-      self._analyzed_results = collections.defaultdict(
-         lambda: collections.defaultdict(
-            lambda: collections.defaultdict(
-               lambda: collections.defaultdict(int))))
+      self._length = 0
+      # {column_name: Column}
+      self._columns = {RANK: Column(NUMERIC_TYPECODE, 0),
+                       CREATION_YEAR: Column(NUMERIC_TYPECODE, 0)}
+      for result in detection_results:
+         self._add(result)
+      for column in self._columns.values():
+         column.pad(self._length)
+
+   def _set(self, column_name, value):
+      column = self._columns.get(column_name)
+      if column is None:
+         column = self._columns[column_name] = Column(_typecode(value), self._length)
+      column.append(self._length, value)
+
+   def _add(self, result):
+      self._set(RANK, int(result['rank']))
+      creation_date = result.get('creation_date')
+      self._set(CREATION_YEAR, int(creation_date[:4]) if creation_date else MISSING)
+      for feature_name, feature_result in result['detection_tool_output'].items():
+         if isinstance(feature_result, dict):
+            # i.e {'detected': 'yes', 'occurrences': 3}. Nested values, such as the
+            # per-object results of the hardening features' aggregates, and unset
+            # values are left out, so columns hold a bounded set of labels.
+            for field, value in feature_result.items():
+               if value is not None and not isinstance(value, (dict, list)):
+                  self._set('%s.%s' % (feature_name, field), value)
+         else:
+            self._set(feature_name, feature_result)
+      self._length += 1
+
+   def feature_columns(self):
+      return sorted(name for name in self._columns if name not in (RANK, CREATION_YEAR))
+
+   def _key(self, name):
+      # Returns the values of a column to group by, and how to label them.
+      if name == RANK_BUCKET:
+         ranks = self._columns[RANK].array()
+         indexes = np.searchsorted(BUCKETS, ranks, side='left')
+         buckets = np.append(BUCKETS, OVERFLOW_BUCKET_VALUE)[indexes]
+         return np.where(ranks == MISSING, MISSING, buckets), _bucket_label
+      if name not in self._columns:
+         raise KeyError('no such column: %s' % name)
+      column = self._columns[name]
+      return column.array(), column.label
+
+   def group_by(self, keys, sum_column=None):
+      """
+      Returns a mapping from each combination of values of the key columns to the
+      number of packages with it, or their sum of the numeric sum_column. Packages
+      missing any of the keys are left out.
+      """
+      if sum_column and (sum_column not in self._columns or
+                         self._columns[sum_column].categorical):
+         raise KeyError('no such numeric column: %s' % sum_column)
+      values, labels = zip(*[self._key(key) for key in keys])
+      present = np.logical_and.reduce([key_values != MISSING for key_values in values])
+      if not present.any():
+         return {}
+
+      # Each key's distinct values, and each package's index into them, combined into
+      # a single index of the package's combination of values.
+      key_uniques, key_indexes = zip(*[np.unique(key_values[present], return_inverse=True)
+                                       for key_values in values])
+      combined = np.ravel_multi_index([indexes.reshape(-1) for indexes in key_indexes],
+                                      [len(uniques) for uniques in key_uniques])
+      combinations, inverse = np.unique(combined, return_inverse=True)
+      inverse = inverse.reshape(-1)
+      if sum_column:
+         sums = self._columns[sum_column].array()[present]
+         totals = np.bincount(inverse, weights=np.where(sums == MISSING, 0, sums),
+                              minlength=len(combinations))
+      else:
+         totals = np.bincount(inverse, minlength=len(combinations))
+
+      key_combinations = zip(*[uniques[indexes] for uniques, indexes in zip(
+         key_uniques, np.unravel_index(combinations, [len(uniques) for uniques in key_uniques]))])
+      total_type = (float if sum_column and
+                    self._columns[sum_column].values.typecode == FLOAT_TYPECODE else int)
+      return dict((tuple(label(value) for label, value in zip(labels, combination)),
+                   total_type(total))
+                  for combination, total in zip(key_combinations, totals))
 
    def run(self):
-      # For every package, extract the features and record
-      # the result for each feature in a dictionary mapping
-      # features to feature results and their counts
-      for package_detection_result in self._detection_results:
-         detectors = package_detection_result['detection_tool_output']
-         bucket = get_bucket(package_detection_result['rank'])
-         for (detector_name, features) in detectors.iteritems():
-            for (feature_name, feature_result) in features.iteritems():
-               self._analyzed_results[bucket][detector_name][feature_name][feature_result] += 1
-
-      return self._analyzed_results
+      """
+      Returns, for each rank bucket, each feature's count of packages by result:
+      {bucket: {feature_name: {field: {result: count}}}}, without the field level for
+      features with a single result. A feature with a single result in some packages
+      and fields in others has its fields counted as features of their own, i.e
+      'stack-protector.all'.
+      """
+      analyzed_results = {}
+      column_names = self.feature_columns()
+      for column_name in column_names:
+         feature_name, _, field = column_name.partition('.')
+         if field and feature_name in column_names:
+            feature_name, field = column_name, ''
+         for (bucket, feature_result), count in sorted(
+               self.group_by([RANK_BUCKET, column_name]).items(), key=_group_order):
+            results = analyzed_results.setdefault(bucket, {}).setdefault(feature_name, {})
+            if field:
+               results = results.setdefault(field, {})
+            results[feature_result] = count
+      return dict(sorted(analyzed_results.items(), key=_group_order))
 
 if __name__ == '__main__':
    parser = argparse.ArgumentParser()
    parser.add_argument('detection_results',
-                       help=('JSON file with detection results, generated by '
+                       help=('JSON or JSON lines file with detection results, generated by '
                              'detection_harness'))
    parser.add_argument('--out', help="output file path, default: %s" % DEFAULT_OUT_FILENAME,
                        default=DEFAULT_OUT_FILENAME)
+   parser.add_argument('--group-by', nargs='+', metavar='COLUMN',
+                       help=('count packages by these columns instead, i.e %s %s '
+                             'unique_ptr.detected' % (RANK_BUCKET, CREATION_YEAR)))
+   parser.add_argument('--sum', metavar='COLUMN',
+                       help='with --group-by, sum this numeric column instead of counting')
    args = parser.parse_args()
 
    # Verify detection results.
@@ -50,12 +276,19 @@ if __name__ == '__main__':
       sys.stderr.write('detection results file "%s" does not exist' % args.detection_results)
       exit(errno.ENOENT)
 
-   # Read detection results.
-   with open(detection_results_path) as f:
-      detection_results = json.load(f)
-
-   analyzer = DetectionAnalyzer(detection_results)
-   analyzed_results = analyzer.run()
+   # Stream detection results into columns.
+   analyzer = DetectionAnalyzer(iter_results(detection_results_path))
+   if args.group_by:
+      try:
+         groups = analyzer.group_by(args.group_by, args.sum)
+      except KeyError as e:
+         sys.stderr.write('%s, columns: %s\n' % (e.args[0], ' '.join(
+            [RANK, CREATION_YEAR, RANK_BUCKET] + analyzer.feature_columns())))
+         exit(errno.EINVAL)
+      analyzed_results = [dict(list(zip(args.group_by, key)) + [(args.sum or 'count', total)])
+                          for key, total in sorted(groups.items(), key=_group_order)]
+   else:
+      analyzed_results = analyzer.run()
 
    # Save results to output file.
    with open(os.path.join(os.getcwd(), args.out), 'w') as f:
@@ -0,0 +1,102 @@
+"""
+Contains the streaming form of the detection results: one JSON line per package,
+flushed as each package finishes so a crashed run loses at most the package in
+progress, and the conversion back to the legacy JSON array.
+"""
+
+import errno
+import json
+import os
+
+# Bytes read at a time when looking back for the last complete line.
+REPAIR_BLOCK_SIZE = 4096
+
+def package_key(package):
+   """
+   Returns the package=version key of a package info or detection result.
+   """
+   return '%s=%s' % (package['package_name'], package['version_number'])
+
+def _repair(path):
+   # Drops a partial last line left by a crash mid-write, so appended lines
+   # start on a line of their own.
+   with open(path, 'rb+') as f:
+      end = f.seek(0, os.SEEK_END)
+      while end > 0:
+         start = max(end - REPAIR_BLOCK_SIZE, 0)
+         f.seek(start)
+         newline = f.read(end - start).rfind(b'\n')
+         if newline != -1:
+            end = start + newline + 1
+            break
+         end = start
+      f.truncate(end)
+
+def _iter_lines(path):
+   # Yields (offset, result) for each line of a results file.
+   with open(path, 'rb') as f:
+      offset = 0
+      for line in f:
+         if line.endswith(b'\n'):
+            yield offset, json.loads(line)
+         offset += len(line)
+
+def completed_keys(path):
+   """
+   Returns the package=version keys of the results in a results file, empty if
+   there is no file.
+   """
+   if not os.path.isfile(path):
+      return set()
+   return set(package_key(result) for _, result in _iter_lines(path))
+
+def iter_results(path):
+   """
+   Yields the results of a results file in rank order. Only the ranks and offsets
+   of the results are held in memory, each result being read back in turn.
+   """
+   # Ranks are strings in the package infos, so compared as numbers.
+   index = sorted((int(result['rank']), line_number, offset)
+                  for line_number, (offset, result) in enumerate(_iter_lines(path)))
+   with open(path, 'rb') as f:
+      for _, _, offset in index:
+         f.seek(offset)
+         yield json.loads(f.readline())
+
+def write_json_array(results, path):
+   """
+   Writes the results to path as the indented JSON array the harness has always
+   output, one result at a time.
+   """
+   with open(path, 'w') as f:
+      f.write('[')
+      separator = '\n'
+      for result in results:
+         # Indented as an element of the array.
+         f.write(separator + '    ' + json.dumps(result, indent=4).replace('\n', '\n    '))
+         separator = ',\n'
+      f.write('\n]\n' if separator != '\n' else ']\n')
+
+class ResultsStream:
+   """
+   Appends results to a JSON lines file as they're produced, flushing each one.
+   Resuming appends to the file's results, otherwise a file with results is only
+   replaced if overwrite is set, raising an IOError with errno EEXIST if not.
+   """
+
+   def __init__(self, path, resume=False, overwrite=False):
+      self.path = path
+      if resume and os.path.isfile(path):
+         _repair(path)
+         self._file = open(path, 'a')
+      else:
+         if not overwrite and os.path.isfile(path) and os.path.getsize(path):
+            raise IOError(errno.EEXIST, 'results file already exists', path)
+         self._file = open(path, 'w')
+
+   def write(self, result):
+      self._file.write(json.dumps(result) + '\n')
+      self._file.flush()
+
+   def close(self):
+      self._file.close()
@@ -0,0 +1,114 @@
+"""
+Resolves repo URLs to where they redirect to, in batches over a shared pool of
+keep-alive connections.
+"""
+
+import threading
+
+import requests
+
+from github_client import map_concurrently
+
+try:
+   from urllib.parse import urlsplit, urlunsplit
+except ImportError:
+   from urlparse import urlsplit, urlunsplit
+
+DEFAULT_WORKERS = 16
+REQUEST_TIMEOUT = 30
+# Attempts at a request failing to connect before giving up on the URL.
+CONNECT_ATTEMPTS = 2
+# URLs of a host in a row failing to connect before the host is taken to be dead.
+DEAD_HOST_FAILURES = 3
+
+class UrlResolver:
+   """
+   Follows the redirects of URLs with HEAD requests, memoizing what it learns of
+   each host. Once DEAD_HOST_FAILURES URLs of a host in a row fail to connect, its
+   other URLs resolve to None without being requested; timeouts don't count, as
+   slow hosts aren't dead. Once a host moves, i.e http://host to https://host or
+   git.debian.org to salsa.debian.org with the path kept, its other URLs are
+   rewritten the same way before being requested, saving the redirect hop.
+   """
+
+   def __init__(self, workers=DEFAULT_WORKERS):
+      self.workers = workers
+      self._session = requests.Session()
+      adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+      self._session.mount('http://', adapter)
+      self._session.mount('https://', adapter)
+      self._lock = threading.Lock()
+      # Map from URL -> resolved URL, or None if it doesn't resolve.
+      self._resolved = {}
+      # Map from (scheme, host) -> (scheme, host) it moved to.
+      self._moved_hosts = {}
+      # set([(scheme, host)])
+      self._dead_hosts = set()
+      # Map from (scheme, host) -> number of its URLs in a row failing to connect.
+      self._host_failures = {}
+
+   def _head(self, url):
+      # Returns the response to a HEAD request of the URL, retrying it if it fails
+      # to connect.
+      for attempt in range(CONNECT_ATTEMPTS):
+         try:
+            return self._session.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+         except requests.Timeout:
+            # Subclassed by ConnectTimeout, which is also a ConnectionError.
+            raise
+         except requests.ConnectionError:
+            if attempt == CONNECT_ATTEMPTS - 1:
+               raise
+
+   def _resolve(self, url):
+      parts = urlsplit(url)
+      host = (parts.scheme, parts.netloc)
+      with self._lock:
+         if url in self._resolved:
+            return self._resolved[url]
+         # The moved host's URL is still requested, as the repo may be gone from it.
+         request_host = self._moved_hosts.get(host, host)
+         if request_host in self._dead_hosts:
+            return None
+
+      try:
+         response = self._head(urlunsplit(request_host + tuple(parts[2:])))
+         resolved_url = response.url if response.ok else None
+      except requests.Timeout:
+         # Left unresolved rather than memoized, as it may be reached later.
+         return None
+      except requests.ConnectionError:
+         with self._lock:
+            failures = self._host_failures.get(request_host, 0) + 1
+            self._host_failures[request_host] = failures
+            if failures >= DEAD_HOST_FAILURES:
+               self._dead_hosts.add(request_host)
+         return None
+      except requests.RequestException:
+         resolved_url = None
+
+      with self._lock:
+         self._host_failures.pop(request_host, None)
+         self._resolved[url] = resolved_url
+         if resolved_url:
+            resolved_parts = urlsplit(resolved_url)
+            resolved_host = (resolved_parts.scheme, resolved_parts.netloc)
+            if resolved_host != host and tuple(resolved_parts[2:]) == tuple(parts[2:]):
+               self._moved_hosts[host] = resolved_host
+      return resolved_url
+
+   def resolve_all(self, urls):
+      """
+      Returns a mapping from each URL to the URL it redirects to, or None if it
+      can't be reached. The first URL of each host is resolved before the others,
+      so they can be resolved from what it showed of the host.
+      """
+      urls = list(set(urls))
+      first_urls = {}
+      for url in sorted(urls):
+         first_urls.setdefault(urlsplit(url)[:2], url)
+      map_concurrently(self._resolve, first_urls.values(), self.workers)
+      return dict(zip(urls, map_concurrently(self._resolve, urls, self.workers)))
+
+   def close(self):
+      self._session.close()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The infra scripts are run from src, importing the detector's modules from its
+# own directory as the harness does.
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_PATH, '..', 'src'))
+sys.path.append(os.path.join(TESTS_PATH, '..', '..', 'detector'))
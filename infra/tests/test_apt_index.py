@@ -0,0 +1,81 @@
+import bz2
+import gzip
+import os
+import shutil
+
+import pytest
+
+import apt_index
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PACKAGES_PATH = os.path.join(FIXTURES_PATH, 'Packages')
+SOURCES_PATH = os.path.join(FIXTURES_PATH, 'Sources')
+
+
+def _compress(path, directory, suffix):
+   compressed_path = os.path.join(str(directory), os.path.basename(path) + suffix)
+   if suffix == '.gz':
+      open_compressed = gzip.open
+   elif suffix == '.bz2':
+      open_compressed = bz2.BZ2File
+   else:
+      lzma = pytest.importorskip('lzma')
+      open_compressed = lzma.open
+   with open(path, 'rb') as f, open_compressed(compressed_path, 'wb') as compressed:
+      shutil.copyfileobj(f, compressed)
+   return compressed_path
+
+
+def test_iter_stanzas_joins_continuation_lines():
+   stanzas = list(apt_index.iter_stanzas(PACKAGES_PATH))
+
+   assert [stanza['Package'] for stanza in stanzas] == [
+      'answer', 'answer', 'answer', 'libanswer1', 'orphan']
+   assert stanzas[0]['Description'] == (
+      'answers questions\nAnswers every question asked of it,\n.\nwhatever the question.')
+   assert stanzas[3] == {'Package': 'libanswer1', 'Version': '1:0.9-2',
+                         'Source': 'answer-lib',
+                         'Maintainer': 'Somebody <somebody@example.com>'}
+
+
+def test_lookup():
+   index = apt_index.AptIndex.load([PACKAGES_PATH], [SOURCES_PATH])
+
+   assert len(index) == 3
+   # The binNMU is the highest version, its source version is named in its Source.
+   assert index.lookup('answer') == {
+      'version': '1.0-1+b1',
+      'maintainer': 'Nobody <nobody@example.com>',
+      'source_package': 'answer',
+      'source_version': '1.0-1',
+      'installed_size': 43,
+      'vcs': {'Vcs-Browser': 'https://salsa.debian.org/nobody/answer',
+              'Vcs-Git': 'https://salsa.debian.org/nobody/answer.git -b debian/latest'},
+   }
+   assert apt_index.vcs_git_url(index.lookup('answer')['vcs']) == (
+      'https://salsa.debian.org/nobody/answer.git')
+   libanswer = index.lookup('libanswer1')
+   assert (libanswer['source_package'], libanswer['source_version']) == (
+      'answer-lib', '1:0.9-2')
+   assert apt_index.vcs_git_url(libanswer['vcs']) == 'https://github.com/somebody/answer-lib'
+   orphan = index.lookup('orphan')
+   assert (orphan['source_package'], orphan['source_version']) == ('orphan', '2.0')
+   assert (orphan['installed_size'], orphan['vcs']) == (None, {})
+   assert 'missing' not in index
+   assert index.lookup('missing') is None
+
+
+@pytest.mark.parametrize('suffix', ['.gz', '.bz2', '.xz'])
+def test_lookup_compressed(tmp_path, suffix):
+   index = apt_index.AptIndex.load([_compress(PACKAGES_PATH, tmp_path, suffix)],
+                                   [_compress(SOURCES_PATH, tmp_path, suffix)])
+
+   assert index.lookup('answer') == apt_index.AptIndex.load(
+      [PACKAGES_PATH], [SOURCES_PATH]).lookup('answer')
+
+
+def test_compare_versions():
+   assert apt_index.compare_versions('1.0-1+b1', '1.0-1') > 0
+   assert apt_index.compare_versions('1.0~rc1-1', '1.0-1') < 0
+   assert apt_index.compare_versions('1:0.9-2', '2.0') > 0
+   assert apt_index.compare_versions('1.0-1', '1.0-1') == 0
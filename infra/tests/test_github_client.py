@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('requests')
+
+try:
+   from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+   from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+import github_client
+
+
+class StandInApi:
+   """
+   Stand-in for the GitHub API on a free local port in a background thread,
+   answering GET requests with handle(path, request_headers) -> (status, headers,
+   body) and recording the requests' headers.
+   """
+
+   def __init__(self, handle):
+      self.requests = []
+      api = self
+
+      class Handler(BaseHTTPRequestHandler):
+         protocol_version = 'HTTP/1.1'
+
+         def do_GET(self):
+            api.requests.append(dict(self.headers))
+            status, headers, body = handle(self.path, self.headers)
+            body = json.dumps(body).encode('utf-8') if body is not None else b''
+            self.send_response(status)
+            for name, value in headers.items():
+               self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+         def log_message(self, *args):
+            pass
+
+      self._httpd = HTTPServer(('127.0.0.1', 0), Handler)
+      self.url = 'http://127.0.0.1:%d' % self._httpd.server_address[1]
+      self._thread = threading.Thread(target=self._httpd.serve_forever)
+      self._thread.daemon = True
+      self._thread.start()
+
+   def close(self):
+      self._httpd.shutdown()
+      self._httpd.server_close()
+
+
+def test_rate_limited_request_waits_for_reset(monkeypatch):
+   monkeypatch.setattr(github_client, 'RESET_MARGIN', 0.2)
+   limited = [True]
+
+   def handle(path, headers):
+      if limited[0]:
+         limited[0] = False
+         return 403, {'X-RateLimit-Remaining': '0',
+                      'X-RateLimit-Reset': '%d' % time.time()}, {'message': 'rate limited'}
+      return 200, {'X-RateLimit-Remaining': '4999',
+                   'X-RateLimit-Reset': '%d' % (time.time() + 3600)}, {'full_name': 'a/b'}
+
+   api = StandInApi(handle)
+   client = github_client.GitHubClient(api.url, workers=1)
+   try:
+      start = time.time()
+      assert client.get_json('/repos/a/b') == {'full_name': 'a/b'}
+      assert time.time() - start >= 0.2
+      assert len(api.requests) == 2
+   finally:
+      client.close()
+      api.close()
+
+
+def test_rate_limited_request_gives_up(monkeypatch):
+   monkeypatch.setattr(github_client, 'MAX_ATTEMPTS', 2)
+   api = StandInApi(lambda path, headers: (429, {'Retry-After': '0'}, None))
+   client = github_client.GitHubClient(api.url, workers=1)
+   try:
+      with pytest.raises(github_client.GitHubError):
+         client.get_json('/repos/a/b')
+      assert len(api.requests) == 2
+   finally:
+      client.close()
+      api.close()
+
+
+def test_unchanged_response_is_read_from_cache(tmp_path):
+   etag = '"abc"'
+
+   def handle(path, headers):
+      if headers.get('If-None-Match') == etag:
+         return 304, {'ETag': etag}, None
+      return 200, {'ETag': etag}, {'full_name': 'a/b'}
+
+   api = StandInApi(handle)
+   cache_path = str(tmp_path / 'cache.sqlite')
+   try:
+      for _ in range(2):
+         # A fresh client each time, as the cache persists across runs.
+         client = github_client.GitHubClient(api.url, cache_path=cache_path, workers=1)
+         try:
+            assert client.get_json('/repos/a/b') == {'full_name': 'a/b'}
+         finally:
+            client.close()
+      assert 'If-None-Match' not in api.requests[0]
+      assert api.requests[1]['If-None-Match'] == etag
+   finally:
+      api.close()
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import results_analyzer
+
+
+def _result(rank, detected):
+   return {
+      'rank': str(rank),
+      'creation_date': '2015-06-01',
+      'detection_tool_output': {'unique_ptr': {'detected': detected}},
+   }
+
+
+RESULTS = [_result(rank, detected) for rank, detected in [
+   (1, 'yes'), (100, 'no'), (101, 'yes'), (30000, 'yes'), (30001, 'no'), (45000, 'no')]]
+
+
+def test_ranks_past_last_bucket_are_counted():
+   analyzer = results_analyzer.DetectionAnalyzer(RESULTS)
+
+   assert analyzer.group_by([results_analyzer.RANK_BUCKET]) == {
+      (100,): 2, (1000,): 1, (30000,): 1, (None,): 2}
+   analyzed_results = analyzer.run()
+   assert list(analyzed_results) == [100, 1000, 30000, None]
+   assert analyzed_results[None] == {'unique_ptr': {'detected': {'no': 2}}}
+   assert analyzed_results[100] == {'unique_ptr': {'detected': {'no': 1, 'yes': 1}}}
+   # As the original analyzer's, the overflow bucket is null.
+   assert '"null"' in json.dumps(analyzed_results)
+
+
+def test_iter_results_reads_json_array_and_lines(tmp_path):
+   array_path = tmp_path / 'results.json'
+   array_path.write_text(json.dumps(RESULTS, indent=4))
+   lines_path = tmp_path / 'results.jsonl'
+   lines_path.write_text(''.join(json.dumps(result) + '\n' for result in RESULTS))
+
+   assert list(results_analyzer.iter_results(str(array_path))) == RESULTS
+   assert list(results_analyzer.iter_results(str(lines_path))) == RESULTS
+
+
+def _hardening_result(rank, stack_protector):
+   return {'rank': str(rank), 'detection_tool_output': {'stack-protector': stack_protector}}
+
+
+def test_mixed_string_and_dict_feature():
+   analyzer = results_analyzer.DetectionAnalyzer([
+      _hardening_result(1, 'yes'),
+      _hardening_result(2, {'all': 'no', 'any': 'yes', 'fraction': 0.5,
+                            'objects': {'usr/bin/a': 'yes', 'usr/bin/b': 'no, not found!'}}),
+      _hardening_result(3, {'all': 'yes', 'any': 'yes', 'fraction': 1.0,
+                            'objects': {'usr/bin/c': 'yes'}}),
+      _hardening_result(4, {'all': 'no', 'any': 'no', 'fraction': None,
+                            'objects': {}}),
+   ])
+
+   # The per-object results aren't columns, the fraction is a numeric one.
+   assert analyzer.feature_columns() == [
+      'stack-protector', 'stack-protector.all', 'stack-protector.any',
+      'stack-protector.fraction']
+   assert analyzer.group_by(['stack-protector.fraction']) == {(0.5,): 1, (1.0,): 1}
+   assert analyzer.group_by([results_analyzer.RANK_BUCKET], 'stack-protector.fraction') == {
+      (100,): 1.5}
+   assert analyzer.run() == {100: {
+      'stack-protector': {'yes': 1},
+      'stack-protector.all': {'no': 2, 'yes': 1},
+      'stack-protector.any': {'no': 1, 'yes': 2},
+      'stack-protector.fraction': {0.5: 1, 1.0: 1},
+   }}
@@ -0,0 +1,68 @@
+import errno
+import json
+
+import pytest
+
+import results_stream
+
+
+def _result(rank):
+   return {'package_name': 'package%s' % rank, 'version_number': '1.0', 'rank': rank}
+
+
+def test_iter_results_sorts_ranks_as_numbers(tmp_path):
+   path = str(tmp_path / 'results.jsonl')
+   stream = results_stream.ResultsStream(path)
+   for rank in ['335', '22', '163', '43']:
+      stream.write(_result(rank))
+   stream.close()
+
+   assert [result['rank'] for result in results_stream.iter_results(path)] == [
+      '22', '43', '163', '335']
+
+
+def test_write_json_array_matches_json_dump(tmp_path):
+   results = [_result(rank) for rank in ['22', '43', '163']]
+   path = str(tmp_path / 'results.json')
+   results_stream.write_json_array(iter(results), path)
+
+   with open(path) as f:
+      assert f.read() == json.dumps(results, indent=4) + '\n'
+
+
+def test_resume_drops_partial_line(tmp_path):
+   path = str(tmp_path / 'results.jsonl')
+   stream = results_stream.ResultsStream(path)
+   stream.write(_result('22'))
+   stream.close()
+   with open(path, 'a') as f:
+      f.write('{"package_name": "trunc')
+
+   stream = results_stream.ResultsStream(path, resume=True)
+   stream.write(_result('3'))
+   stream.close()
+   assert [result['rank'] for result in results_stream.iter_results(path)] == ['3', '22']
+   assert results_stream.completed_keys(path) == set(['package22=1.0', 'package3=1.0'])
+
+
+def test_existing_results_are_not_overwritten(tmp_path):
+   path = str(tmp_path / 'results.jsonl')
+   stream = results_stream.ResultsStream(path)
+   stream.write(_result('22'))
+   stream.close()
+
+   with pytest.raises(IOError) as e:
+      results_stream.ResultsStream(path)
+   assert e.value.errno == errno.EEXIST
+   assert [result['rank'] for result in results_stream.iter_results(path)] == ['22']
+
+   stream = results_stream.ResultsStream(path, overwrite=True)
+   stream.write(_result('43'))
+   stream.close()
+   assert [result['rank'] for result in results_stream.iter_results(path)] == ['43']
+
+
+def test_empty_results_file_is_replaced(tmp_path):
+   path = tmp_path / 'results.jsonl'
+   path.write_text('')
+   results_stream.ResultsStream(str(path)).close()
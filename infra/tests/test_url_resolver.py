@@ -0,0 +1,112 @@
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('requests')
+
+try:
+   from http.server import BaseHTTPRequestHandler, HTTPServer
+   from socketserver import ThreadingMixIn
+except ImportError:
+   from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+   from SocketServer import ThreadingMixIn
+
+import url_resolver
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+   daemon_threads = True
+
+
+class Server:
+   """
+   HTTP server on a free local port in a background thread, answering HEAD requests
+   with handle(path) -> (status, headers) and recording the paths requested.
+   """
+
+   def __init__(self, handle):
+      self.paths = []
+      server = self
+
+      class Handler(BaseHTTPRequestHandler):
+         def do_HEAD(self):
+            server.paths.append(self.path)
+            status, headers = handle(self.path)
+            self.send_response(status)
+            for name, value in headers.items():
+               self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+         def log_message(self, *args):
+            pass
+
+      self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+      self.url = 'http://127.0.0.1:%d' % self._httpd.server_address[1]
+      self._thread = threading.Thread(target=self._httpd.serve_forever)
+      self._thread.daemon = True
+      self._thread.start()
+
+   def close(self):
+      self._httpd.shutdown()
+      self._httpd.server_close()
+
+
+@pytest.fixture
+def resolver():
+   resolver = url_resolver.UrlResolver(workers=2)
+   yield resolver
+   resolver.close()
+
+
+def _closed_port_url():
+   sock = socket.socket()
+   sock.bind(('127.0.0.1', 0))
+   port = sock.getsockname()[1]
+   sock.close()
+   return 'http://127.0.0.1:%d' % port
+
+
+def test_moved_host_urls_are_still_requested(resolver):
+   new = Server(lambda path: (200, {}) if path == '/repo' else (404, {}))
+   old = Server(lambda path: (301, {'Location': new.url + path}))
+   try:
+      assert resolver._resolve(old.url + '/repo') == new.url + '/repo'
+      # Rewritten to the new host, skipping the old one, where it's gone.
+      assert resolver._resolve(old.url + '/gone') is None
+      assert old.paths == ['/repo']
+      assert new.paths == ['/repo', '/gone']
+   finally:
+      old.close()
+      new.close()
+
+
+def test_host_is_dead_after_consecutive_connection_failures(resolver):
+   url = _closed_port_url()
+   for i in range(url_resolver.DEAD_HOST_FAILURES - 1):
+      assert resolver._resolve('%s/repo%d' % (url, i)) is None
+   assert not resolver._dead_hosts
+   assert resolver._resolve(url + '/last') is None
+   assert resolver._dead_hosts == set([('http', url[len('http://'):])])
+
+
+def test_timeout_does_not_kill_host(resolver, monkeypatch):
+   monkeypatch.setattr(url_resolver, 'REQUEST_TIMEOUT', 0.2)
+   slow = [True]
+
+   def handle(path):
+      if slow[0]:
+         time.sleep(0.5)
+      return 200, {}
+
+   server = Server(handle)
+   try:
+      for i in range(url_resolver.DEAD_HOST_FAILURES):
+         assert resolver._resolve(server.url + '/repo') is None
+      assert not resolver._dead_hosts
+      slow[0] = False
+      assert resolver._resolve(server.url + '/repo') == server.url + '/repo'
+   finally:
+      server.close()